@@ -1,19 +1,45 @@
+import asyncio
+import gzip
+import json
 import os
 import shutil
+import tempfile
+import threading
 import uuid
-from typing import List, Optional
-from fastapi import APIRouter, UploadFile, File, HTTPException, Header, BackgroundTasks
+import zlib
+from typing import List, Literal, Optional
+from fastapi import APIRouter, UploadFile, File, HTTPException, Header, Request
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
+from fastapi.responses import FileResponse, Response, StreamingResponse
 
 from app.services.ingestion import IngestionService
+from app.services.jobs import IngestionJobManager
 from app.services.rag_agent import TestGenAgent
 from app.services.selenium_agent import SeleniumAgent
+from app.services.providers import get_providers
+from app.services.limiter import Overloaded
+from app.services.retrieval import RetrievalTimeout
+from app.services.artifacts import describe_files, page_artifacts, text_artifact_path
+from app.services.parsing import get_parser_pool
+from app.services.plan_parser import parse_test_plan
+from app.services.selector_validation import validate_scripts
+from app.services.projects import attach_project, check_project_name, describe_project, list_projects, project_exists, project_upload_dir
+from app.services.session_manifest import attached_project, is_project_key, project_key
+from app.services.session_registry import session_registry
+from app.services.state_store import get_state_store, shared_state
+from app.services.cleanup import SessionReaper
 from app.core.config import settings
 from app.core.logger import get_logger
+from app.core.tracing import bind_request, stage, trace
 
 router = APIRouter()
+# Disable proxy buffering so tokens reach the browser as they are produced.
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
 logger = get_logger("api_routes")
 
 ingestion_service = IngestionService()
+ingestion_jobs = IngestionJobManager(store=get_state_store() if shared_state() else None)
+session_reaper = SessionReaper(session_registry, ingestion_service)
 # selenium_agent = SeleniumAgent() 
 
 from pydantic import BaseModel
@@ -21,94 +47,490 @@ from pydantic import BaseModel
 class TestGenerationRequest(BaseModel):
     query: str
     session_id: str
+    retrieval_mode: Optional[Literal["hybrid", "dense", "lexical"]] = None
 
 class ScriptGenerationRequest(BaseModel):
     test_case: str
     session_id: str 
+    retrieval_mode: Optional[Literal["hybrid", "dense", "lexical"]] = None
+    # An ingested HTML file name; defaults to the most recently ingested page.
+    target_page: Optional[str] = None
+    # Send locators that miss or match several elements back to the model once.
+    repair: bool = False
+
+class BatchScriptRequest(BaseModel):
+    session_id: str
+    plan: Optional[str] = None
+    cases: Optional[List[str]] = None
+    concurrency: int = 4
+    retrieval_mode: Optional[Literal["hybrid", "dense", "lexical"]] = None
+    target_page: Optional[str] = None
+    repair: bool = False
+
+class SessionStartRequest(BaseModel):
+    # Omitted: the default project, if one is ingested.
+    project: Optional[str] = None
+
+class ProjectAttachRequest(BaseModel):
+    # None detaches.
+    project: Optional[str] = None
+
+class ScriptValidationRequest(BaseModel):
+    session_id: str
+    scripts: List[str]
+    target_page: Optional[str] = None
+
+class ClientDisconnected(Exception):
+    pass
+
+def _track_session(session_id: str):
+    if is_project_key(session_id):
+        raise HTTPException(status_code=400, detail="Project knowledge bases are managed under /projects.")
+    session_registry.touch(session_id)
+    bind_request(session_id=session_id)
+
+async def _agent(cls, session_id: str, retrieval_mode: str = None):
+    """Builds an agent off the event loop: opening the retriever reads manifests and may call the Chroma server."""
+    providers = get_providers()
+    return await run_in_threadpool(cls, session_id=session_id, providers=providers, retrieval_mode=retrieval_mode)
+
+async def _unless_disconnected(http_request: Request, coro):
+    """Awaits `coro`, cancelling it (and its provider calls) if the client goes away first."""
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=settings.DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
+
+async def _while_connected(http_request: Request, events, stop: threading.Event, session_id: str):
+    """
+    Iterates a sync event generator in the threadpool, checking for a client
+    disconnect while each event is produced. When the client goes away (or
+    Starlette cancels the response) `stop` is set, so the generator starts
+    no further work; the thread still inside it returns on its own.
+    """
+    try:
+        while True:
+            step = asyncio.ensure_future(run_in_threadpool(next, events, None))
+            while True:
+                done, _ = await asyncio.wait({step}, timeout=settings.DISCONNECT_POLL_SECONDS)
+                if done:
+                    break
+                if await http_request.is_disconnected():
+                    logger.info(f"Session {session_id}: Client went away, stopping the batch")
+                    return
+            event = step.result()
+            if event is None:
+                return
+            yield event
+    finally:
+        stop.set()
+
+def _overloaded(e: Overloaded) -> HTTPException:
+    return HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def _llm_timeout() -> HTTPException:
+    return HTTPException(status_code=504, detail=f"The model did not answer within {settings.LLM_TIMEOUT_SECONDS:g}s.")
+
+async def _provider_slot():
+    """A provider slot for a streaming response, taken before the response starts so saturation is a 429/503."""
+    try:
+        return await get_providers().limiter.enter()
+    except Overloaded as e:
+        raise _overloaded(e)
+
+async def _holding(release, events):
+    """
+    Iterates a sync event generator in the threadpool, giving the slot back
+    when the stream ends. On a client disconnect Starlette cancels this
+    wrapper, but never closes the sync generator itself.
+    """
+    try:
+        async for event in iterate_in_threadpool(events):
+            yield event
+    finally:
+        release()
 
 @router.get("/health")
 async def health_check():
-    return {"status": "operational", "version": "2.0"}
+    return {"status": "operational", "version": "2.0", "warm": get_providers().is_warm}
+
+@router.get("/stats")
+async def service_stats():
+    stats = get_providers().stats()
+    stats["sessions"] = session_reaper.stats()
+    pool = get_parser_pool()
+    stats["parsers"] = pool.stats() if pool else {"workers": 0}
+    stats["page_artifacts"] = page_artifacts.stats()
+    return stats
+
+def _attach(session_id: str, project: Optional[str]):
+    try:
+        attach_project(session_id, project)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
 @router.post("/session/start")
-async def start_session():
+async def start_session(request: Optional[SessionStartRequest] = None):
+    """Starts a session, attached to a project knowledge base so it can generate before any upload."""
+    project = request.project if request else None
+    if project is None and settings.DEFAULT_PROJECT and project_exists(settings.DEFAULT_PROJECT):
+        project = settings.DEFAULT_PROJECT
     new_id = str(uuid.uuid4())
-    logger.info(f"New session started: {new_id}")
-    return {"session_id": new_id}
+    if project:
+        _attach(new_id, project)
+    _track_session(new_id)
+    logger.info(f"New session started: {new_id}" + (f" on project {project}" if project else ""))
+    return {"session_id": new_id, "project": project or None}
+
+@router.put("/session/{session_id}/project")
+async def set_session_project(session_id: str, request: ProjectAttachRequest):
+    """Attaches (or with null, detaches) a project; the session's own uploads stay layered on top."""
+    _track_session(session_id)
+    _attach(session_id, request.project)
+    return {"session_id": session_id, "project": request.project}
+
+def _save_upload(file: UploadFile, file_path: str) -> str:
+    """
+    Writes one upload part next to `file_path`, inflating it when the client
+    gzipped it, and returns the temporary path. Nothing replaces the
+    session's current copy until every part of the request is saved.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), prefix=f".{os.path.basename(file_path)}.", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            if (file.headers.get("content-encoding") or "").lower() != "gzip":
+                shutil.copyfileobj(file.file, buffer)
+                return temp_path
+            limit = settings.UPLOAD_MAX_INFLATED_MB * 1024 * 1024
+            written = 0
+            with gzip.GzipFile(fileobj=file.file, mode="rb") as source:
+                while True:
+                    block = source.read(1024 * 1024)
+                    if not block:
+                        break
+                    written += len(block)
+                    if written > limit:
+                        raise HTTPException(
+                            status_code=413,
+                            detail=f"{file.filename} inflates past {settings.UPLOAD_MAX_INFLATED_MB} MB."
+                        )
+                    buffer.write(block)
+        return temp_path
+    except BaseException:
+        # A bad or oversized gzip part must not be left behind half-written.
+        os.remove(temp_path)
+        raise
+
+def _save_uploads(upload_dir: str, files: List[UploadFile]) -> List[str]:
+    """Saves every part, then moves them into place; a failure leaves the previous copies untouched."""
+    os.makedirs(upload_dir, exist_ok=True)
+    staged = []
+    try:
+        for file in files:
+            file_path = os.path.join(upload_dir, file.filename)
+            staged.append((_save_upload(file, file_path), file_path))
+    except BaseException:
+        for temp_path, _ in staged:
+            os.remove(temp_path)
+        raise
+    for temp_path, file_path in staged:
+        os.replace(temp_path, file_path)
+    return [file_path for _, file_path in staged]
+
+async def _submit_uploads(owner_id: str, upload_dir: str, files: List[UploadFile]):
+    """Saves the uploads (off the event loop: gzip parts can inflate to 200 MB) and queues ingestion."""
+    try:
+        saved_paths = await run_in_threadpool(_save_uploads, upload_dir, files)
+        job = ingestion_jobs.submit(owner_id, saved_paths, ingestion_service.process_documents)
+        
+        return {"status": "accepted", "job_id": job.job_id, "message": "Ingestion started."}
+    except HTTPException:
+        raise
+    except (gzip.BadGzipFile, EOFError, zlib.error) as e:
+        logger.warning(f"Session {owner_id}: Unreadable upload: {e}")
+        raise HTTPException(status_code=400, detail=f"Unreadable upload: {e}")
+    except Exception as e:
+        logger.error(f"Ingestion failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/ingest")
+@router.post("/ingest", status_code=202)
 async def ingest_documents(
-    background_tasks: BackgroundTasks,
     files: List[UploadFile] = File(...),
     session_id: str = Header(None)
 ):
+    """
+    Saves the uploads and queues the ingestion pipeline on the worker pool.
+    Poll GET /ingest/{job_id} for per-stage progress.
+    """
     if not session_id:
         raise HTTPException(status_code=400, detail="Session-ID header required")
+    _track_session(session_id)
+    return await _submit_uploads(session_id, os.path.join(settings.UPLOAD_DIR, session_id), files)
 
-    session_upload_dir = os.path.join(settings.UPLOAD_DIR, session_id)
-    os.makedirs(session_upload_dir, exist_ok=True)
-    
-    saved_paths = []
+def _project_name(name: str) -> str:
     try:
-        for file in files:
-            file_path = os.path.join(session_upload_dir, file.filename)
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            saved_paths.append(file_path)
-        
-        result = ingestion_service.process_documents(session_id, saved_paths)
-        
-        return result
-    except Exception as e:
-        logger.error(f"Ingestion failed: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        return check_project_name(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/projects")
+async def projects():
+    """Project knowledge bases sessions can attach."""
+    return {"projects": list_projects()}
+
+@router.get("/projects/{name}")
+async def project_details(name: str):
+    if not project_exists(_project_name(name)):
+        raise HTTPException(status_code=404, detail=f"Unknown project '{name}'.")
+    project = describe_project(name)
+    project["documents"] = describe_files(project_key(name))
+    return project
+
+@router.post("/projects/{name}/ingest", status_code=202)
+async def ingest_project_documents(name: str, files: List[UploadFile] = File(...)):
+    """
+    Adds or replaces documents of a project (creating it), embedded once for
+    every session attached to it. Poll GET /ingest/{job_id} as for sessions.
+    """
+    return await _submit_uploads(project_key(_project_name(name)), project_upload_dir(name), files)
+
+@router.get("/ingest/{job_id}")
+async def ingestion_status(job_id: str):
+    job = ingestion_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Unknown ingestion job")
+    if not is_project_key(job.session_id):
+        _track_session(job.session_id)
+    return job.to_dict()
+
+@router.get("/session/{session_id}/files")
+async def session_files(session_id: str):
+    """The session's file manifest: type, size, sha256, parse status and artifacts of every ingested file."""
+    _track_session(session_id)
+    return {"session_id": session_id, "files": describe_files(session_id)}
+
+@router.get("/session/{session_id}/files/{filename}/text")
+async def session_file_text(session_id: str, filename: str):
+    """Text extracted from one ingested file."""
+    _track_session(session_id)
+    path = text_artifact_path(session_id, filename)
+    project = attached_project(session_id)
+    if not os.path.exists(path) and project:
+        path = text_artifact_path(project_key(project), filename)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail=f"No extracted text for '{filename}' in this session.")
+    return FileResponse(path, media_type="text/plain; charset=utf-8")
+
+@router.post("/validate-scripts")
+async def validate_scripts_route(request: ScriptValidationRequest):
+    """
+    Checks the locators of existing scripts against a session page's DOM
+    index, in parallel and without a browser. Results keep the input order.
+    """
+    _track_session(request.session_id)
+    if len(request.scripts) > settings.SELECTOR_VALIDATION_MAX_SCRIPTS:
+        raise HTTPException(status_code=400, detail=f"Validation is limited to {settings.SELECTOR_VALIDATION_MAX_SCRIPTS} scripts.")
+    page = await run_in_threadpool(_session_page, request.session_id, request.target_page)
+    with trace("validate_scripts", request.session_id) as t:
+        t.set(scripts=len(request.scripts), page=page.filename)
+        with stage("selector_validation"):
+            reports = await run_in_threadpool(validate_scripts, request.scripts, page.dom_index)
+    return {
+        "page": page.filename,
+        "valid": sum(r["valid"] for r in reports),
+        "invalid": sum(not r["valid"] for r in reports),
+        "results": reports,
+    }
+
+@router.get("/session/{session_id}/dom-report")
+def dom_report(session_id: str):
+    """Token-reduction report of the selector index for every HTML page in the session. Sync: FastAPI runs it in the threadpool."""
+    _track_session(session_id)
+    reports = {}
+    for _, filename in page_artifacts.pages(session_id):
+        try:
+            reports[filename] = page_artifacts.get(session_id, filename).dom_index.token_report()
+        except LookupError as e:
+            logger.warning(f"Session {session_id}: {e}")
+    if not reports:
+        raise HTTPException(status_code=404, detail="No HTML pages found for this session.")
+    return {"session_id": session_id, "pages": reports}
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _session_page(session_id: str, target_page: str = None):
+    """The preparsed HTML page to script against, from the session's manifest and artifact cache."""
+    try:
+        page = page_artifacts.get(session_id, target_page)
+    except LookupError as e:
+        logger.warning(f"Session {session_id}: {e}")
+        raise HTTPException(status_code=404, detail=str(e))
+    logger.info(f"Session {session_id}: HTML target -> {page.filename}")
+    return page
 
 @router.post("/generate-tests")
-async def generate_tests(request: TestGenerationRequest):
+async def generate_tests(request: TestGenerationRequest, http_request: Request):
+    _track_session(request.session_id)
     try:
-        agent = TestGenAgent(session_id=request.session_id)
-        result = agent.generate_tests(request.query)
+        agent = await _agent(TestGenAgent, request.session_id, request.retrieval_mode)
+        result = await _unless_disconnected(http_request, agent.agenerate_tests(request.query))
         return {"result": result}
+    except Overloaded as e:
+        raise _overloaded(e)
+    except RetrievalTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except asyncio.TimeoutError:
+        raise _llm_timeout()
+    except ClientDisconnected:
+        logger.info(f"Session {request.session_id}: Client went away, test generation cancelled")
+        return Response(status_code=499)
     except Exception as e:
         logger.error(f"Test Gen Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/generate-tests/stream")
+async def stream_tests(request: TestGenerationRequest):
+    """Server-sent events: `token` events as the plan is written, then `done` or `error`."""
+    _track_session(request.session_id)
+    agent = await _agent(TestGenAgent, request.session_id, request.retrieval_mode)
+    release = await _provider_slot()
+
+    # A sync generator, iterated in the threadpool off the event loop.
+    def events():
+        try:
+            for token in agent.stream_tests(request.query):
+                yield _sse("token", {"text": token})
+            yield _sse("done", {})
+        except Exception as e:
+            logger.error(f"Test Gen Stream Error: {e}")
+            yield _sse("error", {"detail": str(e)})
+
+    return StreamingResponse(_holding(release, events()), media_type="text/event-stream", headers=SSE_HEADERS)
+
 @router.post("/generate-script")
-async def generate_script(request: ScriptGenerationRequest):
+async def generate_script(request: ScriptGenerationRequest, http_request: Request):
     """
     Phase 3: RAG-Enhanced Selenium Agent
-    1. LOCATE the HTML file uploaded by THIS specific user (Session ID).
+    1. LOCATE the HTML page uploaded by THIS specific user (Session ID), by
+       `target_page` or the most recently ingested one, preparsed at ingest.
     2. Initialize the Agent with the Session ID (to access the Vector DB for rules).
     3. Generate the script using the User's HTML + User's Rules.
     """
+    _track_session(request.session_id)
     try:
-        session_upload_dir = os.path.join(settings.UPLOAD_DIR, request.session_id)
-        html_content = None
-        html_filename = "checkout.html"
-        
-        if os.path.exists(session_upload_dir):
-            for file in os.listdir(session_upload_dir):
-                if file.lower().endswith(".html"):
-                    found_path = os.path.join(session_upload_dir, file)
-                    logger.info(f"Session {request.session_id}: Found HTML target -> {file}")
-                    
-                    with open(found_path, "r", encoding="utf-8") as f:
-                        html_content = f.read()
-                    break
+        with trace("generate_script", request.session_id):
+            with stage("load_page"):
+                page = await run_in_threadpool(_session_page, request.session_id, request.target_page)
 
-        if not html_content:
-            msg = "No HTML file found for this session. Please go to Tab 1 and upload your target HTML file."
-            logger.warning(f"Session {request.session_id}: {msg}")
-            raise HTTPException(status_code=404, detail=msg)
-            
-        agent = SeleniumAgent(session_id=request.session_id)
+            agent = await _agent(SeleniumAgent, request.session_id, request.retrieval_mode)
 
-        script = agent.generate_script(request.test_case, html_content)
+            script = await _unless_disconnected(http_request, agent.agenerate_script(request.test_case, page))
+            script, selector_report = await _unless_disconnected(
+                http_request, agent.acheck_script(request.test_case, script, page, request.repair)
+            )
         
-        return {"script": script}
+        return {
+            "script": script,
+            "page": page.filename,
+            "dom_report": page.dom_index.token_report(request.test_case),
+            "selector_report": selector_report,
+        }
         
     except HTTPException as he:
         raise he
+    except Overloaded as e:
+        raise _overloaded(e)
+    except RetrievalTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except asyncio.TimeoutError:
+        raise _llm_timeout()
+    except ClientDisconnected:
+        logger.info(f"Session {request.session_id}: Client went away, script generation cancelled")
+        return Response(status_code=499)
     except Exception as e:
         logger.error(f"Script Gen Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/generate-script/stream")
+async def stream_script(request: ScriptGenerationRequest):
+    """Server-sent events: `token` events as the script is written, then `done` or `error`."""
+    _track_session(request.session_id)
+    page = await run_in_threadpool(_session_page, request.session_id, request.target_page)
+    agent = await _agent(SeleniumAgent, request.session_id, request.retrieval_mode)
+    release = await _provider_slot()
+
+    def events():
+        try:
+            tokens = []
+            for token in agent.stream_script(request.test_case, page):
+                tokens.append(token)
+                yield _sse("token", {"text": token})
+            streamed = "".join(tokens)
+            # Repairs run on the slot this stream already holds.
+            script, selector_report = agent.check_script(request.test_case, streamed, page, request.repair, hold_slot=True)
+            done = {
+                "page": page.filename,
+                "dom_report": page.dom_index.token_report(request.test_case),
+                "selector_report": selector_report,
+            }
+            if script != streamed:
+                done["script"] = script
+            yield _sse("done", done)
+        except Exception as e:
+            logger.error(f"Script Gen Stream Error: {e}")
+            yield _sse("error", {"detail": str(e)})
+
+    return StreamingResponse(_holding(release, events()), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.post("/generate-scripts/batch")
+async def generate_scripts_batch(request: BatchScriptRequest, http_request: Request):
+    """
+    Turns a whole test plan (the markdown table from /generate-tests, or a list
+    of cases) into scripts. Streams `start`, one `case` event per finished script, then `done`.
+    """
+    _track_session(request.session_id)
+    if request.cases:
+        cases = [{"scenario": c, "test_case": c} for c in request.cases if c.strip()]
+    else:
+        cases = parse_test_plan(request.plan or "")
+
+    if not cases:
+        raise HTTPException(status_code=400, detail="No test cases found in the request.")
+    if len(cases) > settings.BATCH_MAX_CASES:
+        raise HTTPException(status_code=400, detail=f"Batch is limited to {settings.BATCH_MAX_CASES} cases.")
+
+    page = await run_in_threadpool(_session_page, request.session_id, request.target_page)
+    agent = await _agent(SeleniumAgent, request.session_id, request.retrieval_mode)
+    concurrency = max(1, min(request.concurrency, settings.BATCH_MAX_CONCURRENCY))
+    # Each case takes its own slot as it runs. Getting one here first turns a
+    # saturated server into a 429/503 the client can retry, instead of a 200
+    # stream of failed cases.
+    (await _provider_slot())()
+
+    stop = threading.Event()
+
+    def events():
+        succeeded = failed = 0
+        yield _sse("start", {"total": len(cases), "concurrency": concurrency, "page": page.filename})
+        for result in agent.generate_scripts(cases, page, concurrency, request.repair, stop=stop):
+            if result["status"] == "ok":
+                succeeded += 1
+            else:
+                failed += 1
+            yield _sse("case", result)
+        yield _sse("done", {"total": len(cases), "succeeded": succeeded, "failed": failed})
+
+    return StreamingResponse(
+        _while_connected(http_request, events(), stop, request.session_id),
+        media_type="text/event-stream", headers=SSE_HEADERS
+    )
@@ -15,8 +15,131 @@ class Settings(BaseSettings):
     ASSETS_DIR: str = os.path.join(BASE_DIR, "../assets")
     UPLOAD_DIR: str = os.path.join(BASE_DIR, "uploads")
     VECTOR_DB_PATH: str = os.path.join(BASE_DIR, "vector_store_data")
+    MANIFEST_DIR: str = os.path.join(VECTOR_DB_PATH, "manifests")
+    LEXICAL_INDEX_DIR: str = os.path.join(VECTOR_DB_PATH, "lexical")
+    # Per-file parse results (extracted text) recorded in the session manifest.
+    ARTIFACT_DIR: str = os.path.join(VECTOR_DB_PATH, "artifacts")
+    CACHE_DIR: str = os.path.join(BASE_DIR, "cache")
+
+    # "text" for humans, "json" for one structured object per line (log shippers).
+    LOG_FORMAT: str = "text"
+
+    # Build model clients and import loaders right after startup instead of on the first request.
+    WARM_UP_ON_STARTUP: bool = True
 
     SESSION_TIMEOUT_MINUTES: int = 60
+    # Upload parts sent with Content-Encoding: gzip are inflated on save, up to this size each.
+    UPLOAD_MAX_INFLATED_MB: int = 200
+    SESSION_REAPER_INTERVAL_SECONDS: int = 300
+
+    # "memory" keeps sessions, jobs and locks in this process (one worker).
+    # "sqlite" shares them through STATE_DB_PATH and lock files in LOCK_DIR,
+    # for several uvicorn workers or replicas on one data volume.
+    STATE_BACKEND: str = "memory"
+    STATE_DB_PATH: str = os.path.join(VECTOR_DB_PATH, "state.sqlite3")
+    LOCK_DIR: str = os.path.join(VECTOR_DB_PATH, "locks")
+    # Shared mode only: how often a session's last access is written back,
+    # and how often a running job's progress is published to other workers.
+    SESSION_TOUCH_INTERVAL_SECONDS: float = 30.0
+    JOB_PROGRESS_INTERVAL_SECONDS: float = 0.5
+    # Workers mark their unfinished jobs alive this often; a queued or running
+    # job not marked for JOB_STALE_SECONDS lost its worker and is failed.
+    JOB_HEARTBEAT_SECONDS: float = 10.0
+    JOB_STALE_SECONDS: float = 60.0
+
+    EMBEDDING_MODEL: str = "text-embedding-3-small"
+    LLM_TEMPERATURE: float = 0.1
+    VECTOR_STORE_CACHE_SIZE: int = 256
+
+    VECTOR_BACKEND: str = "chroma"
+    # Set to use a Chroma server instead of the embedded store (required with STATE_BACKEND=sqlite).
+    CHROMA_HOST: str | None = None
+    CHROMA_PORT: int = 8000
+    CHROMA_SSL: bool = False
+    NUMPY_VECTOR_DIR: str = os.path.join(VECTOR_DB_PATH, "numpy")
+    NUMPY_COMPACT_RATIO: float = 0.5
+    NUMPY_ANN_THRESHOLD: int = 20_000
+    NUMPY_ANN_NPROBE: int = 16
+    NUMPY_ANN_ITERATIONS: int = 5
+
+    INGEST_WORKERS: int = 2
+    # Loader processes shared by all ingests (0 parses on the ingest thread, without limits).
+    PARSE_WORKERS: int = 2
+    # Per file, counting only time spent waiting on the parser.
+    PARSE_TIMEOUT_SECONDS: float = 120.0
+    # Address space a parser may grow by past its warm size (0 disables the cap).
+    PARSE_MEMORY_LIMIT_MB: int = 2048
+    PARSE_WORKER_MAX_FILES: int = 200
+    # "structured" splits Markdown by headers, HTML by DOM sections and PDF/text
+    # by page and block, packing whole sections into chunks of up to CHUNK_SIZE
+    # characters; "recursive" is the plain character splitter for every format.
+    CHUNKING_STRATEGY: str = "structured"
+    CHUNK_SIZE: int = 1000
+    # Overlap between recursive chunks, and between the pieces of a section longer than CHUNK_SIZE.
+    CHUNK_OVERLAP: int = 200
+    SECTION_CHUNK_OVERLAP: int = 100
+    JOB_RETENTION_MINUTES: int = 60
+    EMBEDDING_PROVIDER: str = "openai"
+    EMBEDDING_BATCH_SIZE: int = 100
+    EMBEDDING_BATCH_TOKENS: int = 8000
+    EMBEDDING_CONCURRENCY: int = 4
+    EMBEDDING_MAX_RETRIES: int = 5
+    FAKE_EMBEDDING_LATENCY_MS: float = 0.0
+    FAKE_EMBEDDING_MS_PER_1K_TOKENS: float = 0.0
+
+    # "auto" picks Groq, then OpenAI, by which key is set; "fake" is the offline stand-in.
+    LLM_PROVIDER: str = "auto"
+    FAKE_LLM_LATENCY_MS: float = 0.0
+    FAKE_LLM_TOKENS_PER_SECOND: float = 0.0
+    FAKE_LLM_REPLY_TOKENS: int = 120
+
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_PATH: str = os.path.join(CACHE_DIR, "embeddings.sqlite3")
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 200_000
+
+    RETRIEVAL_MODE: str = "hybrid"
+    HYBRID_FETCH_MULTIPLIER: int = 3
+    RRF_K: int = 60
+    DENSE_RETRIEVAL_TIMEOUT_SECONDS: float = 10.0
+    LEXICAL_INDEX_CACHE_SIZE: int = 256
+
+    # Prompt assembly: candidates retrieved per prompt, then merged, diversified
+    # (MMR) and packed into per-section token budgets.
+    CONTEXT_CANDIDATES: int = 8
+    MMR_LAMBDA: float = 0.7
+    TEST_CONTEXT_TOKENS: int = 3000
+    SCRIPT_CONTEXT_TOKENS: int = 1200
+    SCRIPT_PAGE_TOKENS: int = 3000
+    TEST_CASE_TOKENS: int = 400
+    LLM_OUTPUT_RESERVE_TOKENS: int = 2048
+
+    RESPONSE_CACHE_MAX_ENTRIES: int = 1000
+    RESPONSE_CACHE_TTL_SECONDS: int = 3600
+
+    # Retrieval + LLM calls in flight per process; callers past that queue,
+    # up to PROVIDER_QUEUE_SIZE, for at most PROVIDER_QUEUE_TIMEOUT_SECONDS,
+    # and are then answered 429/503 with Retry-After.
+    PROVIDER_CONCURRENCY: int = 16
+    PROVIDER_QUEUE_SIZE: int = 64
+    PROVIDER_QUEUE_TIMEOUT_SECONDS: float = 30.0
+    LLM_TIMEOUT_SECONDS: float = 120.0
+    # How often a generate request checks whether its client went away.
+    DISCONNECT_POLL_SECONDS: float = 0.25
+
+    BATCH_MAX_CASES: int = 200
+    BATCH_MAX_CONCURRENCY: int = 8
+
+    DOM_INDEX_DIR: str = os.path.join(CACHE_DIR, "dom_index")
+    DOM_INDEX_CACHE_SIZE: int = 64
+    PAGE_ARTIFACT_CACHE_SIZE: int = 256
+    DOM_MAX_REGIONS: int = 3
+    DOM_MAX_ELEMENTS: int = 150
+
+    # Generated scripts' locators are checked against the page's DOM index, in parallel for batches.
+    SELECTOR_VALIDATION_WORKERS: int = 4
+    SELECTOR_VALIDATION_MAX_SCRIPTS: int = 1000
+    # Failing locators sent to the model in one repair request.
+    SELECTOR_REPAIR_MAX: int = 20
 
     BACKEND_ROOT: str = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
     
@@ -24,6 +147,13 @@ class Settings(BaseSettings):
     
     ASSETS_DIR: str = os.path.join(PROJECT_ROOT, "assets")
 
+    # Project knowledge base ingested from DEFAULT_PROJECT_DIR at startup (only
+    # new or changed files) and attached to sessions started without one.
+    # Only the documentation: the page under test (checkout.html) is uploaded
+    # per session as the target page, not retrieved as project knowledge.
+    DEFAULT_PROJECT: str = ""
+    DEFAULT_PROJECT_DIR: str = os.path.join(ASSETS_DIR, "documentation")
+
     class Config:
         env_file = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "../.env")
         extra = "ignore"
@@ -31,4 +161,5 @@ class Settings(BaseSettings):
 settings = Settings()
 
 os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
-os.makedirs(settings.VECTOR_DB_PATH, exist_ok=True)
\ No newline at end of file
+os.makedirs(settings.VECTOR_DB_PATH, exist_ok=True)
+os.makedirs(settings.CACHE_DIR, exist_ok=True)
\ No newline at end of file
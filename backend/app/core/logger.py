@@ -1,19 +1,51 @@
+import json
 import logging
 import sys
 
+from app.core.config import settings
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the current request/session ids and any trace fields."""
+
+    def format(self, record):
+        from app.core.tracing import request_context
+
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        context = request_context()
+        if context.get("request_id"):
+            entry["request_id"] = context["request_id"]
+        if context.get("session_id"):
+            entry["session_id"] = context["session_id"]
+        trace = getattr(record, "trace", None)
+        if trace:
+            entry.update(trace)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
 def get_logger(name: str):
     logger = logging.getLogger(name)
     logger.setLevel(logging.INFO)
-    
+
     handler = logging.StreamHandler(sys.stdout)
     handler.setLevel(logging.INFO)
-    
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
+
+    if settings.LOG_FORMAT == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        )
     handler.setFormatter(formatter)
-    
+
     if not logger.handlers:
         logger.addHandler(handler)
-        
-    return logger
\ No newline at end of file
+
+    return logger
@@ -0,0 +1,278 @@
+import contextvars
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from app.core.logger import get_logger
+
+logger = get_logger("trace")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (64, 256, 1024, 2048, 4096, 8192, 16384, 32768, 65536)
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class Histogram:
+    """Cumulative-bucket histogram rendered in the Prometheus text format."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple, buckets: tuple):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(counts), total, n) for key, (counts, total, n) in self._series.items()}
+        for key, (counts, total, n) in sorted(series.items()):
+            labels = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key))
+            prefix = f"{labels}," if labels else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {n}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {n}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple, buckets: tuple = LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+REQUEST_SECONDS = metrics.histogram(
+    "qa_agent_request_seconds", "HTTP request latency, until the last body byte is sent.",
+    ("method", "route", "status")
+)
+STAGE_SECONDS = metrics.histogram(
+    "qa_agent_stage_seconds", "Latency of one pipeline stage.", ("operation", "stage")
+)
+LLM_TOKENS = metrics.histogram(
+    "qa_agent_llm_tokens", "Prompt and completion tokens per LLM call.", ("operation", "kind"), TOKEN_BUCKETS
+)
+PAYLOAD_BYTES = metrics.histogram(
+    "qa_agent_payload_bytes", "Size of uploads, pages, prompts and completions.", ("operation", "kind"), BYTE_BUCKETS
+)
+
+# Request id / session id of whatever is running on this thread or task.
+_request = contextvars.ContextVar("qa_agent_request", default=None)
+_trace = contextvars.ContextVar("qa_agent_trace", default=None)
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def request_context() -> dict:
+    return _request.get() or {}
+
+
+def bind_request(request_id: str = None, session_id: str = None):
+    """Attaches ids to the current request; later log lines and traces pick them up."""
+    context = _request.get()
+    if context is None:
+        context = {"request_id": request_id or new_request_id(), "session_id": session_id}
+        _request.set(context)
+    else:
+        if request_id:
+            context["request_id"] = request_id
+        if session_id:
+            context["session_id"] = session_id
+    return context
+
+
+class Trace:
+    """
+    Timings and attributes of one operation (generate_tests, ingest, ...).
+    Logged as a single structured line when finished.
+    """
+
+    def __init__(self, operation: str, session_id: str = None):
+        context = request_context()
+        self.operation = operation
+        self.request_id = context.get("request_id") or new_request_id()
+        self.session_id = session_id or context.get("session_id")
+        self.stages = []
+        self.attributes = {}
+        self.status = "ok"
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name: str, seconds: float):
+        STAGE_SECONDS.observe(seconds, operation=self.operation, stage=name)
+        with self._lock:
+            self.stages.append((name, seconds))
+
+    def set(self, **attributes):
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def tokens(self, prompt: int, completion: int):
+        LLM_TOKENS.observe(prompt, operation=self.operation, kind="prompt")
+        LLM_TOKENS.observe(completion, operation=self.operation, kind="completion")
+        self.set(prompt_tokens=prompt, completion_tokens=completion)
+
+    def payload(self, kind: str, size: int):
+        PAYLOAD_BYTES.observe(size, operation=self.operation, kind=kind)
+        self.set(**{f"{kind}_bytes": size})
+
+    @contextmanager
+    def active(self):
+        """Makes this the trace that module-level `stage()` calls report to."""
+        token = _trace.set(self)
+        try:
+            yield self
+        except Exception:
+            self.status = "error"
+            raise
+        finally:
+            _trace.reset(token)
+
+    def finish(self):
+        total = time.perf_counter() - self._start
+        STAGE_SECONDS.observe(total, operation=self.operation, stage="total")
+        with self._lock:
+            stages = {}
+            for name, seconds in self.stages:
+                stages[name] = round(stages.get(name, 0.0) + seconds * 1000, 2)
+            record = {
+                "operation": self.operation,
+                "request_id": self.request_id,
+                "session_id": self.session_id,
+                "status": self.status,
+                "duration_ms": round(total * 1000, 2),
+                "stages_ms": stages,
+                **self.attributes,
+            }
+        summary = " ".join(f"{name}={ms}ms" for name, ms in stages.items())
+        logger.info(f"{self.operation} {self.status} in {record['duration_ms']}ms [{summary}]", extra={"trace": record})
+
+
+def current_trace():
+    return _trace.get()
+
+
+@contextmanager
+def trace(operation: str, session_id: str = None):
+    """
+    Traces one operation. If a trace is already active (e.g. the route opened
+    one to include reading its inputs), the operation's stages join it.
+    """
+    active = _trace.get()
+    if active is not None:
+        yield active
+        return
+
+    t = Trace(operation, session_id)
+    try:
+        with t.active():
+            yield t
+    finally:
+        t.finish()
+
+
+@contextmanager
+def stage(name: str):
+    """Times a stage of whatever operation is being traced; a no-op-cheap timer otherwise."""
+    t = _trace.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if t is not None:
+            t.add_stage(name, elapsed)
+        else:
+            STAGE_SECONDS.observe(elapsed, operation="untraced", stage=name)
+
+
+def submit_with_context(pool, fn, *args, **kwargs):
+    """Executor submit that carries the caller's request id and active trace into the worker."""
+    return pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class RequestTracingMiddleware:
+    """
+    Pure ASGI middleware: assigns a request id (honouring X-Request-ID),
+    returns it as a header and records latency until the response body is
+    fully sent, so streaming endpoints are measured end to end.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers") or [])
+        incoming = headers.get(b"x-request-id", b"").decode("latin-1")[:64]
+        context = {"request_id": incoming or new_request_id(), "session_id": None}
+        token = _request.set(context)
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", context["request_id"].encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            route = scope.get("route")
+            REQUEST_SECONDS.observe(
+                elapsed,
+                method=scope.get("method", ""),
+                route=getattr(route, "path", None) or "unmatched",
+                status=status["code"],
+            )
+            _request.reset(token)
@@ -1,8 +1,21 @@
+import asyncio
+import importlib
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from app.api.routes import router
+from fastapi.responses import PlainTextResponse
+from app.api.routes import ingestion_service, router, session_reaper
 from app.core.config import settings
-from app.services.cleanup import cleanup_stale_files
+from app.core.logger import get_logger
+from app.core.tracing import RequestTracingMiddleware, metrics
+from app.services import prompts
+from app.services.ingestion import warm_up_loaders
+from app.services.parsing import shutdown_parsers
+from app.services.projects import seed_project
+from app.services.providers import get_providers
+from app.services.state_store import deployment_problems
+
+logger = get_logger("main")
 
 app = FastAPI(title=settings.PROJECT_NAME)
 
@@ -12,14 +25,61 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
+# Added last so it wraps everything, CORS included.
+app.add_middleware(RequestTracingMiddleware)
+
+def warm_up():
+    """Imports and builds the heavy clients in the background; requests that arrive first build what they need."""
+    try:
+        get_providers().warm_up()
+        warm_up_loaders()
+        importlib.import_module("app.services.retrieval")
+        for name in ("TEST_GEN_PROMPT", "SCRIPT_GEN_PROMPT"):
+            getattr(prompts, name)
+    except Exception as e:
+        logger.error(f"Warm-up failed, clients will be built on first use: {e}")
+    session_reaper.discover()
+
+def seed_default_project():
+    """Brings the default project up to date with its directory; unchanged files cost nothing."""
+    if not settings.DEFAULT_PROJECT:
+        return
+    try:
+        seed_project(ingestion_service, settings.DEFAULT_PROJECT, settings.DEFAULT_PROJECT_DIR)
+    except Exception as e:
+        logger.error(f"Seeding project {settings.DEFAULT_PROJECT} failed: {e}")
+
+async def background_startup():
+    if settings.WARM_UP_ON_STARTUP:
+        await run_in_threadpool(warm_up)
+    else:
+        await run_in_threadpool(session_reaper.discover)
+    await run_in_threadpool(seed_default_project)
+    await session_reaper.run_forever()
 
 @app.on_event("startup")
 async def startup_event():
-    cleanup_stale_files()
+    problems = deployment_problems()
+    if problems:
+        raise RuntimeError("Invalid deployment settings: " + " ".join(problems))
+    # Nothing heavy here: the server starts answering /health immediately.
+    app.state.background_task = asyncio.create_task(background_startup())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    task = getattr(app.state, "background_task", None)
+    if task:
+        task.cancel()
+    await run_in_threadpool(shutdown_parsers)
 
 app.include_router(router, prefix=settings.API_V1_STR)
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,221 @@
+import hashlib
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import List, Tuple
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.services.dom_index import DomIndex, get_dom_index, load_dom_index
+from app.services.session_manifest import SessionManifest, layers_version, project_key
+
+logger = get_logger("artifacts")
+
+PAGE_TYPES = ("html",)
+
+
+def file_record(path: str) -> dict:
+    """Type, size and content hash of one upload."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return {
+        "type": os.path.splitext(path)[1].lower().lstrip("."),
+        "size": os.path.getsize(path),
+        "sha256": digest.hexdigest(),
+    }
+
+
+def session_artifact_dir(session_id: str) -> str:
+    return os.path.join(settings.ARTIFACT_DIR, f"session_{session_id}")
+
+
+def text_artifact_path(session_id: str, filename: str) -> str:
+    return os.path.join(session_artifact_dir(session_id), f"{os.path.basename(filename)}.txt")
+
+
+def drop_session_artifacts(session_id: str):
+    shutil.rmtree(session_artifact_dir(session_id), ignore_errors=True)
+    page_artifacts.invalidate_session(session_id)
+
+
+class TextArtifactWriter:
+    """Extracted text of one file, appended page by page as the file streams in."""
+
+    def __init__(self, session_id: str, filename: str):
+        self.path = text_artifact_path(session_id, filename)
+        self._tmp_path = f"{self.path}.tmp"
+        self._file = None
+        self.chars = 0
+
+    def write(self, text: str):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open(self._tmp_path, "w", encoding="utf-8")
+        if self.chars:
+            self._file.write("\n\n")
+        self._file.write(text)
+        self.chars += len(text)
+
+    def commit(self) -> dict:
+        if self._file is None:
+            self.write("")
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        return {"path": os.path.relpath(self.path, settings.ARTIFACT_DIR), "chars": self.chars}
+
+    def discard(self):
+        if self._file is not None:
+            self._file.close()
+            if os.path.exists(self._tmp_path):
+                os.remove(self._tmp_path)
+
+
+def dom_artifact(index: DomIndex) -> dict:
+    return {"sha256": index.sha256, "elements": len(index.elements), "regions": len(index.regions)}
+
+
+def _layers(session_id: str) -> List[Tuple[str, SessionManifest]]:
+    """The session's manifest, then its attached project's."""
+    manifest = SessionManifest(session_id)
+    layers = [(session_id, manifest)]
+    if manifest.project:
+        base_id = project_key(manifest.project)
+        layers.append((base_id, SessionManifest(base_id)))
+    return layers
+
+
+def describe_files(session_id: str) -> List[dict]:
+    """
+    The session's file manifest as the API reports it (chunk ids become a
+    count), followed by the attached project's files it does not shadow.
+    """
+    described, seen = [], set()
+    for owner_id, manifest in _layers(session_id):
+        layer = "session" if owner_id == session_id else "project"
+        for filename, entry in sorted(manifest.files().items()):
+            if filename in seen:
+                continue
+            seen.add(filename)
+            row = {"filename": filename, **{k: v for k, v in entry.items() if k != "chunks"}}
+            row["chunks"] = len(entry.get("chunks", []))
+            row.setdefault("type", os.path.splitext(filename)[1].lower().lstrip("."))
+            row["layer"] = layer
+            described.append(row)
+    return described
+
+
+class PageArtifact:
+    """A preparsed HTML page of one session: what /generate-script works from."""
+
+    __slots__ = ("session_id", "filename", "sha256", "size", "dom_index")
+
+    def __init__(self, session_id: str, filename: str, sha256: str, size: int, dom_index: DomIndex):
+        self.session_id = session_id
+        self.filename = filename
+        self.sha256 = sha256
+        self.size = size
+        self.dom_index = dom_index
+
+
+class PageArtifactCache:
+    """
+    Preparsed pages per session, resolved through the session's file
+    manifest and kept in an LRU, so generating a script neither lists the
+    upload directory nor rereads the page. Entries remember the manifest
+    version they were resolved from and are reloaded when any process
+    rewrites it; ingestion also invalidates them directly.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def page_names(manifest: SessionManifest) -> List[str]:
+        """HTML pages in the manifest, most recently ingested first."""
+        pages = [
+            (entry.get("ingested_at", 0), filename)
+            for filename, entry in manifest.files().items()
+            if os.path.splitext(filename)[1].lower().lstrip(".") in PAGE_TYPES and entry.get("status") != "failed"
+        ]
+        return [filename for _, filename in sorted(pages, key=lambda p: (-p[0], p[1]))]
+
+    def pages(self, session_id: str) -> List[Tuple[str, str]]:
+        """(owner, filename) of every page the session can target: its own first, then its project's."""
+        pages, seen = [], set()
+        for owner_id, manifest in _layers(session_id):
+            for filename in self.page_names(manifest):
+                if filename not in seen:
+                    seen.add(filename)
+                    pages.append((owner_id, filename))
+        return pages
+
+    def get(self, session_id: str, filename: str = None) -> PageArtifact:
+        """
+        The named page, or the most recently ingested one; pages of an
+        attached project count after the session's own. Raises LookupError
+        when the session has no such page.
+        """
+        key = (session_id, filename)
+        version = layers_version(session_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        artifact = self._load(session_id, filename)
+        with self._lock:
+            self._entries[key] = (version, artifact)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return artifact
+
+    def _load(self, session_id: str, filename: str = None) -> PageArtifact:
+        layered = self.pages(session_id)
+        owners = {name: owner_id for owner_id, name in layered}
+        pages = [name for _, name in layered]
+        if not pages:
+            raise LookupError("No HTML file found for this session. Please go to Tab 1 and upload your target HTML file.")
+        if filename is None:
+            filename = pages[0]
+            if len(pages) > 1:
+                logger.info(f"Session {session_id}: {len(pages)} pages ingested, defaulting to {filename}")
+        elif filename not in pages:
+            raise LookupError(f"Page '{filename}' is not in this session. Available pages: {', '.join(pages)}")
+
+        owner_id = owners[filename]
+        entry = SessionManifest(owner_id).files()[filename]
+        size = entry.get("size")
+        dom_sha = entry.get("artifacts", {}).get("dom_index", {}).get("sha256")
+        index = load_dom_index(dom_sha) if dom_sha else None
+        if index is None:
+            # Ingested before artifacts were recorded, or the DOM cache was cleared.
+            path = os.path.join(settings.UPLOAD_DIR, owner_id, filename)
+            if not os.path.exists(path):
+                raise LookupError(f"Page '{filename}' is no longer on disk. Please upload it again.")
+            with open(path, "r", encoding="utf-8") as f:
+                index = get_dom_index(f.read())
+            size = os.path.getsize(path)
+        return PageArtifact(session_id, filename, entry.get("sha256") or index.sha256, size or 0, index)
+
+    def invalidate_session(self, session_id: str):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == session_id]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+page_artifacts = PageArtifactCache(settings.PAGE_ARTIFACT_CACHE_SIZE)
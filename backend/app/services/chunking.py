@@ -0,0 +1,378 @@
+import os
+import re
+from abc import ABC, abstractmethod
+from typing import List, Tuple
+
+from langchain_core.documents import Document
+
+from app.core.config import settings
+
+STRATEGIES = ("structured", "recursive")
+# Section path elements in chunk metadata, outermost first.
+PATH_SEPARATOR = " > "
+
+# (section path, start, end) over the text of one page.
+Section = Tuple[Tuple[str, ...], int, int]
+
+_MD_FENCE = re.compile(r"^ {0,3}(```|~~~)")
+_MD_ATX = re.compile(r"^ {0,3}(#{1,6})[ \t]+(.+?)[ \t#]*$")
+_MD_SETEXT = re.compile(r"^ {0,3}(=+|-+)[ \t]*$")
+_MD_INLINE = re.compile(r"[*_`]+")
+
+_BLOCK_BREAK = re.compile(r"\n[ \t]*\n\s*")
+# "2.1 Discounts", "IV. Shipping": numbered headings of plain text and PDFs.
+_NUMBERED_HEADING = re.compile(r"^(?:(\d+(?:\.\d+)*)\.?|[IVX]+\.)[ \t]+(\S.{0,78})$")
+_CAPS_HEADING = re.compile(r"^[A-Z][A-Z0-9 &/,'-]{2,59}$")
+
+HTML_HEADINGS = ("h1", "h2", "h3", "h4", "h5", "h6")
+HTML_SKIP = {"head", "style", "noscript", "template", "svg", "iframe", "object"}
+HTML_INLINE = {
+    "a", "abbr", "b", "bdi", "bdo", "cite", "code", "data", "dfn", "em", "i", "kbd", "label", "mark",
+    "q", "s", "samp", "small", "span", "strong", "sub", "sup", "time", "u", "var", "wbr",
+}
+
+
+def _recursive_splitter(chunk_size: int, overlap: int):
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=overlap, add_start_index=True)
+
+
+def _related(group: Tuple[str, ...], path: Tuple[str, ...]) -> bool:
+    """
+    A section joins a chunk under `group` if it is nested in it or is a
+    sibling of it below the top level; top-level sections stay apart.
+    """
+    if path[:len(group)] == group:
+        return True
+    return len(group) > 1 and len(path) == len(group) and path[:-1] == group[:-1]
+
+
+def _common(a: Tuple[str, ...], b: Tuple[str, ...]) -> Tuple[str, ...]:
+    n = 0
+    while n < min(len(a), len(b)) and a[n] == b[n]:
+        n += 1
+    return a[:n]
+
+
+class Chunker(ABC):
+    """
+    Splits the pages of one file into chunks. One instance per file, so
+    state such as the heading in effect carries across pages.
+    """
+
+    def __init__(self, chunk_size: int = None, overlap: int = None):
+        self.chunk_size = chunk_size or settings.CHUNK_SIZE
+        self.overlap = settings.SECTION_CHUNK_OVERLAP if overlap is None else overlap
+        self._splitter = None
+
+    @abstractmethod
+    def split(self, page: Document) -> Tuple[str, List[Document]]:
+        """(text of the page, its chunks); the text is what the file's text artifact records."""
+
+
+class SectionChunker(Chunker):
+    """
+    Subclasses find the sections of a page; whole sections are then packed
+    into chunks of up to CHUNK_SIZE characters, and only sections longer
+    than that are cut.
+
+    Chunks are exact slices of the page text, with start_index and the
+    section path in their metadata.
+    """
+
+    @abstractmethod
+    def sections(self, page: Document) -> Tuple[str, List[Section]]:
+        """(text of the page, its sections in order)."""
+
+    def split(self, page: Document) -> Tuple[str, List[Document]]:
+        text, sections = self.sections(page)
+        metadata = {k: v for k, v in page.metadata.items() if not k.startswith("_")}
+        chunks, group = [], None
+        for path, start, end in sections:
+            if not text[start:end].strip():
+                continue
+            if group and end - group[1] <= self.chunk_size and _related(group[0], path):
+                group = (_common(group[0], path), group[1], end)
+                continue
+            if group:
+                chunks.extend(self._emit(text, metadata, *group))
+            group = (path, start, end)
+        if group:
+            chunks.extend(self._emit(text, metadata, *group))
+        return text, chunks
+
+    def _emit(self, text: str, metadata: dict, path: Tuple[str, ...], start: int, end: int) -> List[Document]:
+        body = text[start:end]
+        start += len(body) - len(body.lstrip())
+        body = body.strip()
+        section = {**metadata, "section_path": PATH_SEPARATOR.join(path)}
+        if len(body) <= self.chunk_size:
+            return [Document(page_content=body, metadata={**section, "start_index": start})]
+
+        if self._splitter is None:
+            self._splitter = _recursive_splitter(self.chunk_size, self.overlap)
+        pieces = []
+        for piece in self._splitter.create_documents([body]):
+            pieces.append(Document(
+                page_content=piece.page_content,
+                metadata={**section, "start_index": start + piece.metadata["start_index"]},
+            ))
+        return pieces
+
+
+class RecursiveChunker(Chunker):
+    """The plain character splitter with overlap, blind to structure."""
+
+    def __init__(self, chunk_size: int = None, overlap: int = None):
+        super().__init__(chunk_size, settings.CHUNK_OVERLAP if overlap is None else overlap)
+
+    def split(self, page: Document) -> Tuple[str, List[Document]]:
+        if self._splitter is None:
+            self._splitter = _recursive_splitter(self.chunk_size, self.overlap)
+        return page.page_content, self._splitter.split_documents([page])
+
+
+class MarkdownChunker(SectionChunker):
+    """Sections start at ATX (#) and setext (===, ---) headers outside code fences."""
+
+    def __init__(self, chunk_size: int = None, overlap: int = None):
+        super().__init__(chunk_size, overlap)
+        self.headings = []
+
+    def _path(self) -> Tuple[str, ...]:
+        return tuple(title for _, title in self.headings)
+
+    def _enter(self, level: int, title: str):
+        while self.headings and self.headings[-1][0] >= level:
+            self.headings.pop()
+        title = _MD_INLINE.sub("", title).strip()
+        if title:
+            self.headings.append((level, title))
+
+    def sections(self, page: Document) -> Tuple[str, List[Section]]:
+        text = page.page_content
+        lines = text.splitlines(keepends=True)
+        offsets = [0]
+        for line in lines:
+            offsets.append(offsets[-1] + len(line))
+
+        starts = [(0, self._path())]
+        fence = None
+        for i, line in enumerate(lines):
+            stripped = line.rstrip("\r\n")
+            opener = _MD_FENCE.match(stripped)
+            if fence:
+                if opener and opener.group(1) == fence:
+                    fence = None
+                continue
+            if opener:
+                fence = opener.group(1)
+                continue
+            atx = _MD_ATX.match(stripped)
+            if atx:
+                self._enter(len(atx.group(1)), atx.group(2))
+                starts.append((offsets[i], self._path()))
+                continue
+            setext = _MD_SETEXT.match(stripped)
+            previous = lines[i - 1].strip() if i else ""
+            if setext and previous and not _MD_ATX.match(previous) and not previous.startswith(("-", "*", ">")):
+                # The header is the line above; it already belongs to the section before.
+                self._enter(1 if setext.group(1)[0] == "=" else 2, previous)
+                if starts[-1][0] == offsets[i - 1]:
+                    starts.pop()
+                starts.append((offsets[i - 1], self._path()))
+
+        sections = []
+        for n, (start, path) in enumerate(starts):
+            end = starts[n + 1][0] if n + 1 < len(starts) else len(text)
+            if end > start:
+                sections.append((path, start, end))
+        return text, sections
+
+
+class BlockChunker(SectionChunker):
+    """
+    Plain text and PDF pages: blocks are separated by blank lines, and a
+    block starting with a heading opens a section. PDF pages come from
+    PdfBlockLoader, which marks heading blocks by font size in
+    "_headings"; plain text relies on numbered or capitalised heading lines.
+    """
+
+    def __init__(self, chunk_size: int = None, overlap: int = None):
+        super().__init__(chunk_size, overlap)
+        self.headings = []
+        self.blocks_seen = 0
+
+    def _heading(self, block: str, single: bool):
+        """(level, title) when the block opens a section."""
+        first, _, rest = block.partition("\n")
+        first = first.strip()
+        numbered = _NUMBERED_HEADING.match(first)
+        if numbered and not first.endswith((".", ":", ";", ",")):
+            return (numbered.group(1) or "1").count(".") + 1, first
+        if _CAPS_HEADING.match(first) and (rest or not single):
+            return 1, first
+        if self.blocks_seen == 0 and not rest and len(first) <= 80 and not first.endswith((".", ":", ";", ",")):
+            # A short first line on its own is the document title.
+            return 0, first
+        return None
+
+    def sections(self, page: Document) -> Tuple[str, List[Section]]:
+        text = page.page_content
+        marked = page.metadata.get("_headings")
+        bounds, start = [], 0
+        for match in _BLOCK_BREAK.finditer(text):
+            bounds.append((start, match.start()))
+            start = match.end()
+        bounds.append((start, len(text)))
+
+        sections = []
+        for i, (start, end) in enumerate(bounds):
+            block = text[start:end]
+            if not block.strip():
+                continue
+            if marked is not None:
+                level = marked.get(i)
+                heading = (level, " ".join(block.split())) if level is not None else None
+            else:
+                heading = self._heading(block, single=len(bounds) == 1)
+            if heading:
+                level, title = heading
+                while self.headings and self.headings[-1][0] >= level:
+                    self.headings.pop()
+                self.headings.append((level, title))
+            self.blocks_seen += 1
+            sections.append((tuple(title for _, title in self.headings), start, end))
+        return text, sections
+
+
+class _HtmlSections:
+    """Visible text of a page grouped by the headings in effect, in document order."""
+
+    def __init__(self):
+        self.headings = []
+        self.sections = [((), [])]
+        self.line = []
+
+    def path(self) -> Tuple[str, ...]:
+        return tuple(title for _, title in self.headings)
+
+    def flush_line(self):
+        line = " ".join("".join(self.line).split())
+        if line:
+            self.sections[-1][1].append(line)
+        self.line = []
+
+    def open(self, path: Tuple[str, ...]):
+        self.flush_line()
+        if self.sections[-1][1]:
+            self.sections.append((path, []))
+        else:
+            self.sections[-1] = (path, [])
+
+    def walk(self, node):
+        from bs4 import NavigableString, Tag
+
+        for child in node.children:
+            if not isinstance(child, Tag):
+                # Comments, doctypes and CDATA are NavigableString subclasses too.
+                if type(child) is NavigableString:
+                    self.line.append(str(child))
+                continue
+            name = child.name
+            if name in HTML_SKIP:
+                continue
+            if name == "br":
+                self.flush_line()
+                continue
+            if name == "script":
+                # Inline scripts often hold the page's business rules; keep them as their own section.
+                code = [line.strip() for line in child.get_text().splitlines() if line.strip()]
+                if code and not child.get("src"):
+                    path = self.path()
+                    self.open(path + ("<script>",))
+                    self.sections[-1][1].extend(code)
+                    self.open(path)
+                continue
+            if name in HTML_HEADINGS:
+                level = int(name[1])
+                title = " ".join(child.get_text().split())
+                while self.headings and self.headings[-1][0] >= level:
+                    self.headings.pop()
+                if title:
+                    self.headings.append((level, title))
+                self.open(self.path())
+                self.line.append(title)
+                self.flush_line()
+                continue
+
+            block = name not in HTML_INLINE
+            # An element holding headings is a section: they end with it.
+            saved = list(self.headings) if block and child.find(HTML_HEADINGS) else None
+            if block:
+                self.flush_line()
+            self.walk(child)
+            if block:
+                self.flush_line()
+            if saved is not None and self.headings != saved:
+                self.headings = saved
+                self.open(self.path())
+
+
+class HtmlChunker(SectionChunker):
+    """
+    Sections follow the page's headings (h1-h6); elements that contain
+    headings close theirs when they end. Styles and markup are dropped,
+    inline scripts kept. The page text becomes the visible text, one line
+    per block element.
+    """
+
+    def sections(self, page: Document) -> Tuple[str, List[Section]]:
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(page.page_content, "html.parser")
+        if soup.title and soup.title.string:
+            page.metadata["title"] = soup.title.string.strip()
+        walker = _HtmlSections()
+        walker.walk(soup.body or soup)
+        walker.flush_line()
+
+        parts, sections, offset = [], [], 0
+        for path, lines in walker.sections:
+            if not lines:
+                continue
+            body = "\n".join(lines)
+            if parts:
+                offset += 2
+            sections.append((path, offset, offset + len(body)))
+            parts.append(body)
+            offset += len(body)
+        return "\n\n".join(parts), sections
+
+
+# Structure-aware chunker per extension; anything else is split recursively.
+CHUNKERS = {
+    ".md": MarkdownChunker,
+    ".html": HtmlChunker,
+    ".pdf": BlockChunker,
+    ".txt": BlockChunker,
+}
+
+
+def check_strategy(strategy: str) -> str:
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown chunking strategy '{strategy}', expected one of: {', '.join(STRATEGIES)}")
+    return strategy
+
+
+def chunker_for(filename: str, strategy: str = None) -> Chunker:
+    """A fresh chunker for one file."""
+    strategy = check_strategy(strategy or settings.CHUNKING_STRATEGY)
+    if strategy == "recursive":
+        return RecursiveChunker()
+    return CHUNKERS.get(os.path.splitext(filename)[1].lower(), RecursiveChunker)()
+
+
+def warm_up_chunkers():
+    _recursive_splitter(settings.CHUNK_SIZE, settings.CHUNK_OVERLAP)
+    import bs4  # noqa: F401
@@ -1,30 +1,150 @@
+import asyncio
 import os
 import shutil
+import threading
 import time
+from fastapi.concurrency import run_in_threadpool
 from app.core.config import settings
 from app.core.logger import get_logger
+from app.services.session_manifest import forget_session_lock, is_project_key, session_lock
+from app.services.session_registry import SessionRegistry
 
 logger = get_logger("cleanup_service")
 
-def cleanup_stale_files():
-    now = time.time()
-    timeout_seconds = settings.SESSION_TIMEOUT_MINUTES * 60
-    upload_dir = settings.UPLOAD_DIR
 
-    if not os.path.exists(upload_dir):
-        return
+def _path_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class SessionReaper:
+    """
+    Periodically expires sessions idle for SESSION_TIMEOUT_MINUTES (by last
+    API access in the registry) and reclaims everything they own together:
+    uploads, the vector collection, manifest, parse artifacts, lexical index
+    and cached responses. With shared state, only the worker holding the
+    reaper lease runs it.
+    """
+
+    def __init__(self, registry: SessionRegistry, ingestion_service):
+        self.registry = registry
+        self.ingestion_service = ingestion_service
+        self.runs = 0
+        self.sessions_reaped = 0
+        self.bytes_reclaimed = 0
+        self.last_run_seconds = 0.0
+        self.last_run_at = None
+        self.leader = False
+        self._lock = threading.Lock()
+
+    def discover(self):
+        """Adopts sessions left on disk by a previous process so they expire too."""
+        now = time.time()
+        found = {}
+
+        upload_dir = settings.UPLOAD_DIR
+        if os.path.exists(upload_dir):
+            for session_id in os.listdir(upload_dir):
+                session_path = os.path.join(upload_dir, session_id)
+                if os.path.isdir(session_path):
+                    found[session_id] = os.path.getmtime(session_path)
+
+        if os.path.exists(settings.MANIFEST_DIR):
+            for name in os.listdir(settings.MANIFEST_DIR):
+                if name.startswith("session_") and name.endswith(".json"):
+                    session_id = name[len("session_"):-len(".json")]
+                    mtime = os.path.getmtime(os.path.join(settings.MANIFEST_DIR, name))
+                    found[session_id] = max(found.get(session_id, 0), mtime)
+
+        try:
+            for session_id in self.ingestion_service.providers.vectors.list_sessions():
+                found.setdefault(session_id, now)
+        except Exception as e:
+            logger.warning(f"Could not list vector collections: {e}")
 
-    for session_id in os.listdir(upload_dir):
-        session_path = os.path.join(upload_dir, session_id)
-        
-        if not os.path.isdir(session_path):
-            continue
+        # Project knowledge bases live under reserved keys and never expire.
+        found = {k: v for k, v in found.items() if not is_project_key(k)}
+        for session_id, last_access in found.items():
+            self.registry.adopt(session_id, last_access)
+        logger.info(f"Discovered {len(found)} sessions on disk")
 
-        last_modified = os.path.getmtime(session_path)
-        if now - last_modified > timeout_seconds:
+    def _reclaim(self, session_id: str) -> int:
+        reclaimed = 0
+        paths = [
+            os.path.join(settings.UPLOAD_DIR, session_id),
+            os.path.join(settings.MANIFEST_DIR, f"session_{session_id}.json"),
+            os.path.join(settings.LEXICAL_INDEX_DIR, f"session_{session_id}.json"),
+            os.path.join(settings.NUMPY_VECTOR_DIR, f"session_{session_id}"),
+            os.path.join(settings.ARTIFACT_DIR, f"session_{session_id}"),
+        ]
+        for path in paths:
+            if os.path.exists(path):
+                reclaimed += _path_size(path)
+
+        upload_path = os.path.join(settings.UPLOAD_DIR, session_id)
+        if os.path.isdir(upload_path):
+            shutil.rmtree(upload_path, ignore_errors=True)
+        self.ingestion_service.delete_session_data(session_id)
+        return reclaimed
+
+    def run_once(self):
+        start = time.time()
+        cutoff = start - settings.SESSION_TIMEOUT_MINUTES * 60
+        reaped = reclaimed = 0
+
+        for session_id in self.registry.stale(settings.SESSION_TIMEOUT_MINUTES * 60):
+            try:
+                with session_lock(session_id):
+                    entry = self.registry.get(session_id)
+                    if entry is None or entry["last_access"] >= cutoff:
+                        continue  # Revived since we listed it.
+                    logger.info(f"Cleaning up stale session: {session_id}")
+                    reclaimed += self._reclaim(session_id)
+                    self.registry.remove(session_id, only_if_before=cutoff)
+                forget_session_lock(session_id)
+                reaped += 1
+            except Exception as e:
+                logger.error(f"Error cleaning {session_id}: {e}")
+
+        elapsed = time.time() - start
+        with self._lock:
+            self.runs += 1
+            self.sessions_reaped += reaped
+            self.bytes_reclaimed += reclaimed
+            self.last_run_seconds = elapsed
+            self.last_run_at = start
+        if reaped:
+            logger.info(f"Reaper removed {reaped} sessions, reclaimed {reclaimed} bytes in {elapsed:.2f}s")
+        return reaped
+
+    async def run_forever(self):
+        # Held across a missed run or two, then free for another worker to take over.
+        lease_seconds = settings.SESSION_REAPER_INTERVAL_SECONDS * 3
+        while True:
             try:
-                logger.info(f"Cleaning up stale session: {session_id}")
-                shutil.rmtree(session_path)
-                
+                self.leader = await run_in_threadpool(self.registry.try_lead, "session_reaper", lease_seconds)
+                if self.leader:
+                    await run_in_threadpool(self.run_once)
             except Exception as e:
-                logger.error(f"Error cleaning {session_id}: {e}")
\ No newline at end of file
+                logger.error(f"Reaper run failed: {e}")
+            await asyncio.sleep(settings.SESSION_REAPER_INTERVAL_SECONDS)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "live_sessions": len(self.registry),
+                "reaper_runs": self.runs,
+                "sessions_reaped": self.sessions_reaped,
+                "bytes_reclaimed": self.bytes_reclaimed,
+                "last_run_seconds": round(self.last_run_seconds, 4),
+                "last_run_at": self.last_run_at,
+                "leader": self.leader,
+            }
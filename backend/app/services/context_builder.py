@@ -0,0 +1,248 @@
+import math
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, List
+
+from langchain_core.documents import Document
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.services.lexical_index import tokenize
+from app.services.tokenizer import count_tokens
+
+logger = get_logger("context_builder")
+
+MODEL_CONTEXT_WINDOWS = {
+    "llama3-70b-8192": 8192,
+    "gpt-4o": 128_000,
+}
+# Unknown models (and the fake) get the tightest window we deploy against.
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Shortest suffix/prefix match treated as splitter overlap rather than coincidence.
+MIN_OVERLAP_CHARS = 24
+# Chunks of one file whose start_index ranges are this close are merged as adjacent.
+ADJACENT_GAP_CHARS = 2
+
+TRUNCATION_MARK = "... (truncated)"
+
+
+def context_window(model: str) -> int:
+    return MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+
+
+@lru_cache(maxsize=32)
+def _template_tokens(model: str, template: str) -> int:
+    return count_tokens(template, model)
+
+
+def _template_text(prompt) -> str:
+    return "\n".join(m.prompt.template for m in prompt.messages if hasattr(m, "prompt"))
+
+
+def section_budgets(model: str, prompt, requested: Dict[str, int]) -> Dict[str, int]:
+    """
+    Per-section token budgets that fit the model's window after the template
+    itself and the reserved completion tokens. Sections shrink proportionally
+    when the configured budgets would overflow.
+    """
+    available = (
+        context_window(model)
+        - settings.LLM_OUTPUT_RESERVE_TOKENS
+        - _template_tokens(model, _template_text(prompt))
+    )
+    total = sum(requested.values())
+    if total <= available:
+        return dict(requested)
+
+    scale = max(available, 0) / total
+    logger.warning(f"Prompt budgets ({total} tokens) exceed {model} window; scaling by {scale:.2f}")
+    return {name: int(budget * scale) for name, budget in requested.items()}
+
+
+def fit_tokens(text: str, max_tokens: int, model: str = None) -> str:
+    """Keeps whole lines from the top until the budget is spent."""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+
+    kept, used = [], count_tokens(TRUNCATION_MARK, model)
+    for line in text.split("\n"):
+        cost = count_tokens(line + "\n", model)
+        if used + cost > max_tokens:
+            if not kept:
+                # A single oversized line: cut it by characters (~4 per token).
+                cut = max(0, (max_tokens - used) * 4)
+                while cut and count_tokens(line[:cut] + "\n" + TRUNCATION_MARK, model) > max_tokens:
+                    cut = int(cut * 0.9)
+                kept.append(line[:cut])
+            break
+        kept.append(line)
+        used += cost
+    # Per-line counts can undershoot the joined text by a token or two at the seams.
+    while len(kept) > 1 and count_tokens("\n".join(kept + [TRUNCATION_MARK]), model) > max_tokens:
+        kept.pop()
+    return "\n".join(kept + [TRUNCATION_MARK])
+
+
+def _overlap(left: str, right: str) -> int:
+    """Length of the longest suffix of `left` that is also a prefix of `right`."""
+    if len(right) < MIN_OVERLAP_CHARS:
+        return 0
+    probe = right[:MIN_OVERLAP_CHARS]
+    start = max(0, len(left) - len(right))
+    best = 0
+    while True:
+        idx = left.find(probe, start)
+        if idx < 0:
+            return best
+        size = len(left) - idx
+        if right.startswith(left[idx:]):
+            return size  # The first hit from the left is the longest overlap.
+        start = idx + 1
+
+
+def _merge_by_offset(group: List[Document]) -> List[Document]:
+    ordered = sorted(group, key=lambda d: d.metadata["start_index"])
+    merged = [ordered[0]]
+    for doc in ordered[1:]:
+        last = merged[-1]
+        last_start = last.metadata["start_index"]
+        last_end = last_start + len(last.page_content)
+        start = doc.metadata["start_index"]
+        if start > last_end + ADJACENT_GAP_CHARS:
+            merged.append(doc)
+            continue
+        end = start + len(doc.page_content)
+        if end > last_end:
+            tail = doc.page_content[max(0, last_end - start):]
+            joiner = "" if start <= last_end else "\n"
+            last = Document(
+                page_content=last.page_content + joiner + tail,
+                metadata={**last.metadata, "merged_chunks": last.metadata.get("merged_chunks", 1) + 1}
+            )
+            merged[-1] = last
+    return merged
+
+
+def _merge_by_text(group: List[Document]) -> List[Document]:
+    docs = list(group)
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(docs)):
+            for j in range(len(docs)):
+                if i == j:
+                    continue
+                a, b = docs[i], docs[j]
+                if b.page_content in a.page_content:
+                    merged = a
+                else:
+                    size = _overlap(a.page_content, b.page_content)
+                    if not size:
+                        continue
+                    merged = Document(
+                        page_content=a.page_content + b.page_content[size:],
+                        metadata={**a.metadata, "merged_chunks": a.metadata.get("merged_chunks", 1) + 1}
+                    )
+                docs[min(i, j)] = merged
+                del docs[max(i, j)]
+                changed = True
+                break
+            if changed:
+                break
+    return docs
+
+
+def merge_chunks(docs: List[Document]) -> List[Document]:
+    """
+    Collapses chunks of the same source that overlap (splitter overlap) or
+    touch. Uses start_index when ingestion recorded it, otherwise detects the
+    shared text. Groups keep the rank of their best-ranked chunk.
+    """
+    groups, order = {}, []
+    for doc in docs:
+        # PDF pages restart start_index, so a page is its own source here.
+        source = (doc.metadata.get("source", ""), doc.metadata.get("page"))
+        if source not in groups:
+            groups[source] = []
+            order.append(source)
+        groups[source].append(doc)
+
+    merged = []
+    for source in order:
+        group = groups[source]
+        if len(group) == 1:
+            merged.extend(group)
+        elif all("start_index" in d.metadata for d in group):
+            merged.extend(_merge_by_offset(group))
+        else:
+            merged.extend(_merge_by_text(group))
+    return merged
+
+
+def _cosine(a: Counter, b: Counter) -> float:
+    if not a or not b:
+        return 0.0
+    dot = sum(count * b[term] for term, count in a.items() if term in b)
+    return dot / (math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values())))
+
+
+def mmr_select(docs: List[Document], budget: int, model: str = None, lambda_: float = None) -> List[Document]:
+    """
+    Maximal marginal relevance over the ranked candidates, until the token
+    budget is full. Relevance is the retrieval rank; redundancy is term
+    cosine, so no extra embedding calls are made.
+    """
+    if not docs:
+        return []
+    lambda_ = settings.MMR_LAMBDA if lambda_ is None else lambda_
+    n = len(docs)
+    relevance = [1.0 - i / n for i in range(n)]
+    vectors = [Counter(tokenize(d.page_content)) for d in docs]
+    costs = [count_tokens(d.page_content, model) for d in docs]
+
+    selected, used = [], 0
+    remaining = list(range(n))
+    redundancy = [0.0] * n
+    while remaining:
+        best = max(remaining, key=lambda i: lambda_ * relevance[i] - (1 - lambda_) * redundancy[i])
+        remaining.remove(best)
+        if used + costs[best] > budget:
+            if not selected and budget > 0:
+                text = fit_tokens(docs[best].page_content, budget, model)
+                selected.append(Document(page_content=text, metadata=docs[best].metadata))
+                break
+            continue
+        selected.append(docs[best])
+        used += costs[best]
+        for i in remaining:
+            redundancy[i] = max(redundancy[i], _cosine(vectors[i], vectors[best]))
+    return selected
+
+
+class ContextBuilder:
+    """
+    Assembles the variable sections of one prompt template within the target
+    model's context window: retrieved chunks are merged and diversified into
+    the "context" budget, other sections are trimmed to theirs.
+    """
+
+    def __init__(self, model: str, prompt, **requested_budgets):
+        self.model = model
+        self.budgets = section_budgets(model, prompt, requested_budgets)
+
+    def context(self, docs: List[Document], trace=None) -> str:
+        merged = merge_chunks(docs)
+        chosen = mmr_select(merged, self.budgets["context"], self.model)
+        text = "\n\n".join(doc.page_content for doc in chosen)
+        if trace is not None:
+            trace.set(
+                context_candidates=len(docs),
+                context_merged=len(docs) - len(merged),
+                context_used=len(chosen),
+                context_tokens=count_tokens(text, self.model),
+            )
+        return text
+
+    def fit(self, section: str, text: str) -> str:
+        return fit_tokens(text, self.budgets[section], self.model)
@@ -0,0 +1,404 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.services.tokenizer import count_tokens
+
+logger = get_logger("dom_index")
+
+INDEX_VERSION = 2
+
+INTERACTIVE_TAGS = {"input", "button", "a", "select", "textarea", "form", "option", "label"}
+REGION_TAGS = {"form", "section", "fieldset", "div", "main", "nav", "header", "footer", "aside", "table", "dialog", "ul", "ol"}
+NOISE_TAGS = ["script", "style", "noscript", "svg", "template", "meta", "link", "iframe", "canvas"]
+KEEP_ATTRS = {
+    "id", "name", "class", "type", "for", "href", "placeholder", "value", "role",
+    "title", "alt", "action", "method", "checked", "selected", "disabled", "required",
+}
+STOPWORDS = {
+    "the", "and", "that", "with", "for", "from", "this", "then", "when", "verify",
+    "test", "check", "should", "into", "are", "is", "a", "an", "of", "to", "on", "in",
+}
+
+
+def _terms(text: str):
+    return {t for t in re.findall(r"[a-z0-9]+", text.lower()) if len(t) > 2 and t not in STOPWORDS}
+
+
+def _short(text: str, limit: int = 80) -> str:
+    text = re.sub(r"\s+", " ", text or "").strip()
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+
+def _quote(value: str) -> str:
+    return value.replace("'", "\\'")
+
+
+def _is_test_attr(attr: str) -> bool:
+    return attr.startswith("data-test") or attr in ("data-testid", "data-qa", "data-cy")
+
+
+class DomIndex:
+    """
+    Compact selector index for one HTML page: interactive and addressable
+    elements with candidate selectors and labels, the DOM regions that own
+    them, plus message strings and style rules the assertions usually need.
+    Built once per page hash and sent to the LLM instead of the raw HTML.
+    """
+
+    def __init__(self, data: dict):
+        self.data = data
+        # Parsed from data["document"] on the first CSS/XPath lookup.
+        self._trees = None
+        self._trees_lock = threading.Lock()
+
+    @property
+    def sha256(self):
+        return self.data["sha256"]
+
+    @property
+    def elements(self):
+        return self.data["elements"]
+
+    @property
+    def regions(self):
+        return self.data["regions"]
+
+    @classmethod
+    def build(cls, html: str, sha256: str = None) -> "DomIndex":
+        from bs4 import BeautifulSoup, Comment
+
+        sha256 = sha256 or hashlib.sha256(html.encode("utf-8")).hexdigest()
+        soup = BeautifulSoup(html, "html.parser")
+
+        style_text = "\n".join(tag.get_text() for tag in soup.find_all("style"))
+        script_text = "\n".join(tag.get_text() for tag in soup.find_all("script"))
+        for tag in soup.find_all(NOISE_TAGS):
+            tag.decompose()
+        for comment in soup.find_all(string=lambda s: isinstance(s, Comment)):
+            comment.extract()
+
+        title = soup.title.get_text(strip=True) if soup.title else ""
+        body = soup.body or soup
+
+        labels = {}
+        for label in body.find_all("label"):
+            target = label.get("for")
+            if target:
+                labels[target] = _short(label.get_text(" ", strip=True))
+
+        candidates = [
+            el for el in body.find_all(True)
+            if el.name in INTERACTIVE_TAGS or el.get("id") or el.get("name")
+            or any(_is_test_attr(a) for a in el.attrs)
+        ]
+
+        id_counts = Counter(el.get("id") for el in body.find_all(id=True))
+        name_counts = Counter(el.get("name") for el in body.find_all(attrs={"name": True}))
+        name_value_counts = Counter((el.get("name"), el.get("value")) for el in body.find_all(attrs={"name": True}))
+        text_counts = Counter((el.name, _short(el.get_text(" ", strip=True))) for el in candidates)
+
+        regions = OrderedDict()
+        elements = []
+        for el in candidates:
+            if el.name == "label" and not el.get("id"):
+                continue
+
+            region = el.find_parent(lambda p: p.name in REGION_TAGS and p.get("id")) or el.find_parent("form")
+            region_key = None
+            if region is not None:
+                region_key = f"#{region['id']}" if region.get("id") else f"form[{len(regions)}]"
+                if region_key not in regions:
+                    regions[region_key] = region
+
+            element = cls._describe(el, labels, id_counts, name_counts, name_value_counts, text_counts)
+            element["region"] = region_key
+            elements.append(element)
+
+        known = {e["id"] for e in elements if e.get("id")} | {e["name"] for e in elements if e.get("name")}
+        classes = {c for e in elements for c in e.get("classes", [])}
+
+        data = {
+            "version": INDEX_VERSION,
+            "sha256": sha256,
+            "title": title,
+            "raw_tokens": count_tokens(html),
+            # Selector validation: exact counts for the cheap lookups, and the
+            # page without scripts, styles and comments for CSS/XPath.
+            "locators": {"ids": dict(id_counts), "names": dict(name_counts)},
+            "document": re.sub(r">\s+<", "> <", str(soup)),
+            "elements": elements,
+            "regions": [
+                {"key": key, "html": cls._clean_region(region), "text": _short(region.get_text(" ", strip=True), 400)}
+                for key, region in regions.items()
+            ],
+            "script_strings": cls._script_strings(script_text, known),
+            "style_rules": cls._style_rules(style_text, known, classes),
+        }
+        return cls(data)
+
+    @staticmethod
+    def _describe(el, labels, id_counts, name_counts, name_value_counts, text_counts) -> dict:
+        el_id, name = el.get("id"), el.get("name")
+        text = _short(el.get_text(" ", strip=True))
+        label = labels.get(el_id) or el.get("aria-label") or el.get("title") or ""
+        if not label and el.find_parent("label"):
+            label = _short(el.find_parent("label").get_text(" ", strip=True))
+        if not label and el.get("type") in ("radio", "checkbox"):
+            # "<input type=radio> Express ($10)" - the caption is the next text node.
+            sibling = el.next_sibling
+            if isinstance(sibling, str) and sibling.strip():
+                label = _short(sibling)
+
+        selectors = []
+        if el_id:
+            status = "unique" if id_counts[el_id] == 1 else "ambiguous"
+            selectors.append({"by": "ID", "value": el_id, "match": status})
+        for attr, value in el.attrs.items():
+            if _is_test_attr(attr):
+                selectors.append({"by": "CSS_SELECTOR", "value": f"[{attr}='{_quote(value)}']", "match": "unique"})
+        if name:
+            if name_counts[name] == 1:
+                selectors.append({"by": "NAME", "value": name, "match": "unique"})
+            elif el.get("value") is not None and name_value_counts[(name, el.get("value"))] == 1:
+                selectors.append({
+                    "by": "CSS_SELECTOR",
+                    "value": f"{el.name}[name='{_quote(name)}'][value='{_quote(el.get('value'))}']",
+                    "match": "unique"
+                })
+            else:
+                selectors.append({"by": "NAME", "value": name, "match": "ambiguous"})
+        if el.name in ("button", "a") and text and text_counts[(el.name, text)] == 1:
+            if el.name == "a":
+                selectors.append({"by": "LINK_TEXT", "value": text, "match": "unique"})
+            else:
+                literal = f'"{text}"' if "'" in text else f"'{text}'"
+                selectors.append({"by": "XPATH", "value": f"//button[normalize-space()={literal}]", "match": "unique"})
+
+        element = {"tag": el.name, "selectors": selectors}
+        for key, value in (
+            ("type", el.get("type")), ("id", el_id), ("name", name), ("label", label),
+            ("placeholder", el.get("placeholder")), ("value", el.get("value")),
+            ("href", el.get("href")), ("text", text if el.name not in REGION_TAGS | {"select"} else ""),
+        ):
+            if value:
+                element[key] = value
+        if el.get("class"):
+            element["classes"] = list(el.get("class"))
+        return element
+
+    @staticmethod
+    def _clean_region(region) -> str:
+        from bs4 import BeautifulSoup
+
+        clone = BeautifulSoup(str(region), "html.parser")
+        for tag in clone.find_all(True):
+            tag.attrs = {
+                k: v for k, v in tag.attrs.items()
+                if k in KEEP_ATTRS or k.startswith("aria-") or _is_test_attr(k)
+            }
+        return re.sub(r">\s+<", "><", re.sub(r"\s+", " ", str(clone))).strip()
+
+    @staticmethod
+    def _script_strings(script_text: str, known: set):
+        # Messages set from inline JS ("Invalid Code", colours...) are what
+        # assertions check, so keep the literals without the code around them.
+        strings = []
+        for match in re.finditer(r"(['\"])((?:(?!\1).){2,100}?)\1", script_text):
+            value = match.group(2).strip()
+            if value and re.search(r"[A-Za-z]", value) and value not in known and value not in strings:
+                strings.append(value)
+        return strings[:50]
+
+    @staticmethod
+    def _style_rules(style_text: str, known: set, classes: set):
+        style_text = re.sub(r"/\*.*?\*/", "", style_text, flags=re.S)
+        rules = []
+        for selector, body in re.findall(r"([^{}]+)\{([^{}]*)\}", style_text):
+            selector = " ".join(selector.split())
+            refs = set(re.findall(r"#([\w-]+)", selector)) | set(re.findall(r"\.([\w-]+)", selector))
+            if refs & (known | classes):
+                rules.append(f"{selector} {{ {' '.join(body.split())} }}")
+        return rules[:50]
+
+    def _parsed(self):
+        with self._trees_lock:
+            if self._trees is None:
+                import lxml.html
+                from bs4 import BeautifulSoup
+
+                document = self.data["document"]
+                self._trees = (BeautifulSoup(document, "html.parser"), lxml.html.document_fromstring(document))
+            return self._trees
+
+    def count_matches(self, by: str, value: str) -> int:
+        """
+        How many elements of the page a Selenium locator (By constant name and
+        value) matches, without a browser. Raises ValueError for a selector
+        Selenium would reject.
+        """
+        locators = self.data["locators"]
+        if by == "ID":
+            return locators["ids"].get(value, 0)
+        if by == "NAME":
+            return locators["names"].get(value, 0)
+
+        soup, tree = self._parsed()
+        if by in ("CSS_SELECTOR", "CLASS_NAME", "TAG_NAME"):
+            if by == "CLASS_NAME":
+                if not value or re.search(r"\s", value):
+                    raise ValueError("compound class names are not permitted")
+                value = "." + re.sub(r"([^\w-])", r"\\\1", value)
+            import soupsieve
+
+            try:
+                return len(soup.select(value))
+            except (soupsieve.SelectorSyntaxError, NotImplementedError) as e:
+                raise ValueError(str(e).splitlines()[0])
+        if by == "XPATH":
+            from lxml import etree
+
+            try:
+                found = tree.xpath(value)
+            except etree.XPathError as e:
+                raise ValueError(str(e))
+            if not isinstance(found, list) or not all(isinstance(n, etree._Element) for n in found):
+                raise ValueError("the expression does not select elements")
+            return len(found)
+        if by in ("LINK_TEXT", "PARTIAL_LINK_TEXT"):
+            texts = [" ".join(a.get_text(" ", strip=True).split()) for a in soup.find_all("a")]
+            if by == "LINK_TEXT":
+                return sum(text == value.strip() for text in texts)
+            return sum(value in text for text in texts)
+        raise ValueError(f"unknown locator strategy By.{by}")
+
+    def _relevance(self, terms: set, text: str) -> int:
+        return len(terms & _terms(text)) if terms else 0
+
+    def select_regions(self, test_case: str = None, max_regions: int = None):
+        max_regions = max_regions or settings.DOM_MAX_REGIONS
+        terms = _terms(test_case or "")
+        scored = [
+            (self._relevance(terms, f"{r['key']} {r['text']}"), i, r)
+            for i, r in enumerate(self.regions)
+        ]
+        scored = [s for s in scored if s[0] > 0] or scored[:max_regions]
+        scored.sort(key=lambda s: (-s[0], s[1]))
+
+        picked = []
+        for _, _, region in scored:
+            if any(region["html"] in p["html"] for p in picked):
+                continue
+            picked.append(region)
+            if len(picked) >= max_regions:
+                break
+        return picked
+
+    def render(self, test_case: str = None) -> str:
+        terms = _terms(test_case or "")
+        elements = self.elements
+        if len(elements) > settings.DOM_MAX_ELEMENTS:
+            ranked = sorted(
+                enumerate(elements),
+                key=lambda pair: -self._relevance(terms, json.dumps(pair[1]))
+            )[:settings.DOM_MAX_ELEMENTS]
+            elements = [e for _, e in sorted(ranked, key=lambda pair: pair[0])]
+
+        lines = [f"PAGE TITLE: {self.data['title']}", "", "SELECTOR INDEX (tag | attributes | candidate selectors):"]
+        for e in elements:
+            tag = e["tag"] + (f"[type={e['type']}]" if e.get("type") else "")
+            attrs = [
+                f'{key}="{e[key]}"' for key in ("label", "text", "placeholder", "value", "href")
+                if e.get(key)
+            ]
+            if e.get("classes"):
+                attrs.append(f"class=\"{' '.join(e['classes'])}\"")
+            if e.get("region"):
+                attrs.append(f"in {e['region']}")
+            selectors = "; ".join(
+                f"By.{s['by']} {json.dumps(s['value'])}" + ("" if s["match"] == "unique" else " (not unique)")
+                for s in e["selectors"]
+            ) or "no stable selector"
+            lines.append(f"- {tag} | {' '.join(attrs)} | {selectors}")
+
+        if self.data["script_strings"]:
+            lines += ["", "TEXT SET BY PAGE SCRIPTS:", ", ".join(f'"{s}"' for s in self.data["script_strings"])]
+        if self.data["style_rules"]:
+            lines += ["", "RELEVANT CSS RULES:"] + self.data["style_rules"]
+
+        regions = self.select_regions(test_case)
+        if regions:
+            lines += ["", "RELEVANT DOM REGIONS (cleaned HTML):"] + [r["html"] for r in regions]
+        return "\n".join(lines)
+
+    def token_report(self, test_case: str = None) -> dict:
+        prompt_tokens = count_tokens(self.render(test_case))
+        raw = self.data["raw_tokens"]
+        return {
+            "sha256": self.sha256,
+            "raw_html_tokens": raw,
+            "index_tokens": prompt_tokens,
+            "elements": len(self.elements),
+            "regions": len(self.regions),
+            "reduction_pct": round(100 * (1 - prompt_tokens / raw), 1) if raw else 0.0,
+        }
+
+
+_memory = OrderedDict()
+_memory_lock = threading.Lock()
+
+
+def _remember(index: DomIndex):
+    with _memory_lock:
+        _memory[index.sha256] = index
+        _memory.move_to_end(index.sha256)
+        if len(_memory) > settings.DOM_INDEX_CACHE_SIZE:
+            _memory.popitem(last=False)
+
+
+def load_dom_index(sha256: str):
+    """The index of an already-parsed page by content hash, or None if it was never built (or evicted from disk)."""
+    with _memory_lock:
+        index = _memory.get(sha256)
+        if index is not None:
+            _memory.move_to_end(sha256)
+            return index
+
+    path = os.path.join(settings.DOM_INDEX_DIR, f"{sha256}.json")
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable DOM index {path}: {e}")
+        return None
+    if data.get("version") != INDEX_VERSION:
+        return None
+    index = DomIndex(data)
+    _remember(index)
+    return index
+
+
+def get_dom_index(html: str) -> DomIndex:
+    """Parses a page once per content hash: memory LRU first, then the on-disk cache."""
+    sha256 = hashlib.sha256(html.encode("utf-8")).hexdigest()
+    index = load_dom_index(sha256)
+    if index is not None:
+        return index
+
+    index = DomIndex.build(html, sha256)
+    os.makedirs(settings.DOM_INDEX_DIR, exist_ok=True)
+    path = os.path.join(settings.DOM_INDEX_DIR, f"{sha256}.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index.data, f)
+    os.replace(tmp_path, path)
+    logger.info(f"Built DOM index {sha256[:12]}: {len(index.elements)} elements, {len(index.regions)} regions")
+    _remember(index)
+    return index
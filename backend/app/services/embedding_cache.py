@@ -0,0 +1,200 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, List
+
+from langchain_core.embeddings import Embeddings
+
+from app.core.logger import get_logger
+
+logger = get_logger("embedding_cache")
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCacheStore:
+    """
+    On-disk, content-addressed embedding store keyed by (model, sha256(text)).
+    Entries carry a last-access timestamp and the oldest are evicted once the
+    store grows past max_entries, down to 90% of it.
+    """
+
+    # Rows inserted between exact counts; other workers write to the same file.
+    RECOUNT_EVERY = 1000
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model, hash)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_access ON embeddings(last_access)")
+        self._conn.commit()
+        # Upper bound on the row count: exact after each recount, plus rows inserted since.
+        self._count = None
+        self._since_count = 0
+
+    def get_many(self, model: str, hashes: List[str]) -> Dict[str, List[float]]:
+        if not hashes:
+            return {}
+
+        found = {}
+        with self._lock:
+            # SQLite caps bound parameters, so look up in slices.
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                    [model, *batch]
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = array("f", blob).tolist()
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE model = ? AND hash = ?",
+                    [(now, model, h) for h in found]
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, model: str, items: Dict[str, List[float]]):
+        if not items:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector, last_access) VALUES (?, ?, ?, ?)",
+                [(model, h, array("f", vector).tobytes(), now) for h, vector in items.items()]
+            )
+            self._evict(len(items))
+            self._conn.commit()
+
+    def _evict(self, inserted: int):
+        # Replaced rows count as inserts, so the estimate only errs high.
+        self._since_count += inserted
+        if self._count is not None:
+            self._count += inserted
+            if self._count <= self.max_entries and self._since_count < self.RECOUNT_EVERY:
+                return
+
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            # Down to 90%, so a full store does not count and evict on every insert.
+            overflow += self.max_entries // 10
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN "
+                "(SELECT rowid FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                (overflow,)
+            )
+            logger.info(f"Evicted {overflow} embeddings from cache")
+            count -= overflow
+        self._count, self._since_count = count, 0
+
+    def size(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        return count
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps any LangChain Embeddings so that repeated chunks and queries are
+    served from the shared store instead of going back to the provider.
+    """
+
+    def __init__(self, underlying: Embeddings, store: EmbeddingCacheStore, model_name: str):
+        self.underlying = underlying
+        self.store = store
+        self.model_name = model_name
+        self.hits = 0
+        self.misses = 0
+        self._counter_lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(t) for t in texts]
+        cached = self.store.get_many(self.model_name, list(set(hashes)))
+
+        # Embed each missing text once, even if it repeats inside the batch.
+        missing = {}
+        for h, text in zip(hashes, texts):
+            if h not in cached and h not in missing:
+                missing[h] = text
+
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self.store.put_many(self.model_name, fresh)
+            cached.update(fresh)
+
+        with self._counter_lock:
+            self.misses += len(missing)
+            self.hits += len(texts) - len(missing)
+
+        return [cached[h] for h in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        h = text_hash(text)
+        cached = self.store.get_many(self.model_name, [h])
+        if h in cached:
+            with self._counter_lock:
+                self.hits += 1
+            return cached[h]
+
+        vector = self.underlying.embed_query(text)
+        self.store.put_many(self.model_name, {h: vector})
+        with self._counter_lock:
+            self.misses += 1
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        # The store is synchronous SQLite, with a busy timeout: keep it off the event loop.
+        h = text_hash(text)
+        cached = await asyncio.to_thread(self.store.get_many, self.model_name, [h])
+        if h in cached:
+            with self._counter_lock:
+                self.hits += 1
+            return cached[h]
+
+        vector = await self.underlying.aembed_query(text)
+        await asyncio.to_thread(self.store.put_many, self.model_name, {h: vector})
+        with self._counter_lock:
+            self.misses += 1
+        return vector
+
+    def stats(self):
+        with self._counter_lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "model": self.model_name,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "entries": self.store.size(),
+            "max_entries": self.store.max_entries,
+        }
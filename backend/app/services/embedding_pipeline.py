@@ -0,0 +1,184 @@
+import random
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import TYPE_CHECKING, Callable, Iterable, List
+
+from langchain_core.documents import Document
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.core.tracing import stage, submit_with_context
+from app.services.tokenizer import count_tokens
+
+if TYPE_CHECKING:
+    from langchain_core.embeddings import Embeddings
+
+logger = get_logger("embedding_pipeline")
+
+
+def token_batches(chunks: Iterable[Document], max_tokens: int, max_items: int):
+    """Groups chunks so each provider request stays under a token budget."""
+    batch, batch_tokens = [], 0
+    for chunk in chunks:
+        tokens = count_tokens(chunk.page_content)
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_items):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(chunk)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def _parse_duration(value: str):
+    # OpenAI reset headers look like "1s", "6m0s" or "120ms".
+    total = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|s|m|h)", value):
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total or None
+
+
+def _retry_after(exc: Exception):
+    hinted = getattr(exc, "retry_after", None)
+    if hinted is not None:
+        return float(hinted)
+
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for header in ("retry-after-ms", "retry-after", "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        value = headers.get(header)
+        if not value:
+            continue
+        if header == "retry-after-ms":
+            return float(value) / 1000
+        try:
+            return float(value)
+        except ValueError:
+            parsed = _parse_duration(value)
+            if parsed:
+                return parsed
+    return None
+
+
+def _is_rate_limited(exc: Exception) -> bool:
+    status = getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    return status == 429 or type(exc).__name__ == "RateLimitError"
+
+
+# Provider and HTTP client errors that are worth another attempt, matched by class name (any base).
+_TRANSIENT_ERRORS = {
+    "APIConnectionError", "APITimeoutError", "InternalServerError", "ServiceUnavailableError",
+    "TransportError", "TimeoutException", "ConnectionError", "Timeout",
+}
+
+
+def _is_retryable(exc: Exception) -> bool:
+    """Rate limits, 5xx, timeouts and dropped connections; auth, bad requests and context-length errors are final."""
+    if _is_rate_limited(exc) or getattr(exc, "retry_after", None) is not None:
+        return True
+    status = getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status == 408 or status >= 500
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True
+    return any(cls.__name__ in _TRANSIENT_ERRORS for cls in type(exc).__mro__)
+
+
+def _clean_metadata(metadata: dict) -> dict:
+    # Chroma only accepts scalar metadata values; the NumPy sidecar follows suit.
+    return {
+        k: v for k, v in metadata.items()
+        if isinstance(v, (str, int, float, bool))
+    }
+
+
+class EmbeddingPipeline:
+    """
+    Embeds chunks in token-bounded batches with a bounded number of batches
+    in flight, backing off on rate limits and other transient errors (the
+    rest fail at once), and hands each finished batch to
+    the sink (the vector store upsert) while later batches are still embedding.
+    """
+
+    def __init__(
+        self,
+        embeddings: "Embeddings",
+        max_concurrency: int = None,
+        max_batch_tokens: int = None,
+        max_batch_items: int = None,
+        max_retries: int = None,
+    ):
+        self.embeddings = embeddings
+        self.max_concurrency = max_concurrency or settings.EMBEDDING_CONCURRENCY
+        self.max_batch_tokens = max_batch_tokens or settings.EMBEDDING_BATCH_TOKENS
+        self.max_batch_items = max_batch_items or settings.EMBEDDING_BATCH_SIZE
+        self.max_retries = max_retries if max_retries is not None else settings.EMBEDDING_MAX_RETRIES
+
+    def _embed_with_retry(self, texts: List[str]) -> List[List[float]]:
+        attempt = 0
+        while True:
+            try:
+                with stage("embed_batch"):
+                    return self.embeddings.embed_documents(texts)
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries or not _is_retryable(e):
+                    raise
+                hinted = _retry_after(e)
+                if hinted is None and not _is_rate_limited(e):
+                    backoff = min(2 ** attempt, 30)
+                else:
+                    backoff = hinted if hinted is not None else min(2 ** attempt, 60)
+                delay = backoff + random.uniform(0, backoff * 0.25)
+                logger.warning(f"Embedding batch failed ({e}); retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                time.sleep(delay)
+
+    def run(self, chunks: Iterable[Document], sink: Callable, progress=None) -> int:
+        """
+        sink(batch, vectors) is called on the calling thread, so vector store
+        writes stay single-writer while embedding runs concurrently.
+        Returns the number of chunks stored.
+        """
+        stored = 0
+        batches = token_batches(chunks, self.max_batch_tokens, self.max_batch_items)
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="embed") as pool:
+            in_flight = {}
+
+            def fill():
+                while len(in_flight) < self.max_concurrency:
+                    batch = next(batches, None)
+                    if batch is None:
+                        return
+                    future = submit_with_context(pool, self._embed_with_retry, [c.page_content for c in batch])
+                    in_flight[future] = batch
+
+            fill()
+            while in_flight:
+                finished, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    batch = in_flight.pop(future)
+                    vectors = future.result()
+                    if progress:
+                        progress.advance("chunks_embedded", len(batch))
+                    # Keep the pool busy while this batch is written.
+                    fill()
+                    with stage("store_batch"):
+                        sink(batch, vectors)
+                    stored += len(batch)
+                    if progress:
+                        progress.advance("chunks_stored", len(batch))
+
+        return stored
+
+
+def store_sink(store, id_fn: Callable[[Document], str]):
+    def upsert(batch: List[Document], vectors: List[List[float]]):
+        store.upsert(
+            ids=[id_fn(c) for c in batch],
+            embeddings=vectors,
+            documents=[c.page_content for c in batch],
+            metadatas=[_clean_metadata(c.metadata) or None for c in batch]
+        )
+    return upsert
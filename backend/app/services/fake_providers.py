@@ -0,0 +1,188 @@
+import asyncio
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from typing import Iterator, List
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+class RateLimitedError(Exception):
+    """Raised by fakes to mimic a provider 429 with a Retry-After hint."""
+
+    status_code = 429
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limited, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic offline stand-in for OpenAIEmbeddings.
+    Vectors are derived from the sha256 of the text, so identical text always
+    maps to the same vector. Latency is simulated per request and per token,
+    and every `rate_limit_every`-th request fails with RateLimitedError.
+    """
+
+    def __init__(
+        self,
+        size: int = 256,
+        latency_ms: float = 0.0,
+        ms_per_1k_tokens: float = 0.0,
+        rate_limit_every: int = 0,
+        retry_after: float = 0.05,
+    ):
+        self.size = size
+        self.latency_ms = latency_ms
+        self.ms_per_1k_tokens = ms_per_1k_tokens
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def _vector(self, text: str) -> List[float]:
+        seed = hashlib.sha256(text.encode("utf-8")).digest()
+        values = []
+        block = seed
+        while len(values) < self.size:
+            block = hashlib.sha256(block).digest()
+            values.extend(b / 127.5 - 1.0 for b in block)
+        values = values[:self.size]
+        norm = math.sqrt(sum(v * v for v in values)) or 1.0
+        return [v / norm for v in values]
+
+    def _call_delay(self, texts: List[str]) -> float:
+        """Counts one request; returns its simulated latency in seconds."""
+        with self._lock:
+            self.requests += 1
+            request_no = self.requests
+        if self.rate_limit_every and request_no % self.rate_limit_every == 0:
+            raise RateLimitedError(self.retry_after)
+
+        approx_tokens = sum(len(t) for t in texts) / 4
+        return (self.latency_ms + self.ms_per_1k_tokens * approx_tokens / 1000) / 1000
+
+    def _simulate_call(self, texts: List[str]):
+        delay = self._call_delay(texts)
+        if delay:
+            time.sleep(delay)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._simulate_call(texts)
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self._simulate_call([text])
+        return self._vector(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        delay = self._call_delay(texts)
+        if delay:
+            await asyncio.sleep(delay)
+        return [self._vector(t) for t in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        delay = self._call_delay([text])
+        if delay:
+            await asyncio.sleep(delay)
+        return self._vector(text)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic offline stand-in for ChatGroq / ChatOpenAI.
+    Replies are picked from the prompt hash: a markdown test plan, or a
+    Selenium script for script prompts. Simulates time to first token plus
+    a steady token rate, for both invoke and stream.
+    """
+
+    latency_ms: float = 0.0
+    tokens_per_second: float = 0.0
+    reply_tokens: int = 120
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    @staticmethod
+    def _repair_reply(prompt: str) -> List[str]:
+        # Points every failing locator at a unique selector from the index, in turn.
+        failing = json.loads(prompt.split("FAILING LOCATORS (JSON):", 1)[1].split("TARGET PAGE", 1)[0])
+        candidates = re.findall(r'By\.([A-Z_]+) ("(?:[^"\\]|\\.)*")(?! \(not unique\))', prompt)
+        repairs = [
+            {"ref": f["ref"], "by": candidates[i % len(candidates)][0], "value": json.loads(candidates[i % len(candidates)][1])}
+            for i, f in enumerate(failing)
+        ] if candidates else []
+        return [json.dumps(repairs)]
+
+    def _reply(self, messages: List[BaseMessage]) -> List[str]:
+        prompt = "\n".join(str(m.content) for m in messages)
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        if "FAILING LOCATORS (JSON):" in prompt:
+            return self._repair_reply(prompt)
+        if "Selenium" in prompt:
+            lines = [
+                "from selenium import webdriver",
+                "from selenium.webdriver.common.by import By",
+                "driver = webdriver.Chrome()",
+            ]
+            step = 'driver.find_element(By.ID, "step-{}-{}").click()'
+        else:
+            lines = [
+                "| Test Case ID | Feature | Test Scenario | Expected Result | Source Document |",
+                "|---|---|---|---|---|",
+            ]
+            step = "| TC-{}-{} | Checkout | Scenario | Works | product_specs.md |"
+
+        tokens = []
+        for line in lines:
+            tokens.extend(f"{word} " for word in line.split())
+            tokens[-1] = tokens[-1].rstrip() + "\n"
+        i = 0
+        while len(tokens) < self.reply_tokens:
+            i += 1
+            tokens.extend(f"{word} " for word in step.format(digest[:6], i).split())
+            tokens[-1] = tokens[-1].rstrip() + "\n"
+        return tokens
+
+    def _pace(self, index: int):
+        if index == 0 and self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        elif index and self.tokens_per_second:
+            time.sleep(1 / self.tokens_per_second)
+
+    def _delay(self, tokens: List[str]) -> float:
+        delay = self.latency_ms / 1000
+        if self.tokens_per_second:
+            delay += (len(tokens) - 1) / self.tokens_per_second
+        return delay
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        tokens = self._reply(messages)
+        delay = self._delay(tokens)
+        if delay:
+            time.sleep(delay)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        # Awaits like a real async client, so cancelling the caller stops the call.
+        tokens = self._reply(messages)
+        delay = self._delay(tokens)
+        if delay:
+            await asyncio.sleep(delay)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        for index, token in enumerate(self._reply(messages)):
+            self._pace(index)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
@@ -1,82 +1,232 @@
 import os
-import shutil
-import uuid
+import time
 from typing import List
-from langchain_community.document_loaders import (
-    PyMuPDFLoader, TextLoader, UnstructuredMarkdownLoader, BSHTMLLoader
-)
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
-from app.core.config import settings
-from langchain_openai import OpenAIEmbeddings
 from app.core.config import settings
 from app.core.logger import get_logger
+from app.core.tracing import current_trace, stage, trace
+from app.services.artifacts import TextArtifactWriter, dom_artifact, drop_session_artifacts, file_record, page_artifacts
+from app.services.chunking import check_strategy, chunker_for, warm_up_chunkers
+from app.services.dom_index import get_dom_index
+from app.services.embedding_pipeline import EmbeddingPipeline, store_sink
+from app.services.lexical_index import drop_lexical_index, get_lexical_index, save_lexical_index
+from app.services.parsing import parse_documents, warm_up_parsers
+from app.services.providers import ProviderRegistry, get_providers
+from app.services.session_manifest import ChunkIdAssigner, SessionManifest, session_lock
 
 logger = get_logger("ingestion_service")
 
+def warm_up_loaders():
+    warm_up_parsers()
+    warm_up_chunkers()
+
+
+class _FileState:
+    """
+    Chunk ids of one file while its pages stream in, diffed against the
+    manifest, plus the artifacts recorded for it.
+    """
+
+    def __init__(self, session_id: str, filename: str, previous: List[str], strategy: str = None):
+        self.ids = ChunkIdAssigner(filename)
+        self.chunker = chunker_for(filename, strategy)
+        self.previous = set(previous)
+        self.chunk_ids = []
+        self.new_ids = []
+        self.pages = 0
+        self.text = TextArtifactWriter(session_id, filename)
+        self.record = {}
+
+
 class IngestionService:
-    def __init__(self):
-        if not settings.OPENAI_API_KEY:
+    def __init__(self, providers: ProviderRegistry = None):
+        # The registry builds its clients lazily, so this is cheap at import time.
+        self.providers = providers or get_providers()
+
+    def process_documents(self, session_id: str, file_paths: List[str], progress=None, strategy: str = None):
+        if settings.EMBEDDING_PROVIDER != "fake" and not settings.OPENAI_API_KEY:
              raise ValueError("OPENAI_API_KEY is missing in .env config")
-             
-        self.embeddings = OpenAIEmbeddings(
-            model="text-embedding-3-small",
-            api_key=settings.OPENAI_API_KEY
-        )
-        self.vector_store = Chroma(
-            persist_directory=settings.VECTOR_DB_PATH,
-            embedding_function=self.embeddings
-        )
 
-    def _get_loader(self, file_path: str):
-        ext = os.path.splitext(file_path)[1].lower()
-        if ext == ".pdf": return PyMuPDFLoader(file_path)
-        if ext == ".md": return UnstructuredMarkdownLoader(file_path)
-        if ext == ".html": return BSHTMLLoader(file_path)
-        if ext in [".txt", ".json"]: return TextLoader(file_path, encoding="utf-8")
-        raise ValueError(f"Unsupported file type: {ext}")
-
-    def process_documents(self, session_id: str, file_paths: List[str]):
-        raw_documents = []
-        
-        for path in file_paths:
+        with trace("ingest", session_id) as t:
+            strategy = check_strategy(strategy or settings.CHUNKING_STRATEGY)
+            t.set(files=len(file_paths), chunking=strategy)
+            t.payload("upload", sum(os.path.getsize(p) for p in file_paths if os.path.exists(p)))
+            lock = session_lock(session_id)
+            with stage("lock_wait"):
+                lock.acquire()
             try:
-                loader = self._get_loader(path)
-                raw_documents.extend(loader.load())
-            except Exception as e:
-                logger.error(f"Failed to load {path}: {e}")
+                result = self._process_documents(session_id, file_paths, progress, strategy)
+            finally:
+                lock.release()
+            t.set(**{k: result[k] for k in ("chunks", "added", "removed", "unchanged") if k in result})
+            if result.get("status") != "success":
+                t.status = "error"
+            return result
+
+    def _process_documents(self, session_id: str, file_paths: List[str], progress=None, strategy: str = None):
+        """
+        Streams pages from the parser pool through each file's chunker into
+        the embedding pipeline, so only the batches in flight are held in
+        memory. Only chunks missing from the manifest are embedded; chunks
+        that vanished from a re-uploaded file are deleted afterwards.
+        """
+        manifest = SessionManifest(session_id)
+        streaming, finished, failed = {}, {}, {}
+        # Chunks already stored for files that failed part-way through.
+        orphan_ids = []
+        timings = {"parse": 0.0, "split": 0.0}
+
+        def new_chunks():
+            events = parse_documents(file_paths, strategy)
+            while True:
+                start = time.perf_counter()
+                event = next(events, None)
+                timings["parse"] += time.perf_counter() - start
+                if event is None:
+                    return
+                kind, path, payload = event
+                filename = os.path.basename(path)
 
-        if not raw_documents:
-            return {"status": "error", "message": "No valid documents parsed."}
+                if kind == "page":
+                    state = streaming.get(filename)
+                    if state is None:
+                        state = streaming[filename] = _FileState(
+                            session_id, filename, manifest.chunk_ids(filename), strategy
+                        )
+                    state.pages += 1
+                    start = time.perf_counter()
+                    text, chunks = state.chunker.split(payload)
+                    timings["split"] += time.perf_counter() - start
+                    state.text.write(text)
+                    unchanged = 0
+                    for chunk in chunks:
+                        chunk_id = state.ids.next(chunk.page_content)
+                        chunk.metadata["chunk_id"] = chunk_id
+                        state.chunk_ids.append(chunk_id)
+                        if chunk_id in state.previous:
+                            unchanged += 1
+                        else:
+                            state.new_ids.append(chunk_id)
+                            yield chunk
+                    if progress:
+                        progress.advance("chunks_produced", len(chunks))
+                        progress.advance("chunks_unchanged", unchanged)
+                    continue
 
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        chunks = text_splitter.split_documents(raw_documents)
+                state = streaming.pop(filename, None)
+                if kind == "done":
+                    state = state or _FileState(session_id, filename, manifest.chunk_ids(filename), strategy)
+                    with stage("artifacts"):
+                        state.record = {**file_record(path), "status": "parsed", "pages": state.pages}
+                        artifacts = {"text": state.text.commit()}
+                        if path.lower().endswith(".html"):
+                            # Preparse the selector index so /generate-script never reads the page.
+                            try:
+                                with stage("dom_index"), open(path, "r", encoding="utf-8") as f:
+                                    artifacts["dom_index"] = dom_artifact(get_dom_index(f.read()))
+                            except Exception as e:
+                                logger.warning(f"DOM index failed for {path}: {e}")
+                        state.record["artifacts"] = artifacts
+                    finished[filename] = state
+                else:
+                    logger.error(f"Failed to load {path}: {payload}")
+                    failed[filename] = payload
+                    if state:
+                        state.text.discard()
+                        orphan_ids.extend(state.new_ids)
+                if progress:
+                    progress.advance("files_parsed")
 
         try:
-            vector_store = Chroma(
-                collection_name=f"session_{session_id}",
-                persist_directory=settings.VECTOR_DB_PATH,
-                embedding_function=self.embeddings
+            store = self.providers.vector_store(session_id)
+            lexical = get_lexical_index(session_id)
+            upsert = store_sink(store, lambda c: c.metadata["chunk_id"])
+
+            def sink(batch, vectors):
+                upsert(batch, vectors)
+                for chunk in batch:
+                    lexical.add(chunk.metadata["chunk_id"], chunk.page_content, chunk.metadata)
+
+            pipeline = EmbeddingPipeline(self.providers.embeddings)
+            with stage("stream_embed_store"):
+                pipeline.run(new_chunks(), sink, progress=progress)
+            t = current_trace()
+            if t is not None:
+                for name, seconds in timings.items():
+                    t.add_stage(name, seconds)
+
+            stale_ids = [i for state in finished.values() for i in state.previous - set(state.chunk_ids)]
+            removed = stale_ids + orphan_ids
+            if removed:
+                with stage("delete_stale"):
+                    store.delete(removed)
+
+            # Keep the BM25 sidecar in step with the collection.
+            with stage("lexical_index"):
+                for chunk_id in removed:
+                    lexical.remove(chunk_id)
+                save_lexical_index(session_id, lexical)
+
+            with stage("manifest_save"):
+                ingested_at = time.time()
+                for filename, state in finished.items():
+                    manifest.set_chunks(filename, state.chunk_ids)
+                    manifest.set_file(filename, **state.record, ingested_at=ingested_at, last_error=None)
+                for filename, error in failed.items():
+                    # A failed re-upload keeps the chunks and artifacts of the last good version.
+                    previous = manifest.files().get(filename)
+                    status = previous.get("status", "parsed") if previous else "failed"
+                    manifest.set_file(filename, status=status, last_error=error, failed_at=ingested_at)
+                manifest.save()
+            if not finished:
+                return {"status": "error", "message": "No valid documents parsed."}
+            self.providers.response_cache.invalidate_session(session_id)
+            page_artifacts.invalidate_session(session_id)
+
+            total = sum(len(state.chunk_ids) for state in finished.values())
+            added = sum(len(state.new_ids) for state in finished.values())
+            unchanged = total - added
+            logger.info(
+                f"Session {session_id}: Ingested {total} chunks "
+                f"({added} new, {len(stale_ids)} removed, {unchanged} unchanged)."
             )
-            vector_store.add_documents(documents=chunks)
-            
-            logger.info(f"Session {session_id}: Ingested {len(chunks)} chunks.")
-            return {"status": "success", "chunks": len(chunks), "message": "Knowledge Base Built."}
+            return {
+                "status": "success",
+                "chunks": total,
+                "added": added,
+                "removed": len(stale_ids),
+                "unchanged": unchanged,
+                "message": "Knowledge Base Built."
+            }
             
         except Exception as e:
             logger.error(f"Vector DB Error: {e}")
             return {"status": "error", "message": str(e)}
+        finally:
+            for state in streaming.values():
+                state.text.discard()
 
     def delete_session_data(self, session_id: str):
-        try:
-            vector_store = Chroma(
-                collection_name=f"session_{session_id}",
-                persist_directory=settings.VECTOR_DB_PATH,
-                embedding_function=self.embeddings
-            )
-            vector_store.delete_collection()
-            logger.info(f"Cleaned up session {session_id}")
-            return True
-        except Exception as e:
-            logger.warning(f"Cleanup failed for {session_id}: {e}")
-            return False
\ No newline at end of file
+        """
+        Removes everything stored for the session. Each step runs even when
+        an earlier one fails (e.g. a collection that was never created), so
+        one error cannot leave the rest behind; True only if all succeeded.
+        """
+        steps = (
+            ("vector store", self.providers.drop_session),
+            ("manifest", lambda sid: SessionManifest(sid).delete()),
+            ("lexical index", drop_lexical_index),
+            ("artifacts", drop_session_artifacts),
+            ("response cache", self.providers.response_cache.invalidate_session),
+        )
+        failed = []
+        with session_lock(session_id):
+            for name, step in steps:
+                try:
+                    step(session_id)
+                except Exception as e:
+                    logger.warning(f"Cleanup of the {name} failed for {session_id}: {e}")
+                    failed.append(name)
+        if failed:
+            return False
+        logger.info(f"Cleaned up session {session_id}")
+        return True
\ No newline at end of file
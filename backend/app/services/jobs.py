@@ -0,0 +1,189 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.core.tracing import submit_with_context
+
+logger = get_logger("ingestion_jobs")
+
+STAGES = ("files_parsed", "chunks_produced", "chunks_unchanged", "chunks_embedded", "chunks_stored")
+
+
+class IngestionJob:
+    def __init__(self, session_id: str, file_paths: List[str], store=None):
+        self.job_id = str(uuid.uuid4())
+        self.session_id = session_id
+        self.file_paths = file_paths
+        self.status = "queued"
+        self.progress = {"files_total": len(file_paths), **{stage: 0 for stage in STAGES}}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self._lock = threading.Lock()
+        # Shared state store other workers poll this job through, if any.
+        self._store = store
+        self._published_at = 0.0
+
+    def _publish(self, force: bool = False):
+        if self._store is None:
+            return
+        if not force and self.updated_at - self._published_at < settings.JOB_PROGRESS_INTERVAL_SECONDS:
+            return
+        self._published_at = self.updated_at
+        try:
+            self._store.save_job(self.to_dict())
+        except Exception as e:
+            logger.warning(f"Could not publish ingestion job {self.job_id}: {e}")
+
+    def advance(self, stage: str, count: int = 1):
+        with self._lock:
+            self.progress[stage] += count
+            self.updated_at = time.time()
+        self._publish()
+
+    def set_total(self, stage: str, total: int):
+        with self._lock:
+            self.progress[stage] = total
+            self.updated_at = time.time()
+        self._publish()
+
+    def finish(self, status: str, result=None, error: str = None):
+        with self._lock:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.updated_at = time.time()
+        self._publish(force=True)
+
+    @property
+    def done(self):
+        return self.status in ("completed", "failed")
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "job_id": self.job_id,
+                "session_id": self.session_id,
+                "status": self.status,
+                "progress": dict(self.progress),
+                "result": self.result,
+                "error": self.error,
+                "created_at": self.created_at,
+                "updated_at": self.updated_at,
+            }
+
+
+class StoredJob:
+    """A job run by another worker process, as last published to the state store."""
+
+    def __init__(self, data: dict):
+        self.data = data
+        self.job_id = data["job_id"]
+        self.session_id = data["session_id"]
+        self.status = data["status"]
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+class IngestionJobManager:
+    """
+    Runs ingestion pipelines on a bounded worker pool so the API event loop
+    never waits on parsing, embedding or vector store writes. With a shared
+    state store, jobs are also published there so any worker can report them,
+    and a heartbeat keeps them marked alive: a job whose worker died is
+    failed once it goes JOB_STALE_SECONDS without one, instead of being
+    polled as "running" forever.
+    """
+
+    def __init__(self, max_workers: int = None, store=None):
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or settings.INGEST_WORKERS,
+            thread_name_prefix="ingest"
+        )
+        self.store = store
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._heartbeat = None
+
+    def submit(self, session_id: str, file_paths: List[str], pipeline: Callable) -> IngestionJob:
+        job = IngestionJob(session_id, file_paths, store=self.store)
+        with self._lock:
+            self._prune()
+            self._jobs[job.job_id] = job
+            self._start_heartbeat()
+        job._publish(force=True)
+        # Carries the request id over, so the job's trace links back to its POST /ingest.
+        submit_with_context(self.executor, self._run, job, pipeline)
+        logger.info(f"Session {session_id}: Queued ingestion job {job.job_id} ({len(file_paths)} files)")
+        return job
+
+    def get(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            data = self.store.load_job(job_id)
+            if data and data["status"] in ("queued", "running") and data["updated_at"] < self._stale_cutoff():
+                self._fail_stale(job_id)
+                data = self.store.load_job(job_id)
+            job = StoredJob(data) if data else None
+        return job
+
+    @staticmethod
+    def _stale_cutoff() -> float:
+        return time.time() - settings.JOB_STALE_SECONDS
+
+    def _fail_stale(self, job_id: str = None):
+        try:
+            failed = self.store.fail_stale_jobs(
+                self._stale_cutoff(), "The worker running this ingestion stopped. Please upload the files again.", job_id
+            )
+            if failed:
+                logger.warning(f"Failed {failed} ingestion jobs whose worker stopped")
+        except Exception as e:
+            logger.warning(f"Could not fail stale ingestion jobs: {e}")
+
+    def _start_heartbeat(self):
+        if self.store is None or self._heartbeat is not None:
+            return
+        self._heartbeat = threading.Thread(target=self._beat, name="ingest-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def _beat(self):
+        while True:
+            time.sleep(settings.JOB_HEARTBEAT_SECONDS)
+            with self._lock:
+                live = [jid for jid, job in self._jobs.items() if not job.done]
+            if not live:
+                continue
+            try:
+                self.store.heartbeat_jobs(live, time.time())
+            except Exception as e:
+                logger.warning(f"Could not mark ingestion jobs alive: {e}")
+
+    def _run(self, job: IngestionJob, pipeline: Callable):
+        job.finish("running")
+        try:
+            result = pipeline(job.session_id, job.file_paths, progress=job)
+            status = "completed" if result.get("status") == "success" else "failed"
+            job.finish(status, result=result, error=None if status == "completed" else result.get("message"))
+        except Exception as e:
+            logger.error(f"Ingestion job {job.job_id} failed: {e}")
+            job.finish("failed", error=str(e))
+
+    def _prune(self):
+        cutoff = time.time() - settings.JOB_RETENTION_MINUTES * 60
+        expired = [jid for jid, job in self._jobs.items() if job.done and job.updated_at < cutoff]
+        for jid in expired:
+            del self._jobs[jid]
+        if self.store is not None:
+            self._fail_stale()
+            try:
+                self.store.prune_jobs(cutoff)
+            except Exception as e:
+                logger.warning(f"Could not prune stored ingestion jobs: {e}")
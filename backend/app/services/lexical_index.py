@@ -0,0 +1,177 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from typing import List, Tuple
+
+from langchain_core.documents import Document
+
+from app.core.config import settings
+from app.core.logger import get_logger
+
+logger = get_logger("lexical_index")
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased word tokens. Compound tokens such as "pay-now-btn" or
+    "error_email" are kept whole (exact element ids, coupon codes) and
+    also split into their parts.
+    """
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower()):
+        tokens.append(token)
+        if re.search(r"[-_.]", token):
+            tokens.extend(p for p in re.split(r"[-_.]", token) if p)
+    return tokens
+
+
+def _terms(text: str, metadata: dict) -> List[str]:
+    # Headings a chunk sits under count as its words too, so "discount rules" finds the rules' body.
+    return tokenize(text) + tokenize(metadata.get("section_path") or "")
+
+
+class BM25Index:
+    """In-memory Okapi BM25 over one session's chunks, keyed by chunk id."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs = {}
+        self._postings = defaultdict(dict)
+        self._lengths = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, chunk_id: str, text: str, metadata: dict):
+        counts = Counter(_terms(text, metadata))
+        with self._lock:
+            if chunk_id in self.docs:
+                self.remove(chunk_id)
+            self.docs[chunk_id] = {"text": text, "metadata": metadata}
+            self._lengths[chunk_id] = sum(counts.values())
+            self._total_length += self._lengths[chunk_id]
+            for term, tf in counts.items():
+                self._postings[term][chunk_id] = tf
+
+    def remove(self, chunk_id: str):
+        with self._lock:
+            doc = self.docs.pop(chunk_id, None)
+            if doc is None:
+                return
+            self._total_length -= self._lengths.pop(chunk_id)
+            for term in set(_terms(doc["text"], doc["metadata"])):
+                postings = self._postings.get(term)
+                if postings is not None:
+                    postings.pop(chunk_id, None)
+                    if not postings:
+                        del self._postings[term]
+
+    def search(self, query: str, k: int) -> List[Tuple[Document, float]]:
+        with self._lock:
+            return self._search(query, k)
+
+    def _search(self, query: str, k: int) -> List[Tuple[Document, float]]:
+        if not self.docs:
+            return []
+
+        n = len(self.docs)
+        avg_length = self._total_length / n or 1.0
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[chunk_id] / avg_length)
+                scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [
+            (Document(page_content=self.docs[cid]["text"], metadata=self.docs[cid]["metadata"]), score)
+            for cid, score in ranked
+        ]
+
+    def to_dict(self):
+        with self._lock:
+            return {"k1": self.k1, "b": self.b, "docs": dict(self.docs)}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BM25Index":
+        index = cls(data.get("k1", 1.5), data.get("b", 0.75))
+        for chunk_id, doc in data.get("docs", {}).items():
+            index.add(chunk_id, doc["text"], doc["metadata"])
+        return index
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def _index_path(session_id: str) -> str:
+    return os.path.join(settings.LEXICAL_INDEX_DIR, f"session_{session_id}.json")
+
+
+def _sidecar_version(path: str):
+    # Not the mtime alone: two saves within one tick of a coarse clock would look the same.
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+
+def get_lexical_index(session_id: str) -> BM25Index:
+    """
+    Loaded from the sidecar file next to the vector store data, then kept in
+    an LRU. Reloaded when the sidecar changes, e.g. after another worker
+    process ingested into the session.
+    """
+    path = _index_path(session_id)
+    version = _sidecar_version(path)
+    with _indexes_lock:
+        entry = _indexes.get(session_id)
+        if entry is not None and entry[0] == version:
+            _indexes.move_to_end(session_id)
+            return entry[1]
+
+        index = BM25Index()
+        if version is not None:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    index = BM25Index.from_dict(json.load(f))
+            except Exception as e:
+                logger.warning(f"Session {session_id}: Ignoring unreadable lexical index ({e})")
+
+        _indexes[session_id] = (version, index)
+        _indexes.move_to_end(session_id)
+        if len(_indexes) > settings.LEXICAL_INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+        return index
+
+
+def save_lexical_index(session_id: str, index: BM25Index):
+    os.makedirs(settings.LEXICAL_INDEX_DIR, exist_ok=True)
+    path = _index_path(session_id)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index.to_dict(), f)
+    os.replace(tmp_path, path)
+    with _indexes_lock:
+        _indexes[session_id] = (_sidecar_version(path), index)
+
+
+def drop_lexical_index(session_id: str):
+    with _indexes_lock:
+        _indexes.pop(session_id, None)
+    path = _index_path(session_id)
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,187 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable
+
+from app.core.logger import get_logger
+from app.core.tracing import current_trace
+
+logger = get_logger("limiter")
+
+
+class Overloaded(Exception):
+    """No provider slot for this request: 429 when the queue is full, 503 when the wait timed out."""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("state", "event", "loop", "future")
+
+    def __init__(self, loop=None):
+        self.state = "waiting"
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+            self.future = None
+        else:
+            self.event = None
+            self.future = loop.create_future()
+
+    def wake(self):
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class ProviderLimiter:
+    """
+    Bounds the provider work (retrieval plus the LLM call) in flight in this
+    process, for async requests and worker threads alike. Callers past
+    `limit` queue in FIFO order; once `max_waiting` are queued new callers
+    are turned away, and a caller still queued after `wait_timeout` gives up.
+    Either way the caller gets Overloaded with a Retry-After estimate instead
+    of piling more work onto a saturated server.
+    """
+
+    def __init__(self, limit: int, max_waiting: int, wait_timeout: float):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self._active = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+        # Moving average of how long a slot is held, for Retry-After.
+        self._hold_seconds = 1.0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def _retry_after(self) -> int:
+        return max(1, math.ceil(self._hold_seconds * (len(self._waiters) + 1) / self.limit))
+
+    def _enter(self, waiter: _Waiter) -> bool:
+        """Takes a free slot (True) or queues `waiter` (False)."""
+        with self._lock:
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+                self.admitted += 1
+                return True
+            if len(self._waiters) >= self.max_waiting:
+                self.rejected += 1
+                raise Overloaded(
+                    f"Server busy: {len(self._waiters)} requests already waiting for a model slot.",
+                    429, self._retry_after()
+                )
+            self._waiters.append(waiter)
+            return False
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Takes `waiter` out of the queue; True if it was granted a slot meanwhile."""
+        with self._lock:
+            if waiter.state == "granted":
+                return True
+            waiter.state = "abandoned"
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+            return False
+
+    def _timed_out(self):
+        with self._lock:
+            self.timed_out += 1
+            retry_after = self._retry_after()
+        raise Overloaded(f"Server busy: no model slot freed up within {self.wait_timeout:g}s.", 503, retry_after)
+
+    def _release(self, held: float):
+        with self._lock:
+            self._hold_seconds = 0.9 * self._hold_seconds + 0.1 * held
+            # Hand the slot straight to the next live waiter, so it cannot be taken out of turn.
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if waiter.state == "waiting":
+                    waiter.state = "granted"
+                    self.admitted += 1
+                    waiter.wake()
+                    return
+            self._active -= 1
+
+    def _releaser(self, waited: float) -> Callable[[], None]:
+        t = current_trace()
+        if t is not None and waited:
+            t.add_stage("queue_wait", waited)
+        start = time.perf_counter()
+        released = []
+
+        def release():
+            if not released:
+                released.append(True)
+                self._release(time.perf_counter() - start)
+
+        return release
+
+    async def enter(self) -> Callable[[], None]:
+        """Waits for a slot; returns the function that gives it back."""
+        waiter = _Waiter(asyncio.get_running_loop())
+        start = time.perf_counter()
+        if not self._enter(waiter):
+            # Not wait_for: it swallows a cancel that lands after the grant, and the slot would leak.
+            try:
+                await asyncio.wait({waiter.future}, timeout=self.wait_timeout)
+            except BaseException:
+                if self._abandon(waiter):
+                    self._release(0.0)
+                raise
+            if not self._abandon(waiter):
+                self._timed_out()
+        return self._releaser(time.perf_counter() - start)
+
+    def enter_sync(self) -> Callable[[], None]:
+        """enter() for worker threads."""
+        waiter = _Waiter()
+        start = time.perf_counter()
+        if not self._enter(waiter):
+            if not waiter.event.wait(self.wait_timeout) and not self._abandon(waiter):
+                self._timed_out()
+        return self._releaser(time.perf_counter() - start)
+
+    @asynccontextmanager
+    async def slot(self):
+        release = await self.enter()
+        try:
+            yield
+        finally:
+            release()
+
+    @contextmanager
+    def slot_sync(self):
+        release = self.enter_sync()
+        try:
+            yield
+        finally:
+            release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "active": self._active,
+                "waiting": len(self._waiters),
+                "max_waiting": self.max_waiting,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "avg_hold_seconds": round(self._hold_seconds, 3),
+            }
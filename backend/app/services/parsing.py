@@ -0,0 +1,455 @@
+import importlib
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from multiprocessing.connection import wait as wait_connections
+from typing import Iterable, Iterator, Tuple
+
+from langchain_core.document_loaders import BaseLoader
+from langchain_core.documents import Document
+
+from app.core.config import settings
+from app.core.logger import get_logger
+
+logger = get_logger("parsing")
+
+# Loader class (in langchain_community.document_loaders) and kwargs per extension.
+# Classes are imported on first use: the loaders package is slow to import and
+# PDF support alone pulls in image parsers.
+LOADERS = {
+    ".pdf": ("PyMuPDFLoader", {}),
+    ".md": ("UnstructuredMarkdownLoader", {}),
+    ".html": ("BSHTMLLoader", {}),
+    ".txt": ("TextLoader", {"encoding": "utf-8"}),
+    ".json": ("TextLoader", {"encoding": "utf-8"}),
+}
+
+# The structured chunking strategy needs Markdown and HTML as written, and PDF
+# pages with their blocks (see app.services.chunking).
+STRUCTURED_LOADERS = {
+    **LOADERS,
+    ".pdf": ("PdfBlockLoader", {}),
+    ".md": ("TextLoader", {"encoding": "utf-8"}),
+    ".html": ("TextLoader", {"encoding": "utf-8"}),
+}
+
+# What the loaders import only inside load(); workers import them up front.
+PARSER_MODULES = (
+    "langchain_community.document_loaders.pdf",
+    "langchain_community.document_loaders.markdown",
+    "langchain_community.document_loaders.html_bs",
+    "langchain_community.document_loaders.text",
+    "unstructured.partition.md",
+    "pymupdf",
+    "bs4",
+)
+
+
+class PdfBlockLoader(BaseLoader):
+    """
+    One document per PDF page, its text blocks separated by blank lines in
+    reading order. Blocks set in a clearly larger font than the page's body
+    text are recorded as headings in "_headings" (block index -> level),
+    levels ranking the heading sizes seen so far in the document.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+
+    @staticmethod
+    def _blocks(page):
+        blocks = []
+        for block in page.get_text("dict", sort=True)["blocks"]:
+            if block.get("type") != 0:
+                continue
+            lines, size, chars = [], 0.0, 0
+            for line in block["lines"]:
+                text = "".join(span["text"] for span in line["spans"]).strip()
+                if text:
+                    lines.append(text)
+                for span in line["spans"]:
+                    if span["text"].strip():
+                        size = max(size, span["size"])
+                        chars += len(span["text"])
+            if lines:
+                blocks.append(("\n".join(lines), round(size, 1), chars))
+        return blocks
+
+    def lazy_load(self) -> Iterator[Document]:
+        import pymupdf
+
+        heading_sizes = set()
+        with pymupdf.open(self.file_path) as pdf:
+            for number, page in enumerate(pdf):
+                blocks = self._blocks(page)
+                weights = {}
+                for _, size, chars in blocks:
+                    weights[size] = weights.get(size, 0) + chars
+                body = max(weights, key=weights.get) if weights else 0.0
+                marked = [
+                    (i, size) for i, (text, size, _) in enumerate(blocks)
+                    if body and size >= body * 1.15 and len(text) <= 150 and text.count("\n") < 3
+                ]
+                heading_sizes.update(size for _, size in marked)
+                ranks = sorted(heading_sizes, reverse=True)
+                headings = {i: ranks.index(size) + 1 for i, size in marked}
+                yield Document(
+                    page_content="\n\n".join(text for text, _, _ in blocks),
+                    metadata={
+                        "source": self.file_path, "file_path": self.file_path,
+                        "page": number, "total_pages": len(pdf), "_headings": headings,
+                    },
+                )
+
+
+# Loaders of this package, by the names used in STRUCTURED_LOADERS.
+LOCAL_LOADERS = {"PdfBlockLoader": PdfBlockLoader}
+
+
+def loader_class(name: str):
+    if name in LOCAL_LOADERS:
+        return LOCAL_LOADERS[name]
+    return getattr(importlib.import_module("langchain_community.document_loaders"), name)
+
+
+def loader_for(path: str, strategy: str = None):
+    """Loader name and kwargs for a file under the given (or configured) chunking strategy."""
+    ext = os.path.splitext(path)[1].lower()
+    loaders = LOADERS if (strategy or settings.CHUNKING_STRATEGY) == "recursive" else STRUCTURED_LOADERS
+    if ext not in loaders:
+        raise ValueError(f"Unsupported file type: {ext}")
+    return loaders[ext]
+
+
+# --- Worker process side ---
+
+def _virtual_memory_bytes():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _limit_memory(limit_mb: int):
+    """Caps the worker's address space at its warm size plus `limit_mb` (POSIX only)."""
+    try:
+        import resource
+    except ImportError:
+        return
+    baseline = _virtual_memory_bytes()
+    if not limit_mb or baseline is None:
+        return
+    limit = baseline + limit_mb * 1024 * 1024
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _worker_main(conn, memory_limit_mb: int):
+    # Import every parser before capping memory, so the cap only bounds parsing.
+    # Under forkserver these are already loaded in the server we forked from.
+    for module in PARSER_MODULES:
+        try:
+            importlib.import_module(module)
+        except Exception:
+            pass
+    _limit_memory(memory_limit_mb)
+
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, OSError):
+            return
+        if task is None:
+            return
+        path, name, kwargs = task
+        try:
+            pages = 0
+            for doc in loader_class(name)(path, **kwargs).lazy_load():
+                conn.send(("page", doc.page_content, doc.metadata))
+                pages += 1
+            conn.send(("done", pages))
+        except MemoryError:
+            # The heap may be in a bad state: report and let the pool replace us.
+            try:
+                conn.send(("fatal", f"exceeded the {memory_limit_mb} MB parser memory limit"))
+            except Exception:
+                pass
+            return
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+# --- Parent side ---
+
+class _Worker:
+    def __init__(self, context, memory_limit_mb: int):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_conn, memory_limit_mb), name="qa-agent-parser", daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.files = 0
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        self.kill()
+
+
+class _ActiveFile:
+    __slots__ = ("worker", "path", "pages", "waited")
+
+    def __init__(self, worker: _Worker, path: str):
+        self.worker = worker
+        self.path = path
+        self.pages = 0
+        self.waited = 0.0
+
+
+class ParserPool:
+    """
+    Long-lived loader processes. Each parses one file at a time and streams
+    its pages back as they are produced. A worker that overruns the file's
+    time budget, exits or hits its memory cap is killed and replaced, which
+    fails that file only.
+
+    The time budget counts only time spent waiting on the worker, not time
+    the consumer spends embedding pages it already received.
+    """
+
+    def __init__(self, workers: int, timeout: float, memory_limit_mb: int, max_files_per_worker: int = 0):
+        self.size = workers
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.max_files_per_worker = max_files_per_worker
+        methods = multiprocessing.get_all_start_methods()
+        # Never fork the API process itself: it runs event loop and pool threads.
+        self._context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        if self._context.get_start_method() == "forkserver":
+            self._context.set_forkserver_preload([__name__, *PARSER_MODULES])
+        self._slots = threading.BoundedSemaphore(workers)
+        self._idle = []
+        self._workers = set()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._counters = {"files": 0, "failed": 0, "timeouts": 0, "restarts": 0}
+
+    def _count(self, *names):
+        with self._lock:
+            for name in names:
+                self._counters[name] += 1
+
+    def _acquire(self, blocking: bool):
+        if not self._slots.acquire(blocking=blocking):
+            return None
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        try:
+            worker = _Worker(self._context, self.memory_limit_mb)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._workers.add(worker)
+        return worker
+
+    def _release(self, worker: _Worker, reusable: bool):
+        worker.files += 1
+        recycle = self.max_files_per_worker and worker.files >= self.max_files_per_worker
+        with self._lock:
+            keep = reusable and not recycle and not self._closed and worker.process.is_alive()
+            if keep:
+                self._idle.append(worker)
+            else:
+                self._workers.discard(worker)
+        if not keep:
+            if reusable:
+                worker.close()
+            else:
+                self._count("restarts")
+                worker.kill()
+        self._slots.release()
+
+    def start(self):
+        """Starts idle workers ahead of the first ingest."""
+        workers = []
+        while len(workers) < self.size:
+            worker = self._acquire(blocking=False)
+            if worker is None:
+                break
+            workers.append(worker)
+        with self._lock:
+            self._idle.extend(workers)
+        for _ in workers:
+            self._slots.release()
+
+    def parse(self, paths: Iterable[str], strategy: str = None) -> Iterator[Tuple[str, str, object]]:
+        """
+        Yields ("page", path, Document) as pages arrive from any worker,
+        then ("done", path, page_count) or ("failed", path, reason) once per file.
+        Files are parsed in parallel, up to the pool size, with the loaders
+        of the chunking strategy.
+        """
+        pending = deque(paths)
+        active = {}
+        try:
+            while pending or active:
+                while pending:
+                    path = pending[0]
+                    try:
+                        name, kwargs = loader_for(path, strategy)
+                    except ValueError as e:
+                        pending.popleft()
+                        yield "failed", path, str(e)
+                        continue
+                    # Block for a worker only when nothing else is in flight.
+                    worker = self._acquire(blocking=not active)
+                    if worker is None:
+                        break
+                    pending.popleft()
+                    try:
+                        worker.conn.send((path, name, kwargs))
+                    except OSError as e:
+                        self._release(worker, reusable=False)
+                        yield "failed", path, f"parser process unavailable: {e}"
+                        continue
+                    active[worker.conn] = _ActiveFile(worker, path)
+
+                if not active:
+                    continue
+
+                budget = max(0.0, min(self.timeout - f.waited for f in active.values()))
+                started = time.monotonic()
+                ready = wait_connections(list(active), timeout=budget)
+                waited = time.monotonic() - started
+                for f in active.values():
+                    f.waited += waited
+
+                for conn in ready:
+                    f = active[conn]
+                    try:
+                        message = conn.recv()
+                    except (EOFError, OSError):
+                        del active[conn]
+                        f.worker.process.join(timeout=1)
+                        self._release(f.worker, reusable=False)
+                        self._count("failed")
+                        yield "failed", f.path, f"parser process exited (code {f.worker.process.exitcode})"
+                        continue
+
+                    kind = message[0]
+                    if kind == "page":
+                        f.pages += 1
+                        yield "page", f.path, Document(page_content=message[1], metadata=message[2])
+                    elif kind == "done":
+                        del active[conn]
+                        self._release(f.worker, reusable=True)
+                        self._count("files")
+                        yield "done", f.path, f.pages
+                    else:
+                        del active[conn]
+                        self._release(f.worker, reusable=kind == "error")
+                        self._count("failed")
+                        yield "failed", f.path, message[1]
+
+                for conn, f in list(active.items()):
+                    if f.waited >= self.timeout:
+                        del active[conn]
+                        self._release(f.worker, reusable=False)
+                        self._count("timeouts", "failed")
+                        yield "failed", f.path, f"timed out after {self.timeout:g}s ({f.pages} pages read)"
+        finally:
+            # The consumer stopped early: workers mid-file cannot be reused.
+            for f in active.values():
+                self._release(f.worker, reusable=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": len(self._workers),
+                "idle": len(self._idle),
+                "start_method": self._context.get_start_method(),
+                **self._counters,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            workers = list(self._idle)
+            self._idle.clear()
+            self._workers.difference_update(workers)
+        for worker in workers:
+            worker.close()
+
+
+def parse_in_process(paths: Iterable[str], strategy: str = None) -> Iterator[Tuple[str, str, object]]:
+    """Same events as ParserPool.parse, on the calling thread and without limits."""
+    for path in paths:
+        try:
+            name, kwargs = loader_for(path, strategy)
+            pages = 0
+            for doc in loader_class(name)(path, **kwargs).lazy_load():
+                pages += 1
+                yield "page", path, doc
+        except Exception as e:
+            yield "failed", path, f"{type(e).__name__}: {e}"
+            continue
+        yield "done", path, pages
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_parser_pool():
+    """The shared pool, or None when PARSE_WORKERS is 0 (parse in-process)."""
+    global _pool
+    if settings.PARSE_WORKERS <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ParserPool(
+                    settings.PARSE_WORKERS,
+                    settings.PARSE_TIMEOUT_SECONDS,
+                    settings.PARSE_MEMORY_LIMIT_MB,
+                    settings.PARSE_WORKER_MAX_FILES,
+                )
+    return _pool
+
+
+def parse_documents(paths: Iterable[str], strategy: str = None) -> Iterator[Tuple[str, str, object]]:
+    pool = get_parser_pool()
+    if pool is None:
+        return parse_in_process(paths, strategy)
+    return pool.parse(paths, strategy)
+
+
+def warm_up_parsers():
+    pool = get_parser_pool()
+    if pool is None:
+        for name in sorted({name for name, _ in [*LOADERS.values(), *STRUCTURED_LOADERS.values()]}):
+            loader_class(name)
+    else:
+        pool.start()
+
+
+def shutdown_parsers():
+    if _pool is not None:
+        _pool.shutdown()
@@ -0,0 +1,78 @@
+import re
+from typing import List
+
+# Header aliases for the table TestGenAgent is prompted to produce:
+# | Test Case ID | Feature | Test Scenario | Expected Result | Source Document |
+COLUMN_ALIASES = {
+    "id": ("test case id", "id", "tc id", "case id"),
+    "feature": ("feature", "module", "area"),
+    "scenario": ("test scenario", "scenario", "test case", "description", "steps"),
+    "expected": ("expected result", "expected", "expected outcome"),
+    "source": ("source document", "source", "reference"),
+}
+
+
+def _cells(line: str) -> List[str]:
+    line = line.strip()
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|"):
+        line = line[:-1]
+    return [c.strip() for c in re.split(r"(?<!\\)\|", line)]
+
+
+def _is_separator(line: str) -> bool:
+    return bool(re.fullmatch(r"\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?", line.strip()))
+
+
+def case_text(case: dict) -> str:
+    """Single test-case string in the shape /generate-script expects."""
+    parts = []
+    if case.get("id"):
+        parts.append(f"{case['id']}:")
+    if case.get("feature"):
+        parts.append(f"[{case['feature']}]")
+    parts.append(case.get("scenario", ""))
+    text = " ".join(p for p in parts if p).strip()
+    if case.get("expected"):
+        text += f" Expected Result: {case['expected']}"
+    return text
+
+
+def parse_test_plan(plan: str) -> List[dict]:
+    """
+    Turns the markdown table returned by TestGenAgent into structured cases.
+    Falls back to one case per bullet / numbered line for non-table plans.
+    """
+    lines = [l for l in (plan or "").splitlines() if l.strip()]
+    table = [l for l in lines if l.strip().startswith("|")]
+
+    if len(table) >= 2 and _is_separator(table[1]):
+        headers = [h.lower().strip("* ") for h in _cells(table[0])]
+        columns = {}
+        for field, aliases in COLUMN_ALIASES.items():
+            for i, header in enumerate(headers):
+                if header in aliases and field not in columns:
+                    columns[field] = i
+
+        cases = []
+        for row in table[2:]:
+            if _is_separator(row):
+                continue
+            cells = _cells(row)
+            case = {field: cells[i] for field, i in columns.items() if i < len(cells) and cells[i]}
+            if "scenario" not in case:
+                # Unknown header layout: keep the whole row as the scenario.
+                case["scenario"] = " | ".join(c for c in cells if c)
+            if case["scenario"]:
+                case["test_case"] = case_text(case)
+                cases.append(case)
+        return cases
+
+    cases = []
+    for line in lines:
+        match = re.match(r"^\s*(?:[-*+]|\d+[.)])\s+(.*)$", line)
+        if match and match.group(1).strip():
+            scenario = match.group(1).strip()
+            cases.append({"scenario": scenario, "test_case": scenario})
+    return cases
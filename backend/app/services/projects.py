@@ -0,0 +1,111 @@
+import os
+import re
+import shutil
+from typing import List, Optional
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.services.artifacts import file_record
+from app.services.parsing import LOADERS
+from app.services.session_manifest import (
+    PROJECT_PREFIX, SessionManifest, is_project_key, manifest_keys, manifest_version, project_key, session_lock
+)
+
+logger = get_logger("projects")
+
+# Ends up in a Chroma collection name: at most 63 of [a-zA-Z0-9._-], alphanumeric at both ends.
+PROJECT_NAME_RE = re.compile(r"^[a-z0-9](?:[a-z0-9._-]{0,38}[a-z0-9])?$")
+
+
+def check_project_name(name: str) -> str:
+    """Raises ValueError for a name that cannot key a project."""
+    if not PROJECT_NAME_RE.match(name or ""):
+        raise ValueError(
+            "Project names are 1-40 lowercase letters, digits, '.', '_' or '-', "
+            "starting and ending with a letter or digit."
+        )
+    return name
+
+
+def project_exists(name: str) -> bool:
+    return manifest_version(project_key(name)) is not None
+
+
+def project_upload_dir(name: str) -> str:
+    return os.path.join(settings.UPLOAD_DIR, project_key(name))
+
+
+def describe_project(name: str) -> dict:
+    manifest = SessionManifest(project_key(name))
+    files = manifest.files()
+    version = manifest_version(project_key(name))
+    return {
+        "name": name,
+        "files": len(files),
+        "chunks": sum(len(entry.get("chunks", [])) for entry in files.values()),
+        "fingerprint": manifest.fingerprint()[:16],
+        "updated_at": version[0] / 1e9 if version else None,
+    }
+
+
+def list_projects() -> List[dict]:
+    names = sorted(key[len(PROJECT_PREFIX):] for key in manifest_keys() if is_project_key(key))
+    return [describe_project(name) for name in names]
+
+
+def attach_project(session_id: str, name: Optional[str]):
+    """
+    Layers the session's uploads on top of a project knowledge base (None
+    detaches). Nothing is copied or embedded: retrieval reads both.
+    Raises LookupError for a project that was never ingested.
+    """
+    if name is not None:
+        check_project_name(name)
+        if not project_exists(name):
+            raise LookupError(f"Unknown project '{name}'.")
+    with session_lock(session_id):
+        manifest = SessionManifest(session_id)
+        manifest.attach(name)
+        manifest.save()
+    logger.info(f"Session {session_id}: Attached project {name}" if name else f"Session {session_id}: Detached project")
+
+
+def seed_project(ingestion_service, name: str, directory: str) -> dict:
+    """
+    Ingests the supported files under `directory` into a project, skipping
+    the run when every file matches what the project already holds, so
+    restarts and extra workers re-embed nothing. The check, the copy and
+    the ingest all run under the project's lock.
+    """
+    check_project_name(name)
+    key = project_key(name)
+    sources = {}
+    for root, _, files in os.walk(directory):
+        for filename in sorted(files):
+            if os.path.splitext(filename)[1].lower() not in LOADERS:
+                continue
+            if filename in sources:
+                logger.warning(f"Project {name}: Skipping {os.path.join(root, filename)}, {filename} is already seeded")
+                continue
+            sources[filename] = os.path.join(root, filename)
+
+    # Every worker seeds at startup: the first to take the lock ingests, the rest then find nothing changed.
+    with session_lock(key):
+        known = SessionManifest(key).files()
+        changed = [
+            path for filename, path in sorted(sources.items())
+            if known.get(filename, {}).get("sha256") != file_record(path)["sha256"]
+        ]
+        if not changed:
+            logger.info(f"Project {name}: {len(sources)} files from {directory} already ingested")
+            return {"status": "unchanged", "files": len(sources)}
+
+        upload_dir = project_upload_dir(name)
+        os.makedirs(upload_dir, exist_ok=True)
+        paths = []
+        for path in changed:
+            target = os.path.join(upload_dir, os.path.basename(path))
+            shutil.copyfile(path, target)
+            paths.append(target)
+        logger.info(f"Project {name}: Ingesting {len(paths)} new or changed files from {directory}")
+        return ingestion_service.process_documents(key, paths)
@@ -0,0 +1,72 @@
+# Prompts are compiled once, on first use (langchain_core.prompts is slow to
+# import), and shared by every agent instance.
+
+TEST_GEN_TEMPLATE = (
+    """
+    You are an expert QA Automation Lead. Generate comprehensive test cases strictly based on the provided documentation.
+
+    CONTEXT:
+    {context}
+
+    REQUEST:
+    {question}
+
+    OUTPUT:
+    Return a Markdown table with columns: | Test Case ID | Feature | Test Scenario | Expected Result | Source Document |
+    """
+)
+
+SCRIPT_GEN_TEMPLATE = (
+    """
+    You are a Senior QA Automation Engineer. Write a Python Selenium script to automate the following test case.
+
+    1. TEST CASE:
+    {test_case}
+
+    2. DOCUMENTATION RULES (Logic/UI requirements):
+    {context}
+
+    3. TARGET PAGE (Selector index + relevant DOM regions of the uploaded HTML):
+    {page_context}
+
+    REQUIREMENTS:
+    - Use 'webdriver_manager' and 'headless' Chrome options.
+    - Use robust selectors (ID, Name, CSS) based strictly on the selector index above; prefer selectors not marked "(not unique)".
+    - ASSERTIONS: Use the DOCUMENTATION RULES to write specific assertions (e.g., if doc says error is red, check CSS color).
+    - If the documentation contradicts the HTML, trust the HTML for selectors but note the logic discrepancy in comments.
+    - Return ONLY the Python code. No markdown backticks.
+    """
+)
+
+SELECTOR_REPAIR_TEMPLATE = (
+    """
+    You are a Senior QA Automation Engineer fixing selectors in a Selenium script. Each locator below was checked
+    against the target page and either matches nothing, matches several elements, or is not a valid selector.
+
+    FAILING LOCATORS (JSON):
+    {failing}
+
+    TARGET PAGE (Selector index + relevant DOM regions of the uploaded HTML):
+    {page_context}
+
+    REQUIREMENTS:
+    - For every failing locator pick the element the script most likely meant, using the line of code for intent.
+    - Use only selectors from the selector index that are not marked "(not unique)".
+    - Return ONLY a JSON array of {{"ref": <ref>, "by": "<ID|NAME|CSS_SELECTOR|XPATH|LINK_TEXT>", "value": "<selector>"}}.
+      Leave out locators you cannot fix. No markdown backticks.
+    """
+)
+
+_TEMPLATES = {
+    "TEST_GEN_PROMPT": TEST_GEN_TEMPLATE,
+    "SCRIPT_GEN_PROMPT": SCRIPT_GEN_TEMPLATE,
+    "SELECTOR_REPAIR_PROMPT": SELECTOR_REPAIR_TEMPLATE,
+}
+
+
+def __getattr__(name):
+    if name not in _TEMPLATES:
+        raise AttributeError(name)
+    from langchain_core.prompts import ChatPromptTemplate
+    prompt = globals()[name] = ChatPromptTemplate.from_template(_TEMPLATES[name])
+    return prompt
@@ -0,0 +1,223 @@
+import threading
+import time
+from collections import OrderedDict
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.services.response_cache import ResponseCache
+from app.services.limiter import ProviderLimiter
+from app.services.single_flight import SingleFlight
+
+logger = get_logger("providers")
+
+
+class ProviderRegistry:
+    """
+    Process-wide model clients, built once and shared by every request.
+    Embeddings, LLM and the vector backend keep their own connection pools,
+    so reusing them here is what makes keep-alive actually work.
+
+    Each client (and its SDK import) is built on first use or by warm_up(),
+    so importing the app stays cheap and a missing key only fails the
+    feature that needs it.
+    """
+
+    def __init__(self):
+        self._embeddings = None
+        self._llm = None
+        self._vectors = None
+        self._embedding_model = None
+        self._llm_model = None
+        self._build_lock = threading.RLock()
+        self.response_cache = ResponseCache(settings.RESPONSE_CACHE_MAX_ENTRIES, settings.RESPONSE_CACHE_TTL_SECONDS)
+        # Identical generations in flight at once share one LLM call.
+        self.single_flight = SingleFlight()
+        # Every retrieval + LLM call holds one of these slots.
+        self.limiter = ProviderLimiter(
+            settings.PROVIDER_CONCURRENCY, settings.PROVIDER_QUEUE_SIZE, settings.PROVIDER_QUEUE_TIMEOUT_SECONDS
+        )
+
+        self._stores = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def embeddings(self):
+        if self._embeddings is None:
+            with self._build_lock:
+                if self._embeddings is None:
+                    embeddings = self._build_embeddings()
+                    if settings.EMBEDDING_CACHE_ENABLED:
+                        from app.services.embedding_cache import CachedEmbeddings, EmbeddingCacheStore
+                        # Content-addressed cache shared by every session and process restart.
+                        embeddings = CachedEmbeddings(
+                            embeddings,
+                            EmbeddingCacheStore(settings.EMBEDDING_CACHE_PATH, settings.EMBEDDING_CACHE_MAX_ENTRIES),
+                            model_name=self._embedding_model
+                        )
+                    self._embeddings = embeddings
+        return self._embeddings
+
+    @property
+    def embedding_model(self) -> str:
+        self.embeddings
+        return self._embedding_model
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            with self._build_lock:
+                if self._llm is None:
+                    self._llm = self._build_llm()
+                    logger.info(f"LLM client ready ({self._llm_model})")
+        return self._llm
+
+    @property
+    def llm_model(self) -> str:
+        self.llm
+        return self._llm_model
+
+    @property
+    def vectors(self):
+        if self._vectors is None:
+            with self._build_lock:
+                if self._vectors is None:
+                    from app.services.vector_store import build_backend
+                    self._vectors = build_backend()
+        return self._vectors
+
+    def warm_up(self) -> dict:
+        """Builds every client now; called off the event loop once the server is up."""
+        timings = {}
+        for name in ("embeddings", "llm", "vectors"):
+            start = time.perf_counter()
+            getattr(self, name)
+            timings[name] = round(time.perf_counter() - start, 3)
+        logger.info(f"Provider registry ready (llm={self._llm_model}, build seconds={timings})")
+        return timings
+
+    def _build_embeddings(self):
+        if settings.EMBEDDING_PROVIDER == "fake":
+            from app.services.fake_providers import FakeEmbeddings
+            # Offline stand-in for load tests and throughput benchmarks.
+            self._embedding_model = "fake"
+            return FakeEmbeddings(
+                latency_ms=settings.FAKE_EMBEDDING_LATENCY_MS,
+                ms_per_1k_tokens=settings.FAKE_EMBEDDING_MS_PER_1K_TOKENS
+            )
+        if settings.OPENAI_API_KEY:
+            from langchain_openai import OpenAIEmbeddings
+            self._embedding_model = settings.EMBEDDING_MODEL
+            return OpenAIEmbeddings(
+                model=settings.EMBEDDING_MODEL,
+                api_key=settings.OPENAI_API_KEY
+            )
+        # Fallback for local dev if needed, but per previous steps we use OpenAI
+        from langchain_huggingface import HuggingFaceEmbeddings
+        self._embedding_model = "all-MiniLM-L6-v2"
+        return HuggingFaceEmbeddings(model_name=self._embedding_model)
+
+    def _build_llm(self):
+        if settings.LLM_PROVIDER == "fake":
+            from app.services.fake_providers import FakeChatModel
+            self._llm_model = "fake"
+            return FakeChatModel(
+                latency_ms=settings.FAKE_LLM_LATENCY_MS,
+                tokens_per_second=settings.FAKE_LLM_TOKENS_PER_SECOND,
+                reply_tokens=settings.FAKE_LLM_REPLY_TOKENS
+            )
+        if settings.GROQ_API_KEY:
+            from langchain_groq import ChatGroq
+            self._llm_model = "llama3-70b-8192"
+            return ChatGroq(
+                api_key=settings.GROQ_API_KEY,
+                model=self._llm_model,
+                temperature=settings.LLM_TEMPERATURE,
+                timeout=settings.LLM_TIMEOUT_SECONDS
+            )
+        if settings.OPENAI_API_KEY:
+            from langchain_openai import ChatOpenAI
+            self._llm_model = "gpt-4o"
+            return ChatOpenAI(
+                api_key=settings.OPENAI_API_KEY,
+                model=self._llm_model,
+                temperature=settings.LLM_TEMPERATURE,
+                timeout=settings.LLM_TIMEOUT_SECONDS,
+                # Token usage on the last chunk of a stream, so traces need not re-encode it.
+                stream_usage=True
+            )
+        logger.error("No LLM API Key found in settings.")
+        raise ValueError("LLM Configuration Error")
+
+    def vector_store(self, session_id: str) -> "SessionVectorStore":
+        # Session stores are thin views over the shared backend; keep a small
+        # LRU of them so hot sessions skip the collection lookup / sidecar load.
+        # A Chroma server is shared with other workers, which may drop and
+        # recreate a collection under a cached handle, so look it up each time.
+        if getattr(self.vectors, "remote", False):
+            return self.vectors.session(session_id)
+        with self._lock:
+            store = self._stores.get(session_id)
+            if store is not None:
+                self._stores.move_to_end(session_id)
+                return store
+
+            store = self.vectors.session(session_id)
+            self._stores[session_id] = store
+            if len(self._stores) > settings.VECTOR_STORE_CACHE_SIZE:
+                self._stores.popitem(last=False)
+            return store
+
+    def retriever(self, session_id: str, k: int, mode: str = None):
+        from app.services.retrieval import HybridRetriever
+        from app.services.session_manifest import attached_project, manifest_files, project_key
+
+        # A session attached to a project retrieves from the project's collection too.
+        layers = {}
+        project = attached_project(session_id)
+        if project:
+            base_id = project_key(project)
+            layers = {
+                "base_id": base_id,
+                "base_store": self.vector_store(base_id),
+                "shadowed": manifest_files(session_id) & manifest_files(base_id),
+            }
+        return HybridRetriever(
+            session_id=session_id,
+            vector_store=self.vector_store(session_id),
+            embeddings=self.embeddings,
+            k=k,
+            mode=mode or settings.RETRIEVAL_MODE,
+            **layers
+        )
+
+    def stats(self):
+        return {
+            "embedding_cache": self._embeddings.stats() if hasattr(self._embeddings, "stats") else None,
+            "response_cache": self.response_cache.stats(),
+            "single_flight": self.single_flight.stats(),
+            "limiter": self.limiter.stats(),
+            "vector_backend": self._vectors.name if self._vectors is not None else settings.VECTOR_BACKEND,
+            "warm": self.is_warm,
+        }
+
+    @property
+    def is_warm(self) -> bool:
+        return None not in (self._embeddings, self._llm, self._vectors)
+
+    def drop_session(self, session_id: str):
+        with self._lock:
+            self._stores.pop(session_id, None)
+        self.vectors.drop(session_id)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_providers() -> ProviderRegistry:
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ProviderRegistry()
+    return _registry
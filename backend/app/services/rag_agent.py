@@ -1,86 +1,186 @@
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
-from langchain_groq import ChatGroq
-from langchain_openai import ChatOpenAI
+import asyncio
+import time
 
 from app.core.config import settings
 from app.core.logger import get_logger
+from app.core.tracing import Trace, stage, trace
+from app.services.context_builder import ContextBuilder
+from app.services.limiter import Overloaded
+from app.services import prompts
+from app.services.providers import ProviderRegistry, get_providers
+from app.services.response_cache import doc_ids, response_key
+from app.services.retrieval import RetrievalTimeout
+from app.services.session_manifest import kb_fingerprint
+from app.services.single_flight import flight_key
+from app.services.tokenizer import arecord_llm_usage, llm_usage, record_llm_usage
 
 logger = get_logger("rag_agent")
 
 class TestGenAgent:
-    def __init__(self, session_id: str):
+    def __init__(self, session_id: str, providers: ProviderRegistry = None, retrieval_mode: str = None):
         self.session_id = session_id
 
-        if not settings.OPENAI_API_KEY:
+        if settings.EMBEDDING_PROVIDER != "fake" and not settings.OPENAI_API_KEY:
              raise ValueError("OPENAI_API_KEY is missing in .env config")
-             
-        self.embeddings = OpenAIEmbeddings(
-            model="text-embedding-3-small",
-            api_key=settings.OPENAI_API_KEY
-        )
-        
-        self.vector_store = Chroma(
-            collection_name=f"session_{session_id}", 
-            persist_directory=settings.VECTOR_DB_PATH,
-            embedding_function=self.embeddings
+
+        # Clients are shared process-wide; only the retriever view is per session.
+        self.providers = providers or get_providers()
+        self.embeddings = self.providers.embeddings
+        self.llm = self.providers.llm
+        self.retriever = self.providers.retriever(session_id, k=settings.CONTEXT_CANDIDATES, mode=retrieval_mode)
+        self.prompt = prompts.TEST_GEN_PROMPT
+        self.context_builder = ContextBuilder(
+            self.providers.llm_model, self.prompt,
+            context=settings.TEST_CONTEXT_TOKENS, question=settings.TEST_CASE_TOKENS
         )
-        
-        self.retriever = self.vector_store.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": 3}
+        self.cache = self.providers.response_cache
+        self.flights = self.providers.single_flight
+        self.limiter = self.providers.limiter
+
+    def _cache_key(self, query: str, docs) -> str:
+        return response_key(
+            "tests", {"query": query}, doc_ids(docs),
+            self.providers.llm_model, settings.LLM_TEMPERATURE, kb_fingerprint(self.session_id)
         )
 
-        if settings.GROQ_API_KEY:
-            self.llm = ChatGroq(
-                api_key=settings.GROQ_API_KEY,
-                model="llama3-70b-8192",
-                temperature=0.1
-            )
-        elif settings.OPENAI_API_KEY:
-            self.llm = ChatOpenAI(
-                api_key=settings.OPENAI_API_KEY,
-                model="gpt-4o",
-                temperature=0.1
-            )
-        else:
-            logger.error("No LLM API Key found in settings.")
-            raise ValueError("LLM Configuration Error")
-
-        self.prompt = ChatPromptTemplate.from_template(
-            """
-            You are an expert QA Automation Lead. Generate comprehensive test cases strictly based on the provided documentation.
-            
-            CONTEXT:
-            {context}
-            
-            REQUEST: 
-            {question}
-            
-            OUTPUT:
-            Return a Markdown table with columns: | Test Case ID | Feature | Test Scenario | Expected Result | Source Document |
-            """
+    def _retrieve(self, query: str):
+        with stage("retrieve"):
+            docs = self.retriever.invoke(query)
+        with stage("cache_lookup"):
+            key = self._cache_key(query, docs)
+            cached = self.cache.get(key)
+        return docs, key, cached
+
+    def _render(self, query: str, docs, t):
+        with stage("context_build"):
+            context = self.context_builder.context(docs, trace=t)
+            question = self.context_builder.fit("question", query)
+        with stage("prompt_render"):
+            return self.prompt.invoke({"context": context, "question": question})
+
+    def _flight_key(self, query: str) -> str:
+        return flight_key(
+            "tests", {"query": query, "mode": self.retriever.mode},
+            self.providers.llm_model, settings.LLM_TEMPERATURE, kb_fingerprint(self.session_id)
         )
 
+    def _generate(self, query: str, t):
+        with self.limiter.slot_sync():
+            docs, key, cached = self._retrieve(query)
+            t.set(cache_hit=cached is not None, context_chunks=len(docs))
+            if cached is not None:
+                logger.info(f"Session {self.session_id}: Serving test plan from response cache")
+                return cached
+
+            prompt_value = self._render(query, docs, t)
+            # The prompt is rendered separately so its cost and size can be traced.
+            with stage("llm_generate"):
+                message = self.llm.invoke(prompt_value)
+            response = message.content
+        record_llm_usage(t, prompt_value.to_string(), response, usage=llm_usage(message))
+        self.cache.put(key, self.session_id, response)
+        return response
+
     def generate_tests(self, query: str):
         logger.info(f"Session {self.session_id}: Generating tests for query '{query}'")
-        
-        rag_chain = (
-            {"context": self.retriever | self._format_docs, "question": RunnablePassthrough()}
-            | self.prompt
-            | self.llm
-            | StrOutputParser()
-        )
-        
+
         try:
-            response = rag_chain.invoke(query)
-            return response
+            with trace("generate_tests", self.session_id) as t:
+                start = time.perf_counter()
+                response, shared = self.flights.do(self._flight_key(query), lambda: self._generate(query, t))
+                t.set(coalesced=shared)
+                if shared:
+                    t.add_stage("coalesced_wait", time.perf_counter() - start)
+                    logger.info(f"Session {self.session_id}: Shared the result of an identical request in flight")
+                return response
         except Exception as e:
             logger.error(f"RAG Generation failed: {e}")
             return "Error generating test cases. Please ensure documents are uploaded."
 
-    def _format_docs(self, docs):
-        return "\n\n".join(doc.page_content for doc in docs)
\ No newline at end of file
+    async def _agenerate(self, query: str, t):
+        async with self.limiter.slot():
+            with stage("retrieve"):
+                docs = await self.retriever.ainvoke(query)
+            with stage("cache_lookup"):
+                key = self._cache_key(query, docs)
+                cached = self.cache.get(key)
+            t.set(cache_hit=cached is not None, context_chunks=len(docs))
+            if cached is not None:
+                logger.info(f"Session {self.session_id}: Serving test plan from response cache")
+                return cached
+
+            prompt_value = self._render(query, docs, t)
+            with stage("llm_generate"):
+                message = await asyncio.wait_for(self.llm.ainvoke(prompt_value), settings.LLM_TIMEOUT_SECONDS)
+            response = message.content
+        await arecord_llm_usage(t, prompt_value.to_string(), response, usage=llm_usage(message))
+        self.cache.put(key, self.session_id, response)
+        return response
+
+    async def agenerate_tests(self, query: str):
+        """
+        generate_tests on the event loop: retrieval and the LLM call are
+        awaited, under a provider slot and LLM_TIMEOUT_SECONDS. Overloaded,
+        timeouts and cancellation reach the caller; other failures become
+        the usual error text.
+        """
+        logger.info(f"Session {self.session_id}: Generating tests for query '{query}'")
+
+        try:
+            with trace("generate_tests", self.session_id) as t:
+                try:
+                    start = time.perf_counter()
+                    response, shared = await self.flights.ado(self._flight_key(query), lambda: self._agenerate(query, t))
+                except asyncio.CancelledError:
+                    t.status = "cancelled"
+                    raise
+                t.set(coalesced=shared)
+                if shared:
+                    t.add_stage("coalesced_wait", time.perf_counter() - start)
+                    logger.info(f"Session {self.session_id}: Shared the result of an identical request in flight")
+                return response
+        except (Overloaded, RetrievalTimeout, asyncio.TimeoutError):
+            raise
+        except Exception as e:
+            logger.error(f"RAG Generation failed: {e}")
+            return "Error generating test cases. Please ensure documents are uploaded."
+
+    def stream_tests(self, query: str):
+        """Yields the test plan token by token as the model produces it."""
+        logger.info(f"Session {self.session_id}: Streaming tests for query '{query}'")
+
+        # Each next() may run on a different worker thread, so the trace is
+        # only made active around the work done between yields.
+        t = Trace("stream_tests", self.session_id)
+        try:
+            with t.active():
+                docs, key, cached = self._retrieve(query)
+                t.set(cache_hit=cached is not None, context_chunks=len(docs))
+            if cached is not None:
+                yield cached
+                return
+
+            with t.active():
+                prompt_value = self._render(query, docs, t)
+            parts, usage = [], None
+            start = time.perf_counter()
+            for chunk in self.llm.stream(prompt_value):
+                # Providers that report usage on a stream do so on its last chunk.
+                usage = llm_usage(chunk) or usage
+                if chunk.content:
+                    if not parts:
+                        t.add_stage("llm_first_token", time.perf_counter() - start)
+                    parts.append(chunk.content)
+                    yield chunk.content
+            t.add_stage("llm_generate", time.perf_counter() - start)
+            response = "".join(parts)
+            record_llm_usage(t, prompt_value.to_string(), response, usage=usage)
+            self.cache.put(key, self.session_id, response)
+        except GeneratorExit:
+            t.status = "cancelled"
+            raise
+        except Exception:
+            t.status = "error"
+            raise
+        finally:
+            t.finish()
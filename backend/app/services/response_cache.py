@@ -0,0 +1,87 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List
+
+from app.core.logger import get_logger
+
+logger = get_logger("response_cache")
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text or "").strip()
+
+
+def response_key(kind: str, inputs: dict, chunk_ids: List[str], model: str, temperature: float, fingerprint: str) -> str:
+    payload = {
+        "kind": kind,
+        "inputs": {k: normalize_text(v) for k, v in sorted(inputs.items())},
+        "chunks": list(chunk_ids),
+        "model": model,
+        "temperature": temperature,
+        "kb": fingerprint,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def doc_ids(docs) -> List[str]:
+    return [d.metadata.get("chunk_id") or getattr(d, "id", None) or d.page_content[:64] for d in docs]
+
+
+class ResponseCache:
+    """
+    In-memory TTL + LRU cache of finished LLM responses. Keys include the
+    session's knowledge-base fingerprint, so re-ingesting changes every key;
+    invalidate_session also drops the stale entries eagerly.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] < time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, session_id: str, value: str):
+        with self._lock:
+            self._entries[key] = (session_id, value, time.time() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_session(self, session_id: str) -> int:
+        with self._lock:
+            stale = [k for k, entry in self._entries.items() if entry[0] == session_id]
+            for k in stale:
+                del self._entries[k]
+        if stale:
+            logger.info(f"Session {session_id}: Invalidated {len(stale)} cached responses")
+        return len(stale)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+            }
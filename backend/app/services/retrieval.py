@@ -0,0 +1,165 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, FrozenSet, List, Optional, Tuple
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.core.tracing import stage, submit_with_context
+from app.services.lexical_index import get_lexical_index
+
+logger = get_logger("retrieval")
+
+RETRIEVAL_MODES = ("hybrid", "dense", "lexical")
+
+# Dense searches run here so a slow embedding provider can be timed out.
+_dense_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="dense-search")
+
+
+class RetrievalTimeout(Exception):
+    """Dense-only retrieval took longer than DENSE_RETRIEVAL_TIMEOUT_SECONDS; the other modes fall back to BM25."""
+
+    def __init__(self):
+        super().__init__(f"Retrieval did not answer within {settings.DENSE_RETRIEVAL_TIMEOUT_SECONDS:g}s.")
+
+
+def _doc_key(doc: Document) -> str:
+    return doc.metadata.get("chunk_id") or doc.page_content
+
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], k: int, rrf_k: int) -> List[Document]:
+    scores, docs = {}, {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = _doc_key(doc)
+            docs.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+    ordered = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [docs[key] for key in ordered]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Fuses vector-store similarity search with the session's BM25 index using
+    reciprocal rank fusion. Exact tokens (coupon codes, element ids, error
+    strings) are found by the lexical side; "lexical" mode skips the
+    embedding call entirely and is also the fallback when dense search
+    fails or exceeds its timeout. `ainvoke` runs the same steps natively
+    async: the query embedding is awaited, index lookups go to a thread.
+
+    A session attached to a project searches two layers: its own uploads
+    (the overlay) and the project's collection (the base), embedding the
+    query once and fusing every ranking. Base chunks from files the session
+    has re-uploaded are dropped, so the overlay's version wins.
+    """
+
+    session_id: str
+    vector_store: Any
+    embeddings: Any
+    k: int = 3
+    mode: str = "hybrid"
+    base_id: Optional[str] = None
+    base_store: Any = None
+    shadowed: FrozenSet[str] = frozenset()
+
+    def _layers(self) -> List[Tuple[str, Any]]:
+        layers = [(self.session_id, self.vector_store)]
+        if self.base_id:
+            layers.append((self.base_id, self.base_store))
+        return layers
+
+    def _visible(self, layer_id: str, docs: List[Document]) -> List[Document]:
+        if layer_id == self.session_id or not self.shadowed:
+            return docs
+        return [doc for doc in docs if os.path.basename(doc.metadata.get("source", "")) not in self.shadowed]
+
+    def _fuse(self, rankings: List[List[Document]], k: int) -> List[Document]:
+        if len(rankings) == 1:
+            return rankings[0][:k]
+        return reciprocal_rank_fusion(rankings, k, settings.RRF_K)
+
+    def _dense_search(self, query: str, fetch_k: int) -> List[List[Document]]:
+        with stage("embed_query"):
+            embedding = self.embeddings.embed_query(query)
+        with stage("vector_search"):
+            return [
+                self._visible(layer_id, [doc for doc, _ in store.search(embedding, fetch_k)])
+                for layer_id, store in self._layers()
+            ]
+
+    def _dense(self, query: str, fetch_k: int) -> List[List[Document]]:
+        future = submit_with_context(_dense_pool, self._dense_search, query, fetch_k)
+        return future.result(timeout=settings.DENSE_RETRIEVAL_TIMEOUT_SECONDS)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        fetch_k = self.k * settings.HYBRID_FETCH_MULTIPLIER
+
+        if self.mode == "dense":
+            try:
+                return self._fuse(self._dense(query, self.k), self.k)
+            except FutureTimeout:
+                raise RetrievalTimeout() from None
+
+        with stage("lexical_search"):
+            lexical = self._lexical(query, fetch_k)
+        if self.mode == "lexical":
+            return self._fuse(lexical, self.k)
+
+        try:
+            dense = self._dense(query, fetch_k)
+        except FutureTimeout:
+            logger.warning(f"Session {self.session_id}: Dense retrieval timed out, using lexical results")
+            return self._fuse(lexical, self.k)
+        except Exception as e:
+            logger.warning(f"Session {self.session_id}: Dense retrieval failed ({e}), using lexical results")
+            return self._fuse(lexical, self.k)
+
+        return reciprocal_rank_fusion(dense + lexical, self.k, settings.RRF_K)
+
+    def _lexical(self, query: str, fetch_k: int) -> List[List[Document]]:
+        return [
+            self._visible(layer_id, [doc for doc, _ in get_lexical_index(layer_id).search(query, fetch_k)])
+            for layer_id, _ in self._layers()
+        ]
+
+    async def _adense_search(self, query: str, fetch_k: int) -> List[List[Document]]:
+        with stage("embed_query"):
+            embedding = await self.embeddings.aembed_query(query)
+        with stage("vector_search"):
+            layers = self._layers()
+            hits = await asyncio.gather(*(asyncio.to_thread(store.search, embedding, fetch_k) for _, store in layers))
+        return [self._visible(layer_id, [doc for doc, _ in found]) for (layer_id, _), found in zip(layers, hits)]
+
+    async def _adense(self, query: str, fetch_k: int) -> List[List[Document]]:
+        return await asyncio.wait_for(self._adense_search(query, fetch_k), settings.DENSE_RETRIEVAL_TIMEOUT_SECONDS)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        fetch_k = self.k * settings.HYBRID_FETCH_MULTIPLIER
+
+        if self.mode == "dense":
+            try:
+                return self._fuse(await self._adense(query, self.k), self.k)
+            except asyncio.TimeoutError:
+                raise RetrievalTimeout() from None
+
+        with stage("lexical_search"):
+            lexical = await asyncio.to_thread(self._lexical, query, fetch_k)
+        if self.mode == "lexical":
+            return self._fuse(lexical, self.k)
+
+        try:
+            dense = await self._adense(query, fetch_k)
+        except asyncio.TimeoutError:
+            logger.warning(f"Session {self.session_id}: Dense retrieval timed out, using lexical results")
+            return self._fuse(lexical, self.k)
+        except Exception as e:
+            logger.warning(f"Session {self.session_id}: Dense retrieval failed ({e}), using lexical results")
+            return self._fuse(lexical, self.k)
+
+        return reciprocal_rank_fusion(dense + lexical, self.k, settings.RRF_K)
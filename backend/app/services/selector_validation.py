@@ -0,0 +1,263 @@
+import ast
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.services.dom_index import DomIndex
+
+logger = get_logger("selector_validation")
+
+# Selenium's By constants and the strategy strings they stand for.
+BY_VALUES = {
+    "ID": "id", "NAME": "name", "CSS_SELECTOR": "css selector", "XPATH": "xpath",
+    "LINK_TEXT": "link text", "PARTIAL_LINK_TEXT": "partial link text",
+    "TAG_NAME": "tag name", "CLASS_NAME": "class name",
+}
+BY_NAMES = {value: name for name, value in BY_VALUES.items()}
+FAILING = ("missing", "ambiguous", "invalid")
+STATUSES = ("unique", "present", "ambiguous", "missing", "invalid", "dynamic")
+
+# Used when the script does not parse (usually cut off mid-line): literal locators only.
+_LOCATOR_RE = re.compile(
+    r"""(?:By\.(?P<const>[A-Z_]+)|(?P<q1>["'])(?P<strategy>[a-z ]+)(?P=q1))\s*,\s*(?P<q2>["'])(?P<value>(?:\\.|(?!(?P=q2)).)*)(?P=q2)"""
+)
+
+# Scripts of a batch are checked here, off the request thread and in parallel.
+_validation_pool = ThreadPoolExecutor(max_workers=settings.SELECTOR_VALIDATION_WORKERS, thread_name_prefix="selector-check")
+
+
+def strip_fences(script: str) -> str:
+    script = re.sub(r"^```[a-zA-Z]*\n", "", (script or "").strip())
+    return re.sub(r"\n```$", "", script)
+
+
+def _by(node) -> Optional[str]:
+    if isinstance(node, ast.Attribute) and node.attr in BY_VALUES:
+        return node.attr
+    if isinstance(node, ast.Constant) and node.value in BY_NAMES:
+        return BY_NAMES[node.value]
+    return None
+
+
+def _constants(tree) -> dict:
+    """Module names bound exactly once to a string literal, e.g. PROMO_INPUT = "promo-code"."""
+    values, seen = {}, set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            name = node.targets[0].id
+            if name in seen:
+                values.pop(name, None)
+                continue
+            seen.add(name)
+            if isinstance(node.value, ast.Constant) and isinstance(node.value.value, str):
+                values[name] = node.value.value
+    return values
+
+
+def _call_name(func) -> str:
+    if isinstance(func, ast.Attribute):
+        return func.attr
+    return func.id if isinstance(func, ast.Name) else ""
+
+
+def _document_scope(receiver) -> bool:
+    # driver.find_element searches the page; element.find_element only under that element.
+    name = ast.unparse(receiver).split(".")[-1].lower()
+    return "driver" in name or "browser" in name
+
+
+def _locator(by_node, value_node, constants: dict, call: str, scope: str, plural: bool) -> dict:
+    value = None
+    if isinstance(value_node, ast.Constant) and isinstance(value_node.value, str):
+        value = value_node.value
+    elif isinstance(value_node, ast.Name):
+        value = constants.get(value_node.id)
+    locator = {
+        "line": by_node.lineno, "by": _by(by_node), "value": value,
+        "call": call, "scope": scope, "plural": plural,
+    }
+    if isinstance(value_node, ast.Constant) and value_node.end_lineno is not None:
+        locator["_span"] = (by_node.lineno, by_node.col_offset, value_node.end_lineno, value_node.end_col_offset)
+        locator["_string_by"] = isinstance(by_node, ast.Constant)
+    return locator
+
+
+def extract_locators(script: str) -> Tuple[List[dict], Optional[str]]:
+    """
+    Every locator in the script, in source order: find_element(s) calls and
+    (By.X, value) tuples such as expected-condition arguments. Returns
+    (locators, parse_error); a script that does not parse is scanned for
+    literal locators instead.
+    """
+    source = strip_fences(script)
+    try:
+        tree = ast.parse(source)
+    except SyntaxError as e:
+        locators = []
+        for match in _LOCATOR_RE.finditer(source):
+            by = match.group("const") if match.group("const") in BY_VALUES else BY_NAMES.get(match.group("strategy"))
+            if by:
+                locators.append({
+                    "line": source.count("\n", 0, match.start()) + 1, "by": by, "value": match.group("value"),
+                    "call": "locator", "scope": "document", "plural": False,
+                })
+        return locators, f"line {e.lineno}: {e.msg}"
+
+    constants = _constants(tree)
+    locators, tuples = [], set()
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        call = _call_name(node.func)
+        if call in ("find_element", "find_elements") and isinstance(node.func, ast.Attribute):
+            keywords = {k.arg: k.value for k in node.keywords}
+            by_node = node.args[0] if node.args else keywords.get("by")
+            value_node = node.args[1] if len(node.args) > 1 else keywords.get("value")
+            if by_node is not None and value_node is not None and _by(by_node):
+                scope = "document" if _document_scope(node.func.value) else "element"
+                locators.append(_locator(by_node, value_node, constants, call, scope, call == "find_elements"))
+            continue
+        for arg in node.args:
+            if isinstance(arg, ast.Tuple) and len(arg.elts) == 2 and _by(arg.elts[0]):
+                tuples.add(id(arg))
+                locators.append(_locator(arg.elts[0], arg.elts[1], constants, call, "document", "all_elements" in call))
+
+    # Locator tuples bound to names, e.g. CHECKOUT = (By.ID, "checkout-btn").
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Tuple) and id(node.value) not in tuples:
+            elts = node.value.elts
+            if len(elts) == 2 and _by(elts[0]):
+                locators.append(_locator(elts[0], elts[1], constants, "locator", "document", False))
+
+    locators.sort(key=lambda loc: loc["line"])
+    return locators, None
+
+
+def classify(locator: dict, dom_index: DomIndex) -> dict:
+    """Adds match count and status: unique, present (fine for lookups that may match several), ambiguous, missing, invalid or dynamic."""
+    result = {k: v for k, v in locator.items() if not k.startswith("_")}
+    if locator["value"] is None:
+        result.update(matches=None, status="dynamic")
+        return result
+
+    value = locator["value"]
+    if locator["by"] == "XPATH" and locator["scope"] == "element" and value.startswith("."):
+        # Relative to an element: anywhere under the document is the closest we get.
+        value = "//" + value.lstrip("./")
+    try:
+        matches = dom_index.count_matches(locator["by"], value)
+    except ValueError as e:
+        result.update(matches=None, status="invalid", error=str(e))
+        return result
+
+    if matches == 0:
+        status = "missing"
+    elif locator["plural"] or locator["scope"] == "element":
+        status = "present"
+    else:
+        status = "unique" if matches == 1 else "ambiguous"
+    result.update(matches=matches, status=status)
+    return result
+
+
+def validate_script(script: str, dom_index: DomIndex) -> dict:
+    """Resolves every locator of a generated script against the page's DOM index."""
+    locators, parse_error = extract_locators(script)
+    selectors = []
+    for ref, locator in enumerate(locators):
+        result = classify(locator, dom_index)
+        result["ref"] = ref
+        selectors.append(result)
+
+    summary = {status: 0 for status in STATUSES}
+    for selector in selectors:
+        summary[selector["status"]] += 1
+    return {
+        "page": dom_index.sha256,
+        "selectors": selectors,
+        "summary": summary,
+        "valid": not any(summary[status] for status in FAILING),
+        "parse_error": parse_error,
+    }
+
+
+def validate_scripts(scripts: List[str], dom_index: DomIndex) -> List[dict]:
+    """validate_script for many scripts of one page, in parallel; results keep the input order."""
+    return list(_validation_pool.map(lambda script: validate_script(script, dom_index), scripts))
+
+
+def failing_selectors(report: dict) -> List[dict]:
+    return [s for s in report["selectors"] if s["status"] in FAILING]
+
+
+def repair_request(script: str, report: dict) -> List[dict]:
+    """The failing locators as sent to the model: ref, locator, why it failed and the line using it."""
+    lines = strip_fences(script).splitlines()
+    failing = []
+    for selector in failing_selectors(report)[:settings.SELECTOR_REPAIR_MAX]:
+        failing.append({
+            "ref": selector["ref"], "by": selector["by"], "value": selector["value"],
+            "status": selector["status"], "matches": selector["matches"],
+            "code": lines[selector["line"] - 1].strip() if selector["line"] <= len(lines) else "",
+        })
+    return failing
+
+
+def parse_repairs(reply: str) -> List[dict]:
+    """The model's replacement locators; anything malformed is dropped."""
+    start, end = reply.find("["), reply.rfind("]")
+    if start < 0 or end < start:
+        return []
+    try:
+        repairs = json.loads(reply[start:end + 1])
+    except ValueError as e:
+        logger.warning(f"Unreadable selector repair reply: {e}")
+        return []
+    return [
+        r for r in repairs
+        if isinstance(r, dict) and isinstance(r.get("ref"), int)
+        and r.get("by") in BY_VALUES and isinstance(r.get("value"), str)
+    ]
+
+
+def apply_repairs(script: str, repairs: List[dict], dom_index: DomIndex) -> Tuple[str, int]:
+    """
+    Rewrites the repaired locators in place. A replacement is kept only if it
+    resolves on the page as the original lookup needs; locators built from
+    variables are left alone. Returns (script, replacements applied).
+    """
+    source = strip_fences(script)
+    locators, parse_error = extract_locators(source)
+    if parse_error:
+        return script, 0
+
+    # AST offsets are UTF-8 byte columns.
+    encoded = source.encode("utf-8")
+    line_starts = [0]
+    for line in encoded.splitlines(keepends=True):
+        line_starts.append(line_starts[-1] + len(line))
+
+    edits, refs = [], set()
+    for repair in repairs:
+        if not 0 <= repair["ref"] < len(locators) or repair["ref"] in refs:
+            continue
+        locator = locators[repair["ref"]]
+        if "_span" not in locator:
+            continue
+        candidate = dict(locator, by=repair["by"], value=repair["value"])
+        if classify(candidate, dom_index)["status"] not in ("unique", "present"):
+            continue
+        start_line, start_col, end_line, end_col = locator["_span"]
+        if locator["_string_by"]:
+            text = f"{BY_VALUES[repair['by']]!r}, {repair['value']!r}"
+        else:
+            text = f"By.{repair['by']}, {repair['value']!r}"
+        refs.add(repair["ref"])
+        edits.append((line_starts[start_line - 1] + start_col, line_starts[end_line - 1] + end_col, text))
+
+    for start, end, text in sorted(edits, reverse=True):
+        encoded = encoded[:start] + text.encode("utf-8") + encoded[end:]
+    return encoded.decode("utf-8"), len(edits)
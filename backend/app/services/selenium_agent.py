@@ -1,128 +1,375 @@
+import asyncio
+import json
 import os
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Tuple
 
 # Import Settings & Logger
 from app.core.config import settings
 from app.core.logger import get_logger
+from app.core.tracing import Trace, current_trace, stage, submit_with_context, trace
 
-# Import LLM Clients
-from langchain_groq import ChatGroq
-from langchain_openai import ChatOpenAI
+# Import shared clients & prompts
+from app.services.artifacts import PageArtifact
+from app.services.context_builder import ContextBuilder
+from app.services.limiter import Overloaded
+from app.services import prompts
+from app.services.providers import ProviderRegistry, get_providers
+from app.services.response_cache import doc_ids, response_key
+from app.services.retrieval import RetrievalTimeout
+from app.services.selector_validation import (
+    apply_repairs, failing_selectors, parse_repairs, repair_request, validate_script
+)
+from app.services.session_manifest import kb_fingerprint
+from app.services.single_flight import flight_key
+from app.services.tokenizer import arecord_llm_usage, count_tokens, llm_usage, record_llm_usage
 
 logger = get_logger("selenium_agent")
 
+ERROR_PREFIX = "# Error generating script"
+
 class SeleniumAgent:
-    def __init__(self, session_id: str):
+    def __init__(self, session_id: str, providers: ProviderRegistry = None, retrieval_mode: str = None):
         self.session_id = session_id
-        
-        # 1. Initialize Embeddings (Must match IngestionService)
-        # Check if using OpenAI or fallback
-        if settings.OPENAI_API_KEY:
-            self.embeddings = OpenAIEmbeddings(
-                model="text-embedding-3-small",
-                api_key=settings.OPENAI_API_KEY
-            )
-        else:
-            # Fallback for local dev if needed, but per previous steps we use OpenAI
-            from langchain_huggingface import HuggingFaceEmbeddings
-            self.embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-
-        # 2. Connect to the Session-Specific Vector Store
-        self.vector_store = Chroma(
-            collection_name=f"session_{self.session_id}",
-            persist_directory=settings.VECTOR_DB_PATH,
-            embedding_function=self.embeddings
-        )
-        
-        # 3. Create Retriever
-        self.retriever = self.vector_store.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": 2} # Fetch top 2 relevant rules
-        )
+        self.providers = providers or get_providers()
 
-        # 4. Initialize LLM
-        if settings.GROQ_API_KEY:
-            self.llm = ChatGroq(
-                api_key=settings.GROQ_API_KEY,
-                model="llama3-70b-8192",
-                temperature=0.1
-            )
-        elif settings.OPENAI_API_KEY:
-            self.llm = ChatOpenAI(
-                api_key=settings.OPENAI_API_KEY,
-                model="gpt-4o",
-                temperature=0.1
-            )
-        else:
-            raise ValueError("Missing LLM API Key in Settings")
-
-        # 5. Define the "Smart" Prompt
-        # It now includes {context} from the Vector DB
-        self.prompt = ChatPromptTemplate.from_template(
-            """
-            You are a Senior QA Automation Engineer. Write a Python Selenium script to automate the following test case.
-            
-            1. TEST CASE:
-            {test_case}
-            
-            2. DOCUMENTATION RULES (Logic/UI requirements):
-            {context}
-            
-            3. TARGET HTML PAGE SOURCE (For Selectors):
-            {html_content}
-            
-            REQUIREMENTS:
-            - Use 'webdriver_manager' and 'headless' Chrome options.
-            - Use robust selectors (ID, Name, CSS) based strictly on the provided HTML.
-            - ASSERTIONS: Use the DOCUMENTATION RULES to write specific assertions (e.g., if doc says error is red, check CSS color).
-            - If the documentation contradicts the HTML, trust the HTML for selectors but note the logic discrepancy in comments.
-            - Return ONLY the Python code. No markdown backticks.
-            """
+        # 1. Shared embeddings & LLM (built once at startup, must match IngestionService)
+        self.embeddings = self.providers.embeddings
+        self.llm = self.providers.llm
+
+        # 2. Session-scoped retriever view over the shared vector backend
+        self.retriever = self.providers.retriever(session_id, k=settings.CONTEXT_CANDIDATES, mode=retrieval_mode)
+
+        # 3. The "Smart" Prompt, including {context} from the Vector DB, with
+        #    every section held to a token budget that fits the model's window
+        self.prompt = prompts.SCRIPT_GEN_PROMPT
+        self.context_builder = ContextBuilder(
+            self.providers.llm_model, self.prompt,
+            context=settings.SCRIPT_CONTEXT_TOKENS,
+            page_context=settings.SCRIPT_PAGE_TOKENS,
+            test_case=settings.TEST_CASE_TOKENS
         )
 
-    def generate_script(self, test_case: str, html_content: str):
-        logger.info(f"Session {self.session_id}: Generating script for '{test_case[:20]}...'")
-        
-        # Helper to format docs
-        def format_docs(docs):
-            return "\n\n".join(doc.page_content for doc in docs)
-
-        # Define the Chain: Retrieve Context -> Pass to Prompt -> LLM
-        chain = (
-            {
-                "context": self.retriever | format_docs, 
-                "test_case": RunnablePassthrough(),
-                "html_content": lambda x: html_content # Pass raw HTML through
-            }
-            | self.prompt
-            | self.llm
-            | StrOutputParser()
+        # 4. Shared response cache, scoped by the session's knowledge-base fingerprint
+        self.cache = self.providers.response_cache
+        self.flights = self.providers.single_flight
+        self.limiter = self.providers.limiter
+
+    def _response_key(self, test_case: str, relevant_docs, page: PageArtifact):
+        logger.info(f"Retrieved {len(relevant_docs)} context chunks for scripting.")
+
+        # Parsed at ingest time and cached per session page.
+        dom_index = page.dom_index
+        key = response_key(
+            "script", {"test_case": test_case, "page": dom_index.sha256}, doc_ids(relevant_docs),
+            self.providers.llm_model, settings.LLM_TEMPERATURE, kb_fingerprint(self.session_id)
         )
-        
-        try:
-            # We invoke with just the test_case first (for retriever), 
-            # but we need to inject html_content into the chain inputs manually
-            # So we restructure the invoke:
-            
-            # Retrieve specific docs relevant to the test case
+        return relevant_docs, dom_index, key
+
+    def _prepare(self, test_case: str, page: PageArtifact):
+        # Retrieve specific docs relevant to the test case
+        with stage("retrieve"):
             relevant_docs = self.retriever.invoke(test_case)
-            context_str = format_docs(relevant_docs)
-            
-            logger.info(f"Retrieved {len(relevant_docs)} context chunks for scripting.")
-            
-            # Final Generation
-            response = self.prompt.invoke({
-                "context": context_str,
-                "test_case": test_case,
-                "html_content": html_content
+        return self._response_key(test_case, relevant_docs, page)
+
+    async def _aprepare(self, test_case: str, page: PageArtifact):
+        with stage("retrieve"):
+            relevant_docs = await self.retriever.ainvoke(test_case)
+        return self._response_key(test_case, relevant_docs, page)
+
+    def _flight_key(self, test_case: str, page: PageArtifact) -> str:
+        return flight_key(
+            "script", {"test_case": test_case, "page": page.dom_index.sha256, "mode": self.retriever.mode},
+            self.providers.llm_model, settings.LLM_TEMPERATURE, kb_fingerprint(self.session_id)
+        )
+
+    def _build_prompt(self, test_case: str, relevant_docs, dom_index, t=None):
+        # Compact selector index + the DOM regions relevant to this test case,
+        # parsed once per page hash instead of pasting the raw HTML. The render
+        # lists regions last, so trimming to budget drops them first.
+        with stage("dom_render"):
+            page_context = self.context_builder.fit("page_context", dom_index.render(test_case))
+        with stage("context_build"):
+            context = self.context_builder.context(relevant_docs, trace=t)
+        with stage("prompt_render"):
+            return self.prompt.invoke({
+                "context": context,
+                "test_case": self.context_builder.fit("test_case", test_case),
+                "page_context": page_context
             })
-            
-            return self.llm.invoke(response).content
-            
+
+    def _generate_script(self, test_case: str, page: PageArtifact):
+        with trace("generate_script", self.session_id) as t:
+            t.payload("html", page.size)
+            t.set(page=page.filename)
+            start = time.perf_counter()
+            script, shared = self.flights.do(self._flight_key(test_case, page), lambda: self._generate(test_case, page, t))
+            t.set(coalesced=shared)
+            if shared:
+                t.add_stage("coalesced_wait", time.perf_counter() - start)
+                logger.info(f"Session {self.session_id}: Shared the result of an identical request in flight")
+            return script
+
+    def _generate(self, test_case: str, page: PageArtifact, t):
+        with self.limiter.slot_sync():
+            relevant_docs, dom_index, key = self._prepare(test_case, page)
+            with stage("cache_lookup"):
+                cached = self.cache.get(key)
+            t.set(cache_hit=cached is not None, context_chunks=len(relevant_docs))
+            if cached is not None:
+                logger.info(f"Session {self.session_id}: Serving script from response cache")
+                return cached
+
+            response = self._build_prompt(test_case, relevant_docs, dom_index, t)
+
+            # Final Generation
+            with stage("llm_generate"):
+                message = self.llm.invoke(response)
+            script = message.content
+        record_llm_usage(t, response.to_string(), script, usage=llm_usage(message))
+        self.cache.put(key, self.session_id, script)
+        return script
+
+    def generate_script(self, test_case: str, page: PageArtifact):
+        logger.info(f"Session {self.session_id}: Generating script for '{test_case[:20]}...' on {page.filename}")
+
+        try:
+            return self._generate_script(test_case, page)
+        except Exception as e:
+            logger.error(f"Script Generation Failed: {e}")
+            return f"{ERROR_PREFIX}: {str(e)}"
+
+    async def _agenerate(self, test_case: str, page: PageArtifact, t):
+        async with self.limiter.slot():
+            relevant_docs, dom_index, key = await self._aprepare(test_case, page)
+            with stage("cache_lookup"):
+                cached = self.cache.get(key)
+            t.set(cache_hit=cached is not None, context_chunks=len(relevant_docs))
+            if cached is not None:
+                logger.info(f"Session {self.session_id}: Serving script from response cache")
+                return cached
+
+            response = self._build_prompt(test_case, relevant_docs, dom_index, t)
+            with stage("llm_generate"):
+                message = await asyncio.wait_for(self.llm.ainvoke(response), settings.LLM_TIMEOUT_SECONDS)
+            script = message.content
+        await arecord_llm_usage(t, response.to_string(), script, usage=llm_usage(message))
+        self.cache.put(key, self.session_id, script)
+        return script
+
+    async def agenerate_script(self, test_case: str, page: PageArtifact):
+        """generate_script on the event loop; see TestGenAgent.agenerate_tests."""
+        logger.info(f"Session {self.session_id}: Generating script for '{test_case[:20]}...' on {page.filename}")
+
+        try:
+            with trace("generate_script", self.session_id) as t:
+                t.payload("html", page.size)
+                t.set(page=page.filename)
+                try:
+                    start = time.perf_counter()
+                    script, shared = await self.flights.ado(
+                        self._flight_key(test_case, page), lambda: self._agenerate(test_case, page, t)
+                    )
+                except asyncio.CancelledError:
+                    t.status = "cancelled"
+                    raise
+                t.set(coalesced=shared)
+                if shared:
+                    t.add_stage("coalesced_wait", time.perf_counter() - start)
+                    logger.info(f"Session {self.session_id}: Shared the result of an identical request in flight")
+                return script
+        except (Overloaded, RetrievalTimeout, asyncio.TimeoutError):
+            raise
         except Exception as e:
             logger.error(f"Script Generation Failed: {e}")
-            return f"# Error generating script: {str(e)}"
\ No newline at end of file
+            return f"{ERROR_PREFIX}: {str(e)}"
+
+    def _repair_key(self, script: str, page: PageArtifact) -> str:
+        return response_key(
+            "selector_repair", {"script": script, "page": page.dom_index.sha256}, [],
+            self.providers.llm_model, settings.LLM_TEMPERATURE, kb_fingerprint(self.session_id)
+        )
+
+    def _repair_prompt(self, test_case: str, script: str, report: dict, page: PageArtifact):
+        with stage("prompt_render"):
+            return prompts.SELECTOR_REPAIR_PROMPT.invoke({
+                "failing": json.dumps(repair_request(script, report), indent=1),
+                "page_context": self.context_builder.fit("page_context", page.dom_index.render(test_case)),
+            })
+
+    def _apply_repair(self, script: str, prompt, reply: str, page: PageArtifact, key: str) -> str:
+        repaired, applied = apply_repairs(script, parse_repairs(reply), page.dom_index)
+        t = current_trace()
+        if t is not None:
+            t.set(
+                repair_prompt_tokens=count_tokens(prompt.to_string()), repair_completion_tokens=count_tokens(reply),
+                selectors_rewritten=applied
+            )
+        self.cache.put(key, self.session_id, repaired)
+        return repaired
+
+    def _repair(self, test_case: str, script: str, report: dict, page: PageArtifact) -> str:
+        key = self._repair_key(script, page)
+        with stage("cache_lookup"):
+            cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        prompt = self._repair_prompt(test_case, script, report, page)
+        with stage("selector_repair"):
+            reply = self.llm.invoke(prompt).content
+        return self._apply_repair(script, prompt, reply, page, key)
+
+    async def _arepair(self, test_case: str, script: str, report: dict, page: PageArtifact) -> str:
+        key = self._repair_key(script, page)
+        with stage("cache_lookup"):
+            cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        async with self.limiter.slot():
+            prompt = self._repair_prompt(test_case, script, report, page)
+            with stage("selector_repair"):
+                message = await asyncio.wait_for(self.llm.ainvoke(prompt), settings.LLM_TIMEOUT_SECONDS)
+        return self._apply_repair(script, prompt, message.content, page, key)
+
+    @staticmethod
+    def _repaired_report(script: str, before: dict, page: PageArtifact) -> dict:
+        with stage("selector_validation"):
+            report = validate_script(script, page.dom_index)
+        report["repaired"] = max(0, len(failing_selectors(before)) - len(failing_selectors(report)))
+        return report
+
+    def check_script(self, test_case: str, script: str, page: PageArtifact, repair: bool = False,
+                     hold_slot: bool = False) -> Tuple[str, dict]:
+        """
+        Resolves every locator of a generated script against the page's DOM
+        index, without a browser. With `repair`, only the failing locators go
+        back to the model and are rewritten in place; a failed repair keeps
+        the script as generated. Returns (script, selector report), the report
+        is None for an error placeholder. `hold_slot`: the caller already
+        holds a provider slot.
+        """
+        if script.startswith(ERROR_PREFIX):
+            return script, None
+        with stage("selector_validation"):
+            report = validate_script(script, page.dom_index)
+        if not repair or not failing_selectors(report):
+            return script, report
+
+        try:
+            if hold_slot:
+                repaired = self._repair(test_case, script, report, page)
+            else:
+                with self.limiter.slot_sync():
+                    repaired = self._repair(test_case, script, report, page)
+        except Exception as e:
+            logger.warning(f"Session {self.session_id}: Selector repair failed: {e}")
+            report["repair_error"] = str(e)
+            return script, report
+        return repaired, self._repaired_report(repaired, report, page)
+
+    async def acheck_script(self, test_case: str, script: str, page: PageArtifact, repair: bool = False) -> Tuple[str, dict]:
+        """check_script on the event loop: the lookups run in a worker thread, the repair call is awaited."""
+        if script.startswith(ERROR_PREFIX):
+            return script, None
+        with stage("selector_validation"):
+            report = await asyncio.to_thread(validate_script, script, page.dom_index)
+        if not repair or not failing_selectors(report):
+            return script, report
+
+        try:
+            repaired = await self._arepair(test_case, script, report, page)
+        except Exception as e:
+            logger.warning(f"Session {self.session_id}: Selector repair failed: {e}")
+            report["repair_error"] = str(e)
+            return script, report
+        return repaired, await asyncio.to_thread(self._repaired_report, repaired, report, page)
+
+    def _generate_checked(self, test_case: str, page: PageArtifact, repair: bool) -> Tuple[str, dict]:
+        with trace("generate_script", self.session_id):
+            script = self._generate_script(test_case, page)
+            return self.check_script(test_case, script, page, repair)
+
+    def generate_scripts(self, cases: List[dict], page: PageArtifact, concurrency: int, repair: bool = False, stop=None):
+        """
+        Fans a whole plan out over a bounded pool, reusing this agent's retriever
+        and one parsed page. Each script's locators are checked on the worker
+        that wrote it, so validation overlaps the other cases' generation.
+        Yields one result per case as it finishes; a failing case is reported
+        and the rest of the batch carries on.
+
+        Only `concurrency` cases are in flight at a time. Once `stop` (a
+        threading.Event) is set or the generator is closed, no further case
+        starts; the ones already running finish on their own.
+        """
+        logger.info(f"Session {self.session_id}: Batch generating {len(cases)} scripts (concurrency={concurrency})")
+
+        pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="script-batch")
+        queued = iter(enumerate(cases))
+        running = {}
+        try:
+            while True:
+                while len(running) < concurrency and not (stop and stop.is_set()):
+                    index, case = next(queued, (None, None))
+                    if case is None:
+                        break
+                    future = submit_with_context(pool, self._generate_checked, case["test_case"], page, repair)
+                    running[future] = (index, case)
+                if not running or (stop and stop.is_set()):
+                    break
+                finished, _ = wait(running, timeout=settings.DISCONNECT_POLL_SECONDS, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index, case = running.pop(future)
+                    try:
+                        script, report = future.result()
+                        yield {"index": index, "case": case, "status": "ok", "script": script, "selector_report": report}
+                    except Exception as e:
+                        logger.error(f"Batch case {index} failed: {e}")
+                        yield {"index": index, "case": case, "status": "error", "error": str(e)}
+        finally:
+            if running or (stop and stop.is_set()):
+                logger.info(f"Session {self.session_id}: Batch stopped with {len(running)} cases in flight")
+            # Not `with`: its exit would wait for the cases still running.
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def stream_script(self, test_case: str, page: PageArtifact):
+        """Yields the script token by token as the model produces it."""
+        logger.info(f"Session {self.session_id}: Streaming script for '{test_case[:20]}...'")
+
+        # Activated only between yields; see TestGenAgent.stream_tests.
+        t = Trace("stream_script", self.session_id)
+        try:
+            with t.active():
+                t.payload("html", page.size)
+                t.set(page=page.filename)
+                relevant_docs, dom_index, key = self._prepare(test_case, page)
+                with stage("cache_lookup"):
+                    cached = self.cache.get(key)
+                t.set(cache_hit=cached is not None, context_chunks=len(relevant_docs))
+            if cached is not None:
+                yield cached
+                return
+
+            with t.active():
+                response = self._build_prompt(test_case, relevant_docs, dom_index, t)
+            parts, usage = [], None
+            start = time.perf_counter()
+            for chunk in self.llm.stream(response):
+                usage = llm_usage(chunk) or usage
+                if chunk.content:
+                    if not parts:
+                        t.add_stage("llm_first_token", time.perf_counter() - start)
+                    parts.append(chunk.content)
+                    yield chunk.content
+            t.add_stage("llm_generate", time.perf_counter() - start)
+            script = "".join(parts)
+            record_llm_usage(t, response.to_string(), script, usage=usage)
+            self.cache.put(key, self.session_id, script)
+        except GeneratorExit:
+            t.status = "cancelled"
+            raise
+        except Exception:
+            t.status = "error"
+            raise
+        finally:
+            t.finish()
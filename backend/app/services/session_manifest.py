@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import threading
+from collections import defaultdict
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.services.state_store import file_lock, shared_state
+
+logger = get_logger("session_manifest")
+
+_locks = defaultdict(threading.RLock)
+_fingerprints = {}
+
+# Project knowledge bases reuse the per-session storage under keys with this
+# prefix. Session ids are uuid4 strings, so they can never collide with one.
+PROJECT_PREFIX = "project-"
+
+
+def project_key(name: str) -> str:
+    return f"{PROJECT_PREFIX}{name}"
+
+
+def is_project_key(key: str) -> bool:
+    return key.startswith(PROJECT_PREFIX)
+
+
+def session_lock(session_id: str):
+    """
+    Serialises ingest/cleanup work on one session's collection and manifest,
+    across worker processes when state is shared.
+    """
+    if shared_state():
+        return file_lock(f"session:{session_id}")
+    return _locks[session_id]
+
+
+def forget_session_lock(session_id: str):
+    """Drops the per-session lock and memoised fingerprint once a session is reaped."""
+    lock = None if shared_state() else _locks.get(session_id)
+    if lock is not None and lock.acquire(blocking=False):
+        _locks.pop(session_id, None)
+        lock.release()
+    _fingerprints.pop(session_id, None)
+
+
+class ChunkIdAssigner:
+    """
+    Stable ids derived from file name + chunk content, assigned one chunk at
+    a time as a file streams in. Repeated identical chunks inside one file
+    get an occurrence suffix so ids stay unique.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._seen = defaultdict(int)
+
+    def next(self, text: str) -> str:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        occurrence = self._seen[digest]
+        self._seen[digest] += 1
+        return hashlib.sha256(f"{self.filename}\x00{digest}\x00{occurrence}".encode("utf-8")).hexdigest()[:32]
+
+
+def chunk_ids(filename: str, texts: List[str]) -> List[str]:
+    assigner = ChunkIdAssigner(filename)
+    return [assigner.next(text) for text in texts]
+
+
+def _manifest_path(session_id: str) -> str:
+    return os.path.join(settings.MANIFEST_DIR, f"session_{session_id}.json")
+
+
+def manifest_keys() -> List[str]:
+    """Every session (and project) key with a manifest on disk."""
+    if not os.path.isdir(settings.MANIFEST_DIR):
+        return []
+    return [
+        name[len("session_"):-len(".json")] for name in os.listdir(settings.MANIFEST_DIR)
+        if name.startswith("session_") and name.endswith(".json")
+    ]
+
+
+def manifest_version(session_id: str):
+    """
+    (mtime, inode, size) of the session's manifest, or None; changes on every
+    save by any process. Saves replace the file, so the inode and size tell
+    apart two saves within one tick of a coarse filesystem clock.
+    """
+    try:
+        st = os.stat(_manifest_path(session_id))
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+
+def _summary(session_id: str) -> Tuple[str, Optional[str], FrozenSet[str]]:
+    """(fingerprint, attached project, file names) of a manifest, memoised per manifest version."""
+    version = manifest_version(session_id)
+    memo = _fingerprints.get(session_id)
+    if memo is not None and memo[0] == version:
+        return memo[1]
+    summary = SessionManifest(session_id).summary()
+    _fingerprints[session_id] = (version, summary)
+    return summary
+
+
+def kb_fingerprint(session_id: str) -> str:
+    """
+    Hash of every chunk id the session retrieves from: its own collection
+    and its attached project's. Changes whenever ingestion changes either.
+    """
+    fingerprint, project, _ = _summary(session_id)
+    if project:
+        base = _summary(project_key(project))[0]
+        fingerprint = hashlib.sha256(f"{fingerprint}\n{project}\n{base}".encode("utf-8")).hexdigest()
+    return fingerprint
+
+
+def attached_project(session_id: str) -> Optional[str]:
+    return _summary(session_id)[1]
+
+
+def manifest_files(session_id: str) -> FrozenSet[str]:
+    return _summary(session_id)[2]
+
+
+def layers_version(session_id: str):
+    """Changes when the session's manifest or its attached project's does."""
+    project = attached_project(session_id)
+    return (manifest_version(session_id), manifest_version(project_key(project)) if project else None)
+
+
+class SessionManifest:
+    """
+    Per-session record of which chunk ids each ingested file produced,
+    persisted next to the vector store so re-ingestion can diff against it.
+    """
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.path = _manifest_path(session_id)
+        self.data = {"files": {}}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.data = json.load(f)
+            except Exception as e:
+                logger.warning(f"Session {session_id}: Ignoring unreadable manifest ({e})")
+
+    def chunk_ids(self, filename: str) -> List[str]:
+        return self.data["files"].get(filename, {}).get("chunks", [])
+
+    def set_chunks(self, filename: str, ids: List[str]):
+        self.data["files"].setdefault(filename, {})["chunks"] = ids
+
+    def set_file(self, filename: str, **fields):
+        """Records what ingestion learned about a file (type, size, sha256, artifacts, ...)."""
+        self.data["files"].setdefault(filename, {}).update(fields)
+
+    def files(self) -> Dict[str, dict]:
+        return self.data["files"]
+
+    @property
+    def project(self) -> Optional[str]:
+        """The project knowledge base this session's uploads are layered on, if any."""
+        return self.data.get("project")
+
+    def attach(self, project: Optional[str]):
+        if project:
+            self.data["project"] = project
+        else:
+            self.data.pop("project", None)
+
+    def fingerprint(self) -> str:
+        ids = sorted(i for entry in self.data["files"].values() for i in entry.get("chunks", []))
+        return hashlib.sha256("\n".join(ids).encode("utf-8")).hexdigest()
+
+    def summary(self) -> Tuple[str, Optional[str], FrozenSet[str]]:
+        return self.fingerprint(), self.project, frozenset(self.data["files"])
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path)
+        _fingerprints[self.session_id] = (manifest_version(self.session_id), self.summary())
+
+    def delete(self):
+        _fingerprints.pop(self.session_id, None)
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+import uuid
+from typing import List
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.services.state_store import get_state_store, shared_state
+
+logger = get_logger("session_registry")
+
+
+class SessionRegistry:
+    """
+    In-process record of live sessions and when each was last used by an API
+    call. The reaper expires sessions from this, not from directory mtimes.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def touch(self, session_id: str, at: float = None):
+        now = at or time.time()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                self._sessions[session_id] = {"created_at": now, "last_access": now}
+            elif now > entry["last_access"]:
+                entry["last_access"] = now
+
+    def adopt(self, session_id: str, last_access: float):
+        """Registers a session found on disk (e.g. from before a restart) without refreshing it."""
+        with self._lock:
+            if session_id not in self._sessions:
+                self._sessions[session_id] = {"created_at": last_access, "last_access": last_access}
+
+    def stale(self, timeout_seconds: float) -> List[str]:
+        cutoff = time.time() - timeout_seconds
+        with self._lock:
+            return [sid for sid, entry in self._sessions.items() if entry["last_access"] < cutoff]
+
+    def remove(self, session_id: str, only_if_before: float = None) -> bool:
+        """Drops a session unless it was touched after `only_if_before` (i.e. revived mid-reap)."""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return False
+            if only_if_before is not None and entry["last_access"] >= only_if_before:
+                return False
+            del self._sessions[session_id]
+            return True
+
+    def get(self, session_id: str):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            return dict(entry) if entry else None
+
+    def __contains__(self, session_id: str):
+        with self._lock:
+            return session_id in self._sessions
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def try_lead(self, name: str, ttl_seconds: float) -> bool:
+        """Whether this process should run cluster-wide chores such as the reaper. Always, when alone."""
+        return True
+
+
+class SharedSessionRegistry:
+    """
+    Same interface as SessionRegistry, backed by the shared state store so
+    every worker process sees the same sessions. Touches are written back at
+    most every SESSION_TOUCH_INTERVAL_SECONDS per session and process, far
+    below the session timeout the reaper works at.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._written = {}
+        self._lock = threading.Lock()
+
+    def touch(self, session_id: str, at: float = None):
+        now = at or time.time()
+        with self._lock:
+            if now - self._written.get(session_id, 0) < settings.SESSION_TOUCH_INTERVAL_SECONDS:
+                return
+            self._written[session_id] = now
+            if len(self._written) > 10_000:
+                cutoff = now - settings.SESSION_TOUCH_INTERVAL_SECONDS
+                self._written = {sid: t for sid, t in self._written.items() if t >= cutoff}
+        self.store.touch_session(session_id, now)
+
+    def adopt(self, session_id: str, last_access: float):
+        self.store.adopt_session(session_id, last_access)
+
+    def stale(self, timeout_seconds: float) -> List[str]:
+        return self.store.stale_sessions(time.time() - timeout_seconds)
+
+    def remove(self, session_id: str, only_if_before: float = None) -> bool:
+        with self._lock:
+            self._written.pop(session_id, None)
+        return self.store.remove_session(session_id, only_if_before)
+
+    def get(self, session_id: str):
+        return self.store.get_session(session_id)
+
+    def __contains__(self, session_id: str):
+        return self.store.get_session(session_id) is not None
+
+    def __len__(self):
+        return self.store.count_sessions()
+
+    def try_lead(self, name: str, ttl_seconds: float) -> bool:
+        return self.store.try_lease(name, self.owner, ttl_seconds)
+
+
+session_registry = SharedSessionRegistry(get_state_store()) if shared_state() else SessionRegistry()
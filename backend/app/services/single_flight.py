@@ -0,0 +1,132 @@
+import asyncio
+import hashlib
+import json
+import threading
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Tuple
+
+from app.core.logger import get_logger
+from app.services.response_cache import normalize_text
+
+logger = get_logger("single_flight")
+
+
+def flight_key(kind: str, inputs: dict, model: str, temperature: float, fingerprint: str) -> str:
+    """Identifies one generation before retrieval: same inputs, model and knowledge base."""
+    payload = {
+        "kind": kind,
+        "inputs": {k: normalize_text(v) if isinstance(v, str) else v for k, v in sorted(inputs.items())},
+        "model": model,
+        "temperature": temperature,
+        "kb": fingerprint,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    __slots__ = ("key", "future", "task", "waiters")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.future = Future()
+        # Running: waiters giving up must never cancel the shared result.
+        self.future.set_running_or_notify_cancel()
+        self.task = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Collapses concurrent identical calls into one. The first caller for a key
+    runs the work; callers arriving while it is in flight wait for its result
+    (or exception) instead of starting their own. Nothing is kept once the
+    call finishes: finished results are the response cache's job.
+
+    Thread callers (do) and async callers (ado) share flights. Async work
+    runs as its own task and is cancelled only when every caller waiting on
+    it has gone, so one client disconnecting does not fail the others.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _join(self, key: str) -> Tuple[_Flight, bool]:
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight(key)
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+            flight.waiters += 1
+            return flight, leader
+
+    def _leave(self, flight: _Flight) -> bool:
+        """True when the last waiter left an async flight that is still running."""
+        with self._lock:
+            flight.waiters -= 1
+            abandoned = flight.waiters == 0 and flight.task is not None and not flight.future.done()
+            if abandoned:
+                # Late arrivals start a fresh flight rather than join one about to be cancelled.
+                self._drop(flight)
+            return abandoned
+
+    def _drop(self, flight: _Flight):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    def _land(self, flight: _Flight):
+        with self._lock:
+            self._drop(flight)
+
+    def do(self, key: str, fn: Callable) -> Tuple[object, bool]:
+        """Returns (result, shared): shared is True when another caller's run produced it."""
+        flight, leader = self._join(key)
+        try:
+            if not leader:
+                return flight.future.result(), True
+            try:
+                result = fn()
+            except BaseException as e:
+                flight.future.set_exception(e)
+                raise
+            flight.future.set_result(result)
+            return result, False
+        finally:
+            if leader:
+                self._land(flight)
+            self._leave(flight)
+
+    @staticmethod
+    async def _lead(flight: _Flight, factory: Callable[[], Awaitable]):
+        try:
+            flight.future.set_result(await factory())
+        except BaseException as e:
+            flight.future.set_exception(e)
+
+    def _landed(self, flight: _Flight, task: asyncio.Task):
+        # Also runs when the task was cancelled before it ever started.
+        if not flight.future.done():
+            flight.future.set_exception(asyncio.CancelledError())
+        self._land(flight)
+
+    async def ado(self, key: str, factory: Callable[[], Awaitable]) -> Tuple[object, bool]:
+        """do() for coroutines: `factory` makes the coroutine, run once per flight."""
+        flight, leader = self._join(key)
+        if leader:
+            # Copies the leader's context, so its trace collects the shared run's stages.
+            flight.task = asyncio.ensure_future(self._lead(flight, factory))
+            flight.task.add_done_callback(lambda task: self._landed(flight, task))
+        try:
+            return await asyncio.wrap_future(flight.future), not leader
+        finally:
+            if self._leave(flight):
+                flight.task.cancel()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"leaders": self.leaders, "coalesced": self.coalesced, "in_flight": len(self._flights)}
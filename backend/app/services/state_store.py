@@ -0,0 +1,260 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+from app.core.config import settings
+from app.core.logger import get_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: shared mode is POSIX-only, local mode never needs it.
+    fcntl = None
+
+logger = get_logger("state_store")
+
+
+class SQLiteStateStore:
+    """
+    Session registry, ingestion jobs and leader leases shared by every worker
+    process (and every replica mounting the same volume) through one SQLite
+    file. WAL mode lets readers run alongside the single writer; writers from
+    other processes wait up to the busy timeout.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_sessions_access ON sessions(last_access);
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                session_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_updated ON jobs(updated_at);
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            """
+        )
+
+    def _write(self, sql: str, params=()) -> int:
+        with self._lock:
+            return self._conn.execute(sql, params).rowcount
+
+    def _read(self, sql: str, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # --- sessions ---
+
+    def touch_session(self, session_id: str, at: float):
+        self._write(
+            "INSERT INTO sessions (session_id, created_at, last_access) VALUES (?, ?, ?) "
+            "ON CONFLICT(session_id) DO UPDATE SET last_access = MAX(last_access, excluded.last_access)",
+            (session_id, at, at)
+        )
+
+    def adopt_session(self, session_id: str, last_access: float):
+        self._write(
+            "INSERT OR IGNORE INTO sessions (session_id, created_at, last_access) VALUES (?, ?, ?)",
+            (session_id, last_access, last_access)
+        )
+
+    def stale_sessions(self, cutoff: float) -> List[str]:
+        return [row[0] for row in self._read("SELECT session_id FROM sessions WHERE last_access < ?", (cutoff,))]
+
+    def remove_session(self, session_id: str, only_if_before: float = None) -> bool:
+        if only_if_before is None:
+            return self._write("DELETE FROM sessions WHERE session_id = ?", (session_id,)) > 0
+        return self._write(
+            "DELETE FROM sessions WHERE session_id = ? AND last_access < ?", (session_id, only_if_before)
+        ) > 0
+
+    def get_session(self, session_id: str) -> Optional[dict]:
+        rows = self._read("SELECT created_at, last_access FROM sessions WHERE session_id = ?", (session_id,))
+        if not rows:
+            return None
+        return {"created_at": rows[0][0], "last_access": rows[0][1]}
+
+    def count_sessions(self) -> int:
+        return self._read("SELECT COUNT(*) FROM sessions")[0][0]
+
+    # --- ingestion jobs ---
+
+    def save_job(self, job: dict):
+        self._write(
+            "INSERT OR REPLACE INTO jobs (job_id, session_id, status, data, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (job["job_id"], job["session_id"], job["status"], json.dumps(job), job["updated_at"])
+        )
+
+    def load_job(self, job_id: str) -> Optional[dict]:
+        rows = self._read("SELECT data FROM jobs WHERE job_id = ?", (job_id,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def prune_jobs(self, cutoff: float) -> int:
+        return self._write(
+            "DELETE FROM jobs WHERE status IN ('completed', 'failed') AND updated_at < ?", (cutoff,)
+        )
+
+    def heartbeat_jobs(self, job_ids: List[str], at: float):
+        """Marks unfinished jobs of a live worker as still being worked on."""
+        for start in range(0, len(job_ids), 500):
+            batch = job_ids[start:start + 500]
+            self._write(
+                "UPDATE jobs SET updated_at = ?, data = json_set(data, '$.updated_at', ?) "
+                f"WHERE job_id IN ({','.join('?' * len(batch))}) AND status IN ('queued', 'running')",
+                (at, at, *batch)
+            )
+
+    def fail_stale_jobs(self, cutoff: float, error: str, job_id: str = None) -> int:
+        """Fails queued or running jobs (all, or just `job_id`) whose worker stopped marking them before `cutoff`."""
+        now = time.time()
+        sql = (
+            "UPDATE jobs SET status = 'failed', updated_at = ?, data = json_set(data, '$.status', 'failed', "
+            "'$.error', ?, '$.updated_at', ?) WHERE status IN ('queued', 'running') AND updated_at < ?"
+        )
+        params = [now, error, now, cutoff]
+        if job_id is not None:
+            sql += " AND job_id = ?"
+            params.append(job_id)
+        return self._write(sql, params)
+
+    # --- leases ---
+
+    def try_lease(self, name: str, owner: str, ttl_seconds: float) -> bool:
+        """Takes or renews a named lease; True while `owner` holds it."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                    "WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+                    (name, owner, now + ttl_seconds, now)
+                )
+                (holder,) = self._conn.execute("SELECT owner FROM leases WHERE name = ?", (name,)).fetchone()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return holder == owner
+
+
+class FileRLock:
+    """
+    Re-entrant lock that also excludes other processes: a thread RLock plus
+    flock() on a lock file, taken on the outermost acquire only.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if not self._thread_lock.acquire(blocking):
+            return False
+        if self._depth == 0:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                self._thread_lock.release()
+                return False
+            except BaseException:
+                os.close(fd)
+                self._thread_lock.release()
+                raise
+            self._fd = fd
+        self._depth += 1
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+LOCK_STRIPES = 1024
+
+
+def shared_state() -> bool:
+    return settings.STATE_BACKEND == "sqlite"
+
+
+_store = None
+_store_lock = threading.Lock()
+_file_locks = {}
+
+
+def get_state_store() -> SQLiteStateStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SQLiteStateStore(settings.STATE_DB_PATH)
+    return _store
+
+
+def file_lock(key: str) -> FileRLock:
+    """
+    Cross-process lock for `key`. Keys hash onto a fixed set of lock files,
+    so the lock directory stays bounded however many sessions come and go.
+    """
+    stripe = int(hashlib.sha256(key.encode("utf-8")).hexdigest()[:8], 16) % LOCK_STRIPES
+    with _store_lock:
+        lock = _file_locks.get(stripe)
+        if lock is None:
+            os.makedirs(settings.LOCK_DIR, exist_ok=True)
+            lock = FileRLock(os.path.join(settings.LOCK_DIR, f"stripe_{stripe:03d}.lock"))
+            _file_locks[stripe] = lock
+    return lock
+
+
+def deployment_problems() -> List[str]:
+    """Settings that would lose writes when several processes share the data directories."""
+    if not shared_state():
+        if settings.STATE_BACKEND != "memory":
+            return [f"Unknown STATE_BACKEND: {settings.STATE_BACKEND}"]
+        return []
+    problems = []
+    if fcntl is None:
+        problems.append("STATE_BACKEND=sqlite needs POSIX file locks (fcntl).")
+    if settings.VECTOR_BACKEND == "numpy":
+        problems.append("VECTOR_BACKEND=numpy keeps per-process state; use chroma with CHROMA_HOST in shared mode.")
+    elif settings.VECTOR_BACKEND == "chroma" and not settings.CHROMA_HOST:
+        problems.append("Embedded Chroma is single-writer; set CHROMA_HOST to a Chroma server in shared mode.")
+    return problems
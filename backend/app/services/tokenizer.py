@@ -0,0 +1,59 @@
+import asyncio
+from typing import Optional, Tuple
+
+_encodings = {}
+
+# Models tiktoken does not know. Llama 3 uses a 128k BPE close to cl100k in density.
+_FALLBACK_ENCODING = "cl100k_base"
+
+
+def _encoding(model: str = None):
+    key = model or ""
+    if key not in _encodings:
+        try:
+            import tiktoken
+            try:
+                _encodings[key] = tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding(_FALLBACK_ENCODING)
+            except KeyError:
+                _encodings[key] = tiktoken.get_encoding(_FALLBACK_ENCODING)
+        except Exception:
+            _encodings[key] = False
+    return _encodings[key]
+
+
+def count_tokens(text: str, model: str = None) -> int:
+    encoding = _encoding(model)
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)
+
+
+def llm_usage(message) -> Optional[Tuple[int, int]]:
+    """(prompt, completion) tokens as counted by the provider, from a reply or the last stream chunk; None if absent."""
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    token_usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+    if "prompt_tokens" in token_usage:
+        return token_usage["prompt_tokens"], token_usage.get("completion_tokens", 0)
+    return None
+
+
+def record_llm_usage(trace, prompt_text: str, completion: str, model: str = None, usage: Tuple[int, int] = None):
+    """
+    Token counts and sizes of one LLM call, onto the operation's trace. The
+    provider's own counts (`usage`, see llm_usage) are used when it sent
+    them; only otherwise are prompt and completion encoded here.
+    """
+    if usage is None:
+        usage = (count_tokens(prompt_text, model), count_tokens(completion, model))
+    trace.tokens(*usage)
+    trace.payload("prompt", len(prompt_text.encode("utf-8")))
+    trace.payload("completion", len(completion.encode("utf-8")))
+
+
+async def arecord_llm_usage(trace, prompt_text: str, completion: str, model: str = None, usage: Tuple[int, int] = None):
+    """record_llm_usage for the event loop: counting tokens locally runs in a thread."""
+    if usage is None:
+        usage = await asyncio.to_thread(lambda: (count_tokens(prompt_text, model), count_tokens(completion, model)))
+    record_llm_usage(trace, prompt_text, completion, model, usage)
@@ -0,0 +1,339 @@
+import json
+import os
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from typing import List, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from app.core.config import settings
+from app.core.logger import get_logger
+
+logger = get_logger("vector_store")
+
+
+def collection_name(session_id: str) -> str:
+    return f"session_{session_id}"
+
+
+class SessionVectorStore(ABC):
+    """One session's vectors. Implemented by every backend."""
+
+    @abstractmethod
+    def upsert(self, ids: List[str], embeddings: List[List[float]], documents: List[str], metadatas: List[dict]):
+        ...
+
+    @abstractmethod
+    def delete(self, ids: List[str]):
+        ...
+
+    def search(self, embedding: List[float], k: int) -> List[Tuple[Document, float]]:
+        return self.search_many([embedding], k)[0]
+
+    @abstractmethod
+    def search_many(self, embeddings: List[List[float]], k: int) -> List[List[Tuple[Document, float]]]:
+        ...
+
+    @abstractmethod
+    def count(self) -> int:
+        ...
+
+
+class VectorBackend(ABC):
+    name = "base"
+
+    @abstractmethod
+    def session(self, session_id: str) -> SessionVectorStore:
+        ...
+
+    @abstractmethod
+    def drop(self, session_id: str):
+        ...
+
+    @abstractmethod
+    def list_sessions(self) -> List[str]:
+        ...
+
+
+class ChromaSessionStore(SessionVectorStore):
+    def __init__(self, collection):
+        self.collection = collection
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def delete(self, ids):
+        if ids:
+            self.collection.delete(ids=ids)
+
+    def search_many(self, embeddings, k):
+        count = self.collection.count()
+        if not count:
+            return [[] for _ in embeddings]
+
+        result = self.collection.query(
+            query_embeddings=embeddings,
+            n_results=min(k, count),
+            include=["documents", "metadatas", "distances"]
+        )
+        hits = []
+        for docs, metas, distances in zip(result["documents"], result["metadatas"], result["distances"]):
+            hits.append([
+                (Document(page_content=doc, metadata=meta or {}), -distance)
+                for doc, meta, distance in zip(docs, metas, distances)
+            ])
+        return hits
+
+    def count(self):
+        return self.collection.count()
+
+
+class ChromaBackend(VectorBackend):
+    """
+    Embedded Chroma under `path`, or a Chroma server when `host` is given.
+    The embedded store allows one writing process; the server is what
+    several API workers or replicas share.
+    """
+    name = "chroma"
+
+    def __init__(self, path: str, host: str = None, port: int = 8000, ssl: bool = False):
+        import chromadb
+        self.remote = bool(host)
+        if self.remote:
+            self.client = chromadb.HttpClient(host=host, port=port, ssl=ssl)
+        else:
+            self.client = chromadb.PersistentClient(path=path)
+
+    def session(self, session_id):
+        return ChromaSessionStore(self.client.get_or_create_collection(collection_name(session_id)))
+
+    def drop(self, session_id):
+        self.client.delete_collection(collection_name(session_id))
+
+    def list_sessions(self):
+        names = [getattr(c, "name", c) for c in self.client.list_collections()]
+        return [name[len("session_"):] for name in names if name.startswith("session_")]
+
+
+class NumpySessionStore(SessionVectorStore):
+    """
+    Append-only float32 matrix on disk (vectors*.f32, read through np.memmap)
+    plus a JSON sidecar with ids, texts and metadata. Rows are L2-normalised,
+    so a dot product ranks like cosine similarity. Updates and deletes
+    tombstone rows, and the file is compacted once most rows are dead.
+    The sidecar is the commit point: vectors are appended before it is
+    replaced and trimmed back to its row count on open, and compaction
+    writes a new vectors file that the sidecar switches to.
+    Small sessions are searched by brute force. Past the ANN threshold an
+    IVF coarse quantiser (k-means centroids) limits each query to the
+    nprobe nearest clusters.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.meta_path = os.path.join(path, "meta.json")
+        self._lock = threading.RLock()
+        self._matrix = None
+        self._ivf = None
+        self.meta = {"dim": None, "rows": [], "alive": {}, "vectors": "vectors.f32"}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self.meta = json.load(f)
+            self.meta.setdefault("vectors", "vectors.f32")
+            self._recover()
+
+    @property
+    def vectors_path(self) -> str:
+        return os.path.join(self.path, self.meta["vectors"])
+
+    def _recover(self):
+        """Reconciles the vectors file with the sidecar after a crash between writing one and the other."""
+        for name in os.listdir(self.path):
+            if name.startswith("vectors") and name != self.meta["vectors"]:
+                os.remove(os.path.join(self.path, name))
+        dim, rows = self.meta["dim"], len(self.meta["rows"])
+        if not dim:
+            return
+        row_bytes = dim * np.dtype(np.float32).itemsize
+        size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        on_disk = size // row_bytes
+        if on_disk > rows:
+            logger.warning(f"Trimming {on_disk - rows} uncommitted vectors from {self.path}")
+        if size > min(on_disk, rows) * row_bytes:
+            with open(self.vectors_path, "r+b") as f:
+                f.truncate(min(on_disk, rows) * row_bytes)
+        if on_disk < rows:
+            logger.error(f"{self.path} has {on_disk} vectors for {rows} rows; dropping rows without vectors")
+            self.meta["rows"] = self.meta["rows"][:on_disk]
+            self.meta["alive"] = {chunk_id: i for chunk_id, i in self.meta["alive"].items() if i < on_disk}
+            self._save_meta()
+
+    def _save_meta(self):
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.meta_path)
+
+    def _invalidate(self):
+        self._matrix = None
+        self._ivf = None
+
+    def _load_matrix(self):
+        if self._matrix is None:
+            rows = len(self.meta["rows"])
+            if not rows:
+                self._matrix = np.zeros((0, self.meta["dim"] or 0), dtype=np.float32)
+            else:
+                self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.meta["dim"]))
+        return self._matrix
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            if self.meta["dim"] is None:
+                self.meta["dim"] = int(vectors.shape[1])
+            start = len(self.meta["rows"])
+            for offset, (chunk_id, doc, meta) in enumerate(zip(ids, documents, metadatas)):
+                self.meta["rows"].append({"id": chunk_id, "text": doc, "metadata": meta or {}})
+                self.meta["alive"][chunk_id] = start + offset
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self._invalidate()
+            stale_path = self._maybe_compact()
+            self._save_meta()
+            if stale_path:
+                os.remove(stale_path)
+
+    def delete(self, ids):
+        with self._lock:
+            for chunk_id in ids:
+                self.meta["alive"].pop(chunk_id, None)
+            self._invalidate()
+            stale_path = self._maybe_compact()
+            self._save_meta()
+            if stale_path:
+                os.remove(stale_path)
+
+    def _maybe_compact(self):
+        rows, alive = len(self.meta["rows"]), len(self.meta["alive"])
+        if rows < 64 or alive > rows * settings.NUMPY_COMPACT_RATIO:
+            return None
+
+        matrix = np.array(self._load_matrix())
+        keep = sorted(self.meta["alive"].values())
+        compacted = matrix[keep] if keep else np.zeros((0, self.meta["dim"]), dtype=np.float32)
+        stale_path = self.vectors_path
+        generation = self.meta.get("generation", 0) + 1
+        name = f"vectors.{generation}.f32"
+        with open(os.path.join(self.path, name), "wb") as f:
+            f.write(np.ascontiguousarray(compacted).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self._matrix = None
+
+        self.meta["vectors"], self.meta["generation"] = name, generation
+        self.meta["rows"] = [self.meta["rows"][i] for i in keep]
+        self.meta["alive"] = {row["id"]: i for i, row in enumerate(self.meta["rows"])}
+        self._invalidate()
+        return stale_path
+
+    def _build_ivf(self, matrix, live):
+        n = len(live)
+        nlist = max(8, int(np.sqrt(n)))
+        rng = np.random.default_rng(0)
+        data = matrix[live]
+        centroids = data[rng.choice(n, nlist, replace=False)].copy()
+        for _ in range(settings.NUMPY_ANN_ITERATIONS):
+            assign = np.argmax(data @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = data[assign == c]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    centroids[c] = centroid / (np.linalg.norm(centroid) or 1)
+        assign = np.argmax(data @ centroids.T, axis=1)
+        lists = [live[assign == c] for c in range(nlist)]
+        logger.info(f"Built IVF index over {n} vectors ({nlist} lists) for {self.path}")
+        return centroids, lists
+
+    def search_many(self, embeddings, k):
+        queries = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+
+        with self._lock:
+            if not self.meta["alive"]:
+                return [[] for _ in embeddings]
+            matrix = self._load_matrix()
+            live = np.fromiter(sorted(self.meta["alive"].values()), dtype=np.int64)
+            rows = self.meta["rows"]
+
+            if len(live) >= settings.NUMPY_ANN_THRESHOLD:
+                if self._ivf is None:
+                    self._ivf = self._build_ivf(matrix, live)
+                centroids, lists = self._ivf
+                probes = np.argsort(-(queries @ centroids.T), axis=1)[:, :settings.NUMPY_ANN_NPROBE]
+                candidates = [np.concatenate([lists[c] for c in probe]) for probe in probes]
+            else:
+                candidates = [live] * len(queries)
+
+            if candidates and all(c is live for c in candidates):
+                # Brute force: one matrix product for the whole batch.
+                all_scores = queries @ matrix[live].T
+                per_query = [(live, scores) for scores in all_scores]
+            else:
+                per_query = [(cand, matrix[cand] @ q) for cand, q in zip(candidates, queries)]
+
+            results = []
+            for cand, scores in per_query:
+                top = min(k, len(cand))
+                if not top:
+                    results.append([])
+                    continue
+                best = np.argpartition(-scores, top - 1)[:top]
+                best = best[np.argsort(-scores[best])]
+                results.append([
+                    (Document(page_content=rows[cand[i]]["text"], metadata=rows[cand[i]]["metadata"]), float(scores[i]))
+                    for i in best
+                ])
+            return results
+
+    def count(self):
+        return len(self.meta["alive"])
+
+
+class NumpyBackend(VectorBackend):
+    name = "numpy"
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def session(self, session_id):
+        return NumpySessionStore(os.path.join(self.path, collection_name(session_id)))
+
+    def drop(self, session_id):
+        shutil.rmtree(os.path.join(self.path, collection_name(session_id)), ignore_errors=True)
+
+    def list_sessions(self):
+        return [name[len("session_"):] for name in os.listdir(self.path) if name.startswith("session_")]
+
+
+def build_backend(name: str = None) -> VectorBackend:
+    name = name or settings.VECTOR_BACKEND
+    if name == "numpy":
+        return NumpyBackend(settings.NUMPY_VECTOR_DIR)
+    if name == "chroma":
+        return ChromaBackend(settings.VECTOR_DB_PATH, settings.CHROMA_HOST, settings.CHROMA_PORT, settings.CHROMA_SSL)
+    raise ValueError(f"Unknown VECTOR_BACKEND: {name}")
@@ -0,0 +1,308 @@
+"""
+Chunking strategy comparison: recursive character splitting vs structure-aware.
+
+    cd backend
+    python -m benchmarks.bench_chunking --specs 12 --features 8 --k 4
+
+The corpus is assets/ plus synthetic specs: `--specs` documents cycling
+through Markdown, HTML, PDF (when PyMuPDF is installed) and plain text, each
+with `--features` sections of three rules. Every rule states one fact, e.g.
+"Code PROMO-3-2-1 takes 15% off orders above $120.", and gets two queries:
+one naming the code, one naming only the section it is in ("Rule 1.2 of
+Gift cards (3.1)"), which only finds it if the chunk knows its headings.
+
+Each strategy ingests the whole corpus through the real pipeline (parser,
+chunker, FakeEmbeddings, vector store, lexical index) into its own session,
+with the embedding cache off. Reported per strategy, overall and per format:
+
+    chunks          chunks embedded
+    embed tokens    tokens sent to the embedding model (tiktoken)
+    facts intact    facts stated whole inside at least one chunk
+    recall@k        code / section queries whose top-k BM25 chunks contain the whole fact
+    ingest s        wall time of process_documents
+
+Recall uses the session's BM25 index: FakeEmbeddings vectors are hashes, so
+dense recall would be noise. Pass `--json out.json` to keep the numbers.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "assets")
+FORMATS = ("md", "html", "pdf", "txt")
+
+TOPICS = [
+    "Gift cards", "Loyalty points", "Bulk orders", "Student pricing", "Flash sales", "Bundles",
+    "Referral credit", "Seasonal coupons", "Store pickup", "Gift wrapping", "Warranty add-ons", "Trade-in",
+]
+FILLER = (
+    "the checkout page validates every field before the order is submitted and shows inline errors "
+    "customers may edit the cart at any time and totals are recalculated on each change "
+    "prices are displayed in the store currency with two decimals and taxes are added at payment "
+    "support staff can override limits for verified business accounts after a manual review"
+).split()
+
+
+def configure_environment(root: str, args):
+    """Points every setting at `root` and selects the fakes. Must run before `app` is imported."""
+    vector_dir = os.path.join(root, "vector_store_data")
+    cache_dir = os.path.join(root, "cache")
+    os.environ.update({
+        "UPLOAD_DIR": os.path.join(root, "uploads"),
+        "VECTOR_DB_PATH": vector_dir,
+        "MANIFEST_DIR": os.path.join(vector_dir, "manifests"),
+        "LEXICAL_INDEX_DIR": os.path.join(vector_dir, "lexical"),
+        "NUMPY_VECTOR_DIR": os.path.join(vector_dir, "numpy"),
+        "ARTIFACT_DIR": os.path.join(vector_dir, "artifacts"),
+        "CACHE_DIR": cache_dir,
+        "EMBEDDING_CACHE_PATH": os.path.join(cache_dir, "embeddings.sqlite3"),
+        "DOM_INDEX_DIR": os.path.join(cache_dir, "dom_index"),
+        "EMBEDDING_PROVIDER": "fake",
+        "EMBEDDING_CACHE_ENABLED": "false",
+        "FAKE_EMBEDDING_LATENCY_MS": str(args.embedding_latency_ms),
+        "FAKE_EMBEDDING_MS_PER_1K_TOKENS": str(args.embedding_ms_per_1k_tokens),
+        "PARSE_WORKERS": "0",
+    })
+
+
+def _filler(rng: random.Random, sentences: int) -> str:
+    out = []
+    for _ in range(sentences):
+        start = rng.randrange(len(FILLER) - 16)
+        words = FILLER[start:start + rng.randint(10, 16)]
+        out.append(" ".join(words).capitalize() + ".")
+    return " ".join(out)
+
+
+def synthetic_spec(spec: int, features: int, rng: random.Random):
+    """(sections, facts): sections are (feature title, intro, [(rule title, paragraph)]), facts (fact, code query, section query)."""
+    sections, facts = [], []
+    for feature in range(features):
+        topic = TOPICS[(spec + feature) % len(TOPICS)]
+        rules = []
+        for rule in range(3):
+            code = f"PROMO-{spec}-{feature}-{rule}"
+            fact = f"Code {code} takes {rng.choice([5, 10, 15, 20, 25])}% off orders above ${rng.randrange(50, 500, 10)}."
+            # One rule in four runs past CHUNK_SIZE, so both strategies have to cut inside it.
+            long = rule == 1 and feature % 4 == 0
+            before, after = (rng.randint(6, 10), rng.randint(6, 10)) if long else (rng.randint(2, 6), rng.randint(2, 8))
+            paragraph = f"{_filler(rng, before)} {fact} {_filler(rng, after)}"
+            title = f"{topic} ({spec}.{feature + 1})"
+            rules.append((f"Rule {feature + 1}.{rule + 1}", paragraph))
+            facts.append((
+                fact,
+                f"How much does code {code} take off, and above which order total?",
+                f"Which discount does Rule {feature + 1}.{rule + 1} of {title} give?",
+            ))
+        sections.append((title, f"{_filler(rng, 3)}", rules))
+    return sections, facts
+
+
+def render(fmt: str, title: str, sections) -> bytes:
+    if fmt == "md":
+        parts = [f"# {title}\n"]
+        for feature, intro, rules in sections:
+            parts.append(f"## {feature}\n\n{intro}\n")
+            parts.extend(f"### {rule}\n\n{text}\n" for rule, text in rules)
+        return "\n".join(parts).encode("utf-8")
+    if fmt == "html":
+        parts = [f"<html><head><title>{title}</title></head><body><h1>{title}</h1>"]
+        for feature, intro, rules in sections:
+            parts.append(f"<section><h2>{feature}</h2><p>{intro}</p>")
+            parts.extend(f"<div class='rule'><h3>{rule}</h3><p>{text}</p></div>" for rule, text in rules)
+            parts.append("</section>")
+        parts.append("</body></html>")
+        return "\n".join(parts).encode("utf-8")
+    if fmt == "txt":
+        parts = [title, ""]
+        for n, (feature, intro, rules) in enumerate(sections, 1):
+            parts += [f"{n}. {feature}", intro, ""]
+            for m, (rule, text) in enumerate(rules, 1):
+                parts += [f"{n}.{m} {rule}", text, ""]
+        return "\n".join(parts).encode("utf-8")
+    return _render_pdf(title, sections)
+
+
+def _render_pdf(title: str, sections) -> bytes:
+    import pymupdf
+
+    pdf = pymupdf.open()
+    page, y = None, 0
+
+    def write(text, size):
+        nonlocal page, y
+        lines, line = [], ""
+        for word in text.split():
+            candidate = f"{line} {word}".strip()
+            if line and pymupdf.get_text_length(candidate, fontsize=size) > 495:
+                lines.append(line)
+                candidate = word
+            line = candidate
+        lines.append(line)
+        for line in lines:
+            if page is None or y > 800:
+                page, y = pdf.new_page(width=595, height=842), 50
+            page.insert_text((50, y), line, fontsize=size)
+            y += size * 1.25
+        # A paragraph gap, so PyMuPDF sees one block per paragraph.
+        y += size * 1.2
+
+    write(title, 18)
+    for feature, intro, rules in sections:
+        write(feature, 15)
+        write(intro, 10)
+        for rule, text in rules:
+            write(rule, 12)
+            write(text, 10)
+    data = pdf.tobytes()
+    pdf.close()
+    return data
+
+
+def build_corpus(root: str, args):
+    """Writes the corpus under `root`; returns (paths, facts) where facts are (format, fact, code query, section query)."""
+    rng = random.Random(args.seed)
+    try:
+        import pymupdf  # noqa: F401
+        formats = FORMATS
+    except ImportError:
+        formats = tuple(f for f in FORMATS if f != "pdf")
+
+    os.makedirs(root, exist_ok=True)
+    paths, facts = [], []
+    for folder in (ASSETS_DIR, os.path.join(ASSETS_DIR, "documentation")):
+        for name in sorted(os.listdir(folder)):
+            if os.path.isfile(os.path.join(folder, name)):
+                with open(os.path.join(folder, name), "rb") as src, open(os.path.join(root, name), "wb") as dst:
+                    dst.write(src.read())
+                paths.append(os.path.join(root, name))
+    for spec in range(args.specs):
+        fmt = formats[spec % len(formats)]
+        sections, spec_facts = synthetic_spec(spec, args.features, rng)
+        path = os.path.join(root, f"synthetic_spec_{spec}.{fmt}")
+        with open(path, "wb") as f:
+            f.write(render(fmt, f"Synthetic specification {spec}", sections))
+        paths.append(path)
+        facts.extend((fmt, *fact) for fact in spec_facts)
+    return paths, facts
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.split())
+
+
+def run_strategy(strategy: str, paths, facts, k: int):
+    from app.services.ingestion import IngestionService
+    from app.services.lexical_index import get_lexical_index
+    from app.services.session_manifest import SessionManifest
+    from app.services.tokenizer import count_tokens
+
+    session_id = f"bench-chunking-{strategy}"
+    start = time.perf_counter()
+    result = IngestionService().process_documents(session_id, paths, strategy=strategy)
+    elapsed = time.perf_counter() - start
+    if result.get("status") != "success":
+        raise RuntimeError(f"{strategy}: ingestion failed: {result}")
+
+    failed = sorted(name for name, entry in SessionManifest(session_id).files().items() if entry.get("status") == "failed")
+    index = get_lexical_index(session_id)
+    chunks = [(doc["metadata"], _normalize(doc["text"])) for doc in index.docs.values()]
+    per_format = defaultdict(lambda: {"chunks": 0, "embed_tokens": 0, "facts": 0, "intact": 0, "hits": 0, "section_hits": 0})
+    for metadata, text in chunks:
+        row = per_format[os.path.splitext(metadata.get("source", ""))[1].lstrip(".")]
+        row["chunks"] += 1
+        row["embed_tokens"] += count_tokens(text)
+
+    def found(query, fact):
+        return any(fact in _normalize(doc.page_content) for doc, _ in index.search(query, k))
+
+    for fmt, fact, code_query, section_query in facts:
+        row = per_format[fmt]
+        row["facts"] += 1
+        row["intact"] += any(fact in text for _, text in chunks)
+        row["hits"] += found(code_query, fact)
+        row["section_hits"] += found(section_query, fact)
+
+    keys = ("chunks", "embed_tokens", "facts", "intact", "hits", "section_hits")
+    total = {key: sum(row[key] for row in per_format.values()) for key in keys}
+    with_sections = sum(bool(metadata.get("section_path")) for metadata, _ in chunks)
+    return {
+        "strategy": strategy,
+        "ingest_seconds": elapsed,
+        "section_paths": with_sections,
+        "failed_files": failed,
+        **total,
+        "formats": {fmt: dict(row) for fmt, row in sorted(per_format.items())},
+    }
+
+
+def _line(label: str, row: dict, k: int, seconds=None):
+    facts = row["facts"] or 1
+    timing = f"{seconds:9.2f}" if seconds is not None else " " * 9
+    return (
+        f"{label:<24} {row['chunks']:>7} {row['embed_tokens']:>12} "
+        f"{row['intact'] / facts:>12.1%} {row['hits'] / facts:>7.1%} / {row['section_hits'] / facts:<7.1%} {timing}"
+    )
+
+
+def report(results, k: int):
+    print(f"{'strategy / format':<24} {'chunks':>7} {'embed tokens':>12} {'facts intact':>12} {f'recall@{k} code / section':>25} {'ingest s':>7}")
+    for result in results:
+        print(_line(result["strategy"], result, k, result["ingest_seconds"]))
+        for fmt, row in result["formats"].items():
+            print(_line(f"  {fmt or '?'}", row, k))
+    # Compared only on formats every strategy parsed completely.
+    broken = {os.path.splitext(name)[1].lstrip(".") for result in results for name in result["failed_files"]}
+    formats = sorted(set(results[0]["formats"]) - broken)
+
+    def total(result, key):
+        return sum(result["formats"][fmt][key] for fmt in formats if fmt in result["formats"])
+
+    base, *others = results
+    for other in others:
+        print(
+            f"\n{other['strategy']} vs {base['strategy']} ({', '.join(formats)}): "
+            f"{total(other, 'chunks') / max(total(base, 'chunks'), 1) - 1:+.0%} chunks, "
+            f"{total(other, 'embed_tokens') / max(total(base, 'embed_tokens'), 1) - 1:+.0%} embedding tokens, "
+            f"{total(other, 'hits') - total(base, 'hits'):+d} code and "
+            f"{total(other, 'section_hits') - total(base, 'section_hits'):+d} section queries answered; "
+            f"{other['section_paths']}/{other['chunks']} chunks carry a section path"
+        )
+    for result in results:
+        if result["failed_files"]:
+            # Their facts count as lost: e.g. the recursive strategy's Markdown loader needs a spaCy model download.
+            print(f"{result['strategy']}: {len(result['failed_files'])} files failed to parse: {', '.join(result['failed_files'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--specs", type=int, default=12, help="synthetic spec documents, cycling through the formats")
+    parser.add_argument("--features", type=int, default=8, help="sections per synthetic spec, three rules each")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--strategies", nargs="+", default=["recursive", "structured"])
+    parser.add_argument("--embedding-latency-ms", type=float, default=0.0)
+    parser.add_argument("--embedding-ms-per-1k-tokens", type=float, default=20.0)
+    parser.add_argument("--json", help="write the results here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        configure_environment(root, args)
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        paths, facts = build_corpus(os.path.join(root, "corpus"), args)
+        print(f"Corpus: {len(paths)} files, {sum(os.path.getsize(p) for p in paths) / 1024:.0f} KB, {len(facts)} facts\n")
+        results = [run_strategy(strategy, paths, facts, args.k) for strategy in args.strategies]
+
+    report(results, args.k)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
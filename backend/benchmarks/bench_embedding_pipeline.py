@@ -0,0 +1,67 @@
+"""
+Offline throughput benchmark for the ingestion embedding stage.
+
+    cd backend
+    python -m benchmarks.bench_embedding_pipeline --chunks 2000 --latency-ms 80
+
+Uses FakeEmbeddings, so no provider key or network is needed.
+"""
+import argparse
+import time
+
+from langchain_core.documents import Document
+
+from app.services.embedding_pipeline import EmbeddingPipeline
+from app.services.fake_providers import FakeEmbeddings
+
+
+def synthetic_chunks(n: int, size: int):
+    words = "checkout discount coupon SAVE15 cart total shipping express payment error".split()
+    chunks = []
+    for i in range(n):
+        body = " ".join(words[(i + j) % len(words)] for j in range(size // 8))
+        chunks.append(Document(page_content=f"[{i}] {body}", metadata={"source": f"spec_{i // 50}.md"}))
+    return chunks
+
+
+def run_case(name, chunks, embedder, **pipeline_kwargs):
+    stored = []
+    pipeline = EmbeddingPipeline(embedder, **pipeline_kwargs)
+    start = time.perf_counter()
+    pipeline.run(chunks, lambda batch, vectors: stored.extend(vectors))
+    elapsed = time.perf_counter() - start
+    print(
+        f"{name:<28} {len(stored):>6} chunks  {elapsed:7.2f}s  "
+        f"{len(stored) / elapsed:9.1f} chunks/s  {embedder.requests:>5} requests"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--chunk-chars", type=int, default=1000)
+    parser.add_argument("--latency-ms", type=float, default=80.0)
+    parser.add_argument("--ms-per-1k-tokens", type=float, default=20.0)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rate-limit-every", type=int, default=0)
+    args = parser.parse_args()
+
+    chunks = synthetic_chunks(args.chunks, args.chunk_chars)
+
+    def embedder():
+        return FakeEmbeddings(
+            latency_ms=args.latency_ms,
+            ms_per_1k_tokens=args.ms_per_1k_tokens,
+            rate_limit_every=args.rate_limit_every,
+        )
+
+    run_case("sequential, 100 per batch", chunks, embedder(),
+             max_concurrency=1, max_batch_tokens=10**9, max_batch_items=100)
+    run_case("sequential, token batches", chunks, embedder(),
+             max_concurrency=1, max_batch_items=2048)
+    run_case(f"concurrent x{args.concurrency}, token batches", chunks, embedder(),
+             max_concurrency=args.concurrency, max_batch_items=2048)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,450 @@
+"""
+Offline load benchmark for the HTTP API.
+
+    cd backend
+    python -m benchmarks.bench_load --users 16 --concurrency 8 --requests 3 \
+        --llm-latency-ms 400 --llm-tps 80 --embedding-latency-ms 60 --synthetic-kb 200
+
+Starts the real FastAPI app under uvicorn on a free local port, with the
+fake embedding and chat providers and every data directory in a temp dir.
+Each virtual user runs a full session: /session/start, /ingest (polled until
+the job finishes) and `--requests` calls each to /generate-tests and
+/generate-script. The corpus is assets/ plus an optional synthetic spec of
+`--synthetic-kb` KB per user. Queries are unique per request, so the
+response cache never short-circuits the measurement.
+
+Reports throughput and p50/p95/p99 per endpoint, and per internal stage
+(retrieval, LLM, embedding, vector writes, ...) timed in-process. Pass
+`--json out.json` to keep the numbers for comparing runs.
+
+    python -m benchmarks.bench_load --workers 4 --users 16 --concurrency 8
+
+With `--workers N`, runs the shared-state deployment instead: a local Chroma
+server (`chroma run`) and `uvicorn --workers N` with STATE_BACKEND=sqlite, both
+as subprocesses. Sessions are spread over the workers by the kernel, so ingest
+polls and generate calls regularly land on a worker that did not run the job.
+Only endpoint numbers are reported in this mode; stages are timed in-process.
+`--base-url` drives an already running deployment (e.g. the compose `scaled`
+profile) the same way.
+"""
+import argparse
+import asyncio
+import functools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "assets")
+
+TEST_QUERIES = [
+    "Generate positive and negative test cases for the discount code feature",
+    "Write boundary tests for the cart quantity and total calculation",
+    "Cover shipping method selection and its effect on the order total",
+    "Test form validation errors on the checkout page",
+]
+
+
+def configure_environment(root: str, args):
+    """Points every setting at `root` and selects the fakes. Must run before `app` is imported."""
+    vector_dir = os.path.join(root, "vector_store_data")
+    cache_dir = os.path.join(root, "cache")
+    os.environ.update({
+        "UPLOAD_DIR": os.path.join(root, "uploads"),
+        "VECTOR_DB_PATH": vector_dir,
+        "MANIFEST_DIR": os.path.join(vector_dir, "manifests"),
+        "LEXICAL_INDEX_DIR": os.path.join(vector_dir, "lexical"),
+        "NUMPY_VECTOR_DIR": os.path.join(vector_dir, "numpy"),
+        "ARTIFACT_DIR": os.path.join(vector_dir, "artifacts"),
+        "CACHE_DIR": cache_dir,
+        "EMBEDDING_CACHE_PATH": os.path.join(cache_dir, "embeddings.sqlite3"),
+        "DOM_INDEX_DIR": os.path.join(cache_dir, "dom_index"),
+        "EMBEDDING_PROVIDER": "fake",
+        "EMBEDDING_CACHE_ENABLED": str(args.embedding_cache).lower(),
+        "FAKE_EMBEDDING_LATENCY_MS": str(args.embedding_latency_ms),
+        "FAKE_EMBEDDING_MS_PER_1K_TOKENS": str(args.embedding_ms_per_1k_tokens),
+        "LLM_PROVIDER": "fake",
+        "FAKE_LLM_LATENCY_MS": str(args.llm_latency_ms),
+        "FAKE_LLM_TOKENS_PER_SECOND": str(args.llm_tps),
+        "FAKE_LLM_REPLY_TOKENS": str(args.llm_reply_tokens),
+        "VECTOR_BACKEND": args.vector_backend,
+        "RETRIEVAL_MODE": args.retrieval_mode,
+        "PARSE_WORKERS": str(args.parse_workers),
+    })
+    if args.workers:
+        os.environ.update({
+            "STATE_BACKEND": "sqlite",
+            "STATE_DB_PATH": os.path.join(vector_dir, "state.sqlite3"),
+            "LOCK_DIR": os.path.join(vector_dir, "locks"),
+        })
+
+
+class StageRecorder:
+    """Collects in-process durations for named pipeline stages."""
+
+    def __init__(self):
+        self.durations = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self.durations[stage].append(seconds)
+
+    def wrap(self, owner, attr: str, stage: str):
+        original = getattr(owner, attr)
+
+        @functools.wraps(original)
+        def timed(*a, **kw):
+            start = time.perf_counter()
+            try:
+                return original(*a, **kw)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+
+        setattr(owner, attr, timed)
+
+    def wrap_async(self, owner, attr: str, stage: str):
+        original = getattr(owner, attr)
+
+        @functools.wraps(original)
+        async def timed(*a, **kw):
+            start = time.perf_counter()
+            try:
+                return await original(*a, **kw)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+
+        setattr(owner, attr, timed)
+
+    def wrap_iter(self, owner, attr: str, stage: str):
+        """Like wrap, for a function returning an iterator: records the time spent waiting on it."""
+        original = getattr(owner, attr)
+
+        @functools.wraps(original)
+        def timed(*a, **kw):
+            iterator = iter(original(*a, **kw))
+            waited = 0.0
+            try:
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                    finally:
+                        waited += time.perf_counter() - start
+                    yield item
+            finally:
+                self.record(stage, waited)
+
+        setattr(owner, attr, timed)
+
+
+def instrument(recorder: StageRecorder):
+    from app.services import ingestion, lexical_index, vector_store
+    from app.services.embedding_pipeline import EmbeddingPipeline
+    from app.services.fake_providers import FakeChatModel, FakeEmbeddings
+    from app.services.retrieval import HybridRetriever
+    from app.services.selenium_agent import SeleniumAgent
+
+    recorder.wrap(ingestion.IngestionService, "_process_documents", "ingest.pipeline")
+    recorder.wrap_iter(ingestion, "parse_documents", "ingest.parse")
+    recorder.wrap(EmbeddingPipeline, "run", "ingest.embed_and_store")
+    recorder.wrap(ingestion, "save_lexical_index", "ingest.lexical_save")
+    recorder.wrap(vector_store.ChromaSessionStore, "upsert", "vector.upsert")
+    recorder.wrap(vector_store.NumpySessionStore, "upsert", "vector.upsert")
+    recorder.wrap(vector_store.ChromaSessionStore, "search_many", "vector.search")
+    recorder.wrap(vector_store.NumpySessionStore, "search_many", "vector.search")
+    recorder.wrap(lexical_index.BM25Index, "search", "lexical.search")
+    recorder.wrap(FakeEmbeddings, "embed_documents", "embed.documents")
+    recorder.wrap(FakeEmbeddings, "embed_query", "embed.query")
+    recorder.wrap_async(FakeEmbeddings, "aembed_query", "embed.query")
+    recorder.wrap(HybridRetriever, "_get_relevant_documents", "retrieve")
+    recorder.wrap_async(HybridRetriever, "_aget_relevant_documents", "retrieve")
+    recorder.wrap(FakeChatModel, "_generate", "llm")
+    recorder.wrap_async(FakeChatModel, "_agenerate", "llm")
+    recorder.wrap(SeleniumAgent, "_prepare", "script.prepare")
+    recorder.wrap_async(SeleniumAgent, "_aprepare", "script.prepare")
+
+
+def synthetic_spec(user: int, kb: int) -> bytes:
+    words = (
+        "checkout discount coupon cart total shipping express standard payment card "
+        "error validation email required field quantity boundary invalid expired"
+    ).split()
+    lines, size, i = [f"# Synthetic specification {user}\n"], 0, 0
+    while size < kb * 1024:
+        sentence = " ".join(words[(i * 7 + j) % len(words)] for j in range(14))
+        line = f"Rule {user}.{i}: The {sentence}.\n" + ("\n" if i % 6 == 5 else "")
+        lines.append(line)
+        size += len(line)
+        i += 1
+    return "".join(lines).encode("utf-8")
+
+
+def load_corpus():
+    files = []
+    for folder in (ASSETS_DIR, os.path.join(ASSETS_DIR, "documentation")):
+        for name in sorted(os.listdir(folder)):
+            path = os.path.join(folder, name)
+            if os.path.isfile(path):
+                with open(path, "rb") as f:
+                    files.append((name, f.read()))
+    return files
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(app):
+    import uvicorn
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread, f"http://127.0.0.1:{port}"
+
+
+def _wait_for(url: str, proc, timeout: float, what: str, ready=lambda response: True, times: int = 1):
+    """Polls `url` until `ready(response)` holds for `times` responses in a row."""
+    import httpx
+
+    deadline = time.perf_counter() + timeout
+    streak = 0
+    while time.perf_counter() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{what} exited with code {proc.returncode}")
+        try:
+            response = httpx.get(url, timeout=1)
+            streak = streak + 1 if response.status_code < 500 and ready(response) else 0
+            if streak >= times:
+                return
+        except httpx.HTTPError:
+            streak = 0
+        time.sleep(0.1)
+    raise RuntimeError(f"{what} did not come up within {timeout:g}s")
+
+
+def start_deployment(root: str, args):
+    """A Chroma server and `uvicorn --workers N` sharing `root`, as subprocesses. Returns (processes, base_url)."""
+    processes = []
+    try:
+        if args.vector_backend == "chroma":
+            chroma_port = _free_port()
+            chroma = subprocess.Popen(
+                ["chroma", "run", "--path", os.path.join(root, "chroma"), "--host", "127.0.0.1", "--port", str(chroma_port)],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            processes.append(chroma)
+            _wait_for(f"http://127.0.0.1:{chroma_port}/api/v2/heartbeat", chroma, 60, "chroma server")
+            os.environ.update({"CHROMA_HOST": "127.0.0.1", "CHROMA_PORT": str(chroma_port)})
+
+        port = _free_port()
+        api = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+             "--workers", str(args.workers), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=dict(os.environ)
+        )
+        processes.append(api)
+        base_url = f"http://127.0.0.1:{port}"
+        # Any worker may answer; keep polling until a run of them report warm.
+        _wait_for(f"{base_url}/api/health", api, 180, "API server",
+                  ready=lambda response: response.json().get("warm"), times=args.workers * 3)
+        return processes, base_url
+    except Exception:
+        stop_processes(processes)
+        raise
+
+
+def stop_processes(processes):
+    for proc in reversed(processes):
+        proc.terminate()
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+class Timings:
+    def __init__(self):
+        self.calls = defaultdict(list)  # endpoint -> [(start, end, ok)]
+
+    async def timed(self, endpoint: str, coro):
+        start = time.perf_counter()
+        ok = False
+        try:
+            response = await coro
+            ok = response.status_code < 400
+            return response
+        finally:
+            self.calls[endpoint].append((start, time.perf_counter(), ok))
+
+
+async def user_session(client, user: int, args, corpus, timings: Timings):
+    prefix = "/api"
+    response = await timings.timed("POST /session/start", client.post(f"{prefix}/session/start"))
+    session_id = response.json()["session_id"]
+    headers = {"session-id": session_id}
+
+    files = list(corpus)
+    if args.synthetic_kb:
+        files.append((f"synthetic_spec_{user}.txt", synthetic_spec(user, args.synthetic_kb)))
+
+    ingest_start = time.perf_counter()
+    response = await timings.timed("POST /ingest", client.post(
+        f"{prefix}/ingest", headers=headers, files=[("files", (name, data)) for name, data in files]
+    ))
+    job_id = response.json()["job_id"]
+    while True:
+        status = (await timings.timed("GET /ingest/{job_id}", client.get(f"{prefix}/ingest/{job_id}"))).json()
+        if status["status"] in ("completed", "failed"):
+            break
+        await asyncio.sleep(args.poll_interval)
+    timings.calls["ingest job (end to end)"].append((ingest_start, time.perf_counter(), status["status"] == "completed"))
+
+    for i in range(args.requests):
+        query = f"{TEST_QUERIES[(user + i) % len(TEST_QUERIES)]} (user {user}, request {i})"
+        await timings.timed("POST /generate-tests", client.post(
+            f"{prefix}/generate-tests", json={"session_id": session_id, "query": query}
+        ))
+    for i in range(args.requests):
+        case = f"Verify that coupon SAVE15 applies a 15% discount (user {user}, case {i})"
+        await timings.timed("POST /generate-script", client.post(
+            f"{prefix}/generate-script", json={"session_id": session_id, "test_case": case}
+        ))
+
+
+async def drive(base_url: str, args, corpus, timings: Timings):
+    import httpx
+
+    gate = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        async def one(user):
+            async with gate:
+                await user_session(client, user, args, corpus, timings)
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(one(u) for u in range(args.users)), return_exceptions=True)
+        wall = time.perf_counter() - start
+
+    errors = [r for r in results if isinstance(r, Exception)]
+    for e in errors[:5]:
+        print(f"user session failed: {e!r}")
+    return wall, len(errors)
+
+
+def _summary(durations, ok=None, span=None):
+    ms = np.asarray(durations) * 1000
+    row = {
+        "count": len(durations),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+    if ok is not None:
+        row["errors"] = len(durations) - ok
+    if span:
+        row["throughput_rps"] = len(durations) / span
+    return row
+
+
+def report(timings: Timings, recorder: StageRecorder, wall: float):
+    endpoints = {}
+    for endpoint, calls in timings.calls.items():
+        span = max(end for _, end, _ in calls) - min(start for start, _, _ in calls)
+        endpoints[endpoint] = _summary(
+            [end - start for start, end, _ in calls], ok=sum(ok for *_, ok in calls), span=span
+        )
+    stages = {stage: _summary(durations) for stage, durations in recorder.durations.items() if durations}
+
+    print(f"\nwall time {wall:.2f}s\n")
+    print(f"{'endpoint':<28} {'count':>6} {'errors':>6} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, r in endpoints.items():
+        print(
+            f"{name:<28} {r['count']:>6} {r['errors']:>6} {r['throughput_rps']:>8.2f} "
+            f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f}"
+        )
+    print(f"\n{'stage':<28} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name in sorted(stages):
+        r = stages[name]
+        print(f"{name:<28} {r['count']:>6} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['max_ms']:>9.1f}")
+    return {"wall_s": wall, "endpoints": endpoints, "stages": stages}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=8, help="virtual users, one session each")
+    parser.add_argument("--concurrency", type=int, default=4, help="users running at the same time")
+    parser.add_argument("--requests", type=int, default=2, help="generate-tests and generate-script calls per user")
+    parser.add_argument("--synthetic-kb", type=int, default=0, help="extra synthetic spec per user, in KB")
+    parser.add_argument("--embedding-latency-ms", type=float, default=50.0)
+    parser.add_argument("--embedding-ms-per-1k-tokens", type=float, default=10.0)
+    parser.add_argument("--embedding-cache", action="store_true")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0, help="time to first token")
+    parser.add_argument("--llm-tps", type=float, default=100.0, help="output tokens per second, 0 for instant")
+    parser.add_argument("--llm-reply-tokens", type=int, default=120)
+    parser.add_argument("--vector-backend", choices=["chroma", "numpy"], default="chroma")
+    parser.add_argument("--retrieval-mode", choices=["hybrid", "dense", "lexical"], default="hybrid")
+    parser.add_argument("--parse-workers", type=int, default=2, help="loader processes, 0 to parse in-process")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="run uvicorn with N workers and shared state in subprocesses (0: one in-process server)")
+    parser.add_argument("--base-url", help="drive an already running deployment instead of starting one")
+    parser.add_argument("--poll-interval", type=float, default=0.1)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    recorder = StageRecorder()
+    corpus = load_corpus()
+    timings = Timings()
+    if args.base_url:
+        wall, failed_users = asyncio.run(drive(args.base_url.rstrip("/"), args, corpus, timings))
+    else:
+        if args.workers and args.vector_backend == "numpy":
+            parser.error("--workers needs the chroma backend; the numpy store is single-process")
+        with tempfile.TemporaryDirectory(prefix="qa-agent-bench-") as root:
+            configure_environment(root, args)
+            if args.workers:
+                processes, base_url = start_deployment(root, args)
+                try:
+                    wall, failed_users = asyncio.run(drive(base_url, args, corpus, timings))
+                finally:
+                    stop_processes(processes)
+            else:
+                from app.main import app
+
+                instrument(recorder)
+                server, thread, base_url = start_server(app)
+                try:
+                    wall, failed_users = asyncio.run(drive(base_url, args, corpus, timings))
+                finally:
+                    server.should_exit = True
+                    thread.join(timeout=10)
+
+    results = report(timings, recorder, wall)
+    results["failed_users"] = failed_users
+    results["config"] = vars(args)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+Startup benchmark: import cost of the app and time until it is ready.
+
+    cd backend
+    python -m benchmarks.bench_startup --runs 5 --top 25
+    python -m benchmarks.bench_startup --server --llm-provider fake
+
+Each run imports `app.main` in a fresh interpreter under `-X importtime`, with
+every data directory in a temp dir. Reports the median wall time of the
+import, the slowest modules by cumulative import time and self time summed
+per top-level package (what the lazy imports are meant to keep down).
+
+With `--server`, also starts uvicorn in a subprocess and polls /api/health:
+time to the first 200 (accepting traffic) and to `"warm": true` (providers,
+loaders and prompts loaded by the background warm-up).
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import defaultdict
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def environment(root: str, args) -> dict:
+    """Child environment with every setting pointed at `root`."""
+    vector_dir = os.path.join(root, "vector_store_data")
+    cache_dir = os.path.join(root, "cache")
+    env = dict(os.environ)
+    env.update({
+        "UPLOAD_DIR": os.path.join(root, "uploads"),
+        "VECTOR_DB_PATH": vector_dir,
+        "MANIFEST_DIR": os.path.join(vector_dir, "manifests"),
+        "LEXICAL_INDEX_DIR": os.path.join(vector_dir, "lexical"),
+        "NUMPY_VECTOR_DIR": os.path.join(vector_dir, "numpy"),
+        "ARTIFACT_DIR": os.path.join(vector_dir, "artifacts"),
+        "CACHE_DIR": cache_dir,
+        "EMBEDDING_CACHE_PATH": os.path.join(cache_dir, "embeddings.sqlite3"),
+        "DOM_INDEX_DIR": os.path.join(cache_dir, "dom_index"),
+        "EMBEDDING_PROVIDER": args.embedding_provider,
+        "LLM_PROVIDER": args.llm_provider,
+        "FAKE_EMBEDDING_LATENCY_MS": "0",
+        "FAKE_LLM_LATENCY_MS": "0",
+    })
+    return env
+
+
+def measure_import(env: dict, module: str):
+    """One fresh-interpreter import. Returns (wall seconds, [(self_us, cumulative_us, name, depth)])."""
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+
+    modules = []
+    for line in proc.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules.append((int(self_us), int(cumulative_us), name, len(indent) // 2))
+    return wall, modules
+
+
+def summarize_imports(runs):
+    """Median per-module times across runs."""
+    self_times, cumulative_times = defaultdict(list), defaultdict(list)
+    for _, modules in runs:
+        for self_us, cumulative_us, name, _ in modules:
+            self_times[name].append(self_us)
+            cumulative_times[name].append(cumulative_us)
+    per_module = {
+        name: {
+            "self_ms": statistics.median(self_times[name]) / 1000,
+            "cumulative_ms": statistics.median(cumulative_times[name]) / 1000,
+        }
+        for name in self_times
+    }
+    per_package = defaultdict(float)
+    for name, row in per_module.items():
+        per_package[name.split(".")[0]] += row["self_ms"]
+    return per_module, dict(per_package)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _health(url: str):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return json.loads(response.read())
+    except Exception:
+        return None
+
+
+def measure_server(env: dict, timeout: float, poll_interval: float):
+    """Seconds from process start to the first healthy response and to warm."""
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}/api/health"
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    healthy = warm = None
+    try:
+        while time.perf_counter() - start < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"server exited with code {proc.returncode}")
+            body = _health(url)
+            if body is not None:
+                elapsed = time.perf_counter() - start
+                if healthy is None:
+                    healthy = elapsed
+                if body.get("warm"):
+                    warm = elapsed
+                    break
+            time.sleep(poll_interval)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return healthy, warm
+
+
+def _fmt(seconds):
+    return "timeout" if seconds is None else f"{seconds * 1000:.0f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="app.main", help="module to import")
+    parser.add_argument("--runs", type=int, default=5, help="fresh-interpreter imports; medians are reported")
+    parser.add_argument("--top", type=int, default=20, help="slowest modules to list")
+    parser.add_argument("--embedding-provider", default="fake")
+    parser.add_argument("--llm-provider", default="fake")
+    parser.add_argument("--server", action="store_true", help="also time uvicorn to healthy and to warm")
+    parser.add_argument("--server-runs", type=int, default=3)
+    parser.add_argument("--poll-interval", type=float, default=0.02)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="qa-agent-startup-") as root:
+        env = environment(root, args)
+        # The first import compiles bytecode; keep it out of the numbers.
+        measure_import(env, args.module)
+        runs = [measure_import(env, args.module) for _ in range(args.runs)]
+        servers = [measure_server(env, args.timeout, args.poll_interval) for _ in range(args.server_runs)] if args.server else []
+
+    walls = [wall for wall, _ in runs]
+    per_module, per_package = summarize_imports(runs)
+    app_modules = {name: row for name, row in per_module.items() if name.split(".")[0] == "app"}
+
+    print(f"\nimport {args.module}: median {statistics.median(walls) * 1000:.0f} ms wall over {len(walls)} runs "
+          f"(min {min(walls) * 1000:.0f}, max {max(walls) * 1000:.0f}), {len(per_module)} modules\n")
+
+    print(f"{'module':<56} {'self ms':>9} {'cumul ms':>9}")
+    slowest = sorted(per_module.items(), key=lambda item: item[1]["cumulative_ms"], reverse=True)[:args.top]
+    for name, row in slowest:
+        print(f"{name:<56} {row['self_ms']:>9.1f} {row['cumulative_ms']:>9.1f}")
+
+    print(f"\n{'package (self time)':<56} {'ms':>9}")
+    for name, ms in sorted(per_package.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"{name:<56} {ms:>9.1f}")
+
+    print(f"\n{'app module':<56} {'self ms':>9} {'cumul ms':>9}")
+    for name, row in sorted(app_modules.items(), key=lambda item: item[1]["cumulative_ms"], reverse=True):
+        print(f"{name:<56} {row['self_ms']:>9.1f} {row['cumulative_ms']:>9.1f}")
+
+    results = {
+        "module": args.module,
+        "import_wall_ms": [wall * 1000 for wall in walls],
+        "modules": per_module,
+        "packages_self_ms": per_package,
+        "config": vars(args),
+    }
+    if servers:
+        print()
+        for i, (healthy, warm) in enumerate(servers, 1):
+            print(f"server run {i}: healthy after {_fmt(healthy)}, warm after {_fmt(warm)}")
+        results["server"] = [
+            {"healthy_ms": None if h is None else h * 1000, "warm_ms": None if w is None else w * 1000}
+            for h, w in servers
+        ]
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
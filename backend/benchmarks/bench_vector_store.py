@@ -0,0 +1,112 @@
+"""
+Latency / memory comparison of the per-session vector backends.
+
+    cd backend
+    python -m benchmarks.bench_vector_store --sizes 500 2000 10000 --dim 1536
+
+Each (backend, size) case runs in its own process so peak RSS is comparable.
+Vectors are random unit vectors; recall@k of the numpy backend is measured
+against exact brute force (it is < 1.0 only once the IVF index kicks in).
+"""
+import argparse
+import multiprocessing as mp
+import resource
+import tempfile
+import time
+
+import numpy as np
+
+
+def _percentile(values, pct):
+    return float(np.percentile(np.asarray(values) * 1000, pct))
+
+
+def run_case(backend_name, size, dim, queries, k, batch, ann_threshold, result_queue):
+    from app.core.config import settings
+    from app.services.vector_store import ChromaBackend, NumpyBackend
+
+    settings.NUMPY_ANN_THRESHOLD = ann_threshold
+    rng = np.random.default_rng(42)
+    vectors = rng.standard_normal((size, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    query_vectors = rng.standard_normal((queries, dim)).astype(np.float32)
+    query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = ChromaBackend(tmp) if backend_name == "chroma" else NumpyBackend(tmp)
+        store = backend.session("bench")
+
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        for offset in range(0, size, 500):
+            ids = [str(i) for i in range(offset, min(offset + 500, size))]
+            store.upsert(
+                ids=ids,
+                embeddings=vectors[offset:offset + len(ids)].tolist(),
+                documents=[f"chunk {i}" for i in ids],
+                metadatas=[{"chunk_id": i} for i in ids],
+            )
+        insert_s = time.perf_counter() - start
+
+        # Reopen so the first query pays the cold-load cost like a new request would.
+        store = backend.session("bench")
+        latencies, recalls = [], []
+        exact = np.argsort(-(query_vectors @ vectors.T), axis=1)[:, :k]
+        for qi, q in enumerate(query_vectors):
+            start = time.perf_counter()
+            hits = store.search(q.tolist(), k)
+            latencies.append(time.perf_counter() - start)
+            found = {int(doc.metadata["chunk_id"]) for doc, _ in hits}
+            recalls.append(len(found & set(exact[qi].tolist())) / k)
+
+        start = time.perf_counter()
+        for offset in range(0, queries, batch):
+            store.search_many(query_vectors[offset:offset + batch].tolist(), k)
+        batch_s = time.perf_counter() - start
+
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    result_queue.put({
+        "backend": backend_name,
+        "size": size,
+        "insert_s": insert_s,
+        "p50_ms": _percentile(latencies, 50),
+        "p95_ms": _percentile(latencies, 95),
+        "batch_qps": queries / batch_s,
+        "recall": float(np.mean(recalls)),
+        "peak_rss_mb": rss_after / 1024,
+        "rss_growth_mb": (rss_after - rss_before) / 1024,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", default=["chroma", "numpy"])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[500, 2000, 10000])
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--ann-threshold", type=int, default=20000)
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+    print(f"{'backend':<8} {'size':>7} {'insert s':>9} {'p50 ms':>8} {'p95 ms':>8} {'batch q/s':>10} {'recall':>7} {'peak MB':>8} {'+MB':>7}")
+    for size in args.sizes:
+        for backend in args.backends:
+            queue = ctx.Queue()
+            proc = ctx.Process(
+                target=run_case,
+                args=(backend, size, args.dim, args.queries, args.k, args.batch, args.ann_threshold, queue),
+            )
+            proc.start()
+            r = queue.get()
+            proc.join()
+            print(
+                f"{r['backend']:<8} {r['size']:>7} {r['insert_s']:>9.2f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} "
+                f"{r['batch_qps']:>10.0f} {r['recall']:>7.3f} {r['peak_rss_mb']:>8.0f} {r['rss_growth_mb']:>7.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
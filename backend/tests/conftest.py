@@ -0,0 +1,28 @@
+"""
+Every data directory points at a scratch dir and the providers at the fakes,
+before `app` is first imported. Run from backend/: python -m pytest -q
+"""
+import os
+import sys
+import tempfile
+
+ROOT = tempfile.mkdtemp(prefix="qa-agent-tests-")
+VECTOR_DIR = os.path.join(ROOT, "vector_store_data")
+CACHE_DIR = os.path.join(ROOT, "cache")
+
+os.environ.update({
+    "UPLOAD_DIR": os.path.join(ROOT, "uploads"),
+    "VECTOR_DB_PATH": VECTOR_DIR,
+    "MANIFEST_DIR": os.path.join(VECTOR_DIR, "manifests"),
+    "LEXICAL_INDEX_DIR": os.path.join(VECTOR_DIR, "lexical"),
+    "NUMPY_VECTOR_DIR": os.path.join(VECTOR_DIR, "numpy"),
+    "ARTIFACT_DIR": os.path.join(VECTOR_DIR, "artifacts"),
+    "STATE_DB_PATH": os.path.join(VECTOR_DIR, "state.sqlite3"),
+    "LOCK_DIR": os.path.join(VECTOR_DIR, "locks"),
+    "CACHE_DIR": CACHE_DIR,
+    "EMBEDDING_CACHE_PATH": os.path.join(CACHE_DIR, "embeddings.sqlite3"),
+    "DOM_INDEX_DIR": os.path.join(CACHE_DIR, "dom_index"),
+    "EMBEDDING_PROVIDER": "fake",
+    "LLM_PROVIDER": "fake",
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
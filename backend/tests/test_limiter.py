@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+from app.services.limiter import Overloaded, ProviderLimiter
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_free_slot_is_taken_and_given_back():
+    async def scenario():
+        limiter = ProviderLimiter(limit=2, max_waiting=1, wait_timeout=1)
+        release = await limiter.enter()
+        assert limiter.stats()["active"] == 1
+        release()
+        release()  # a second call is a no-op
+        assert limiter.stats()["active"] == 0
+
+    run(scenario())
+
+
+def test_full_queue_is_rejected_with_429():
+    async def scenario():
+        limiter = ProviderLimiter(limit=1, max_waiting=1, wait_timeout=5)
+        release = await limiter.enter()
+        queued = asyncio.ensure_future(limiter.enter())
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as e:
+            await limiter.enter()
+        assert e.value.status_code == 429
+        assert e.value.retry_after >= 1
+        release()
+        (await queued)()
+        stats = limiter.stats()
+        assert (stats["active"], stats["waiting"], stats["rejected"]) == (0, 0, 1)
+
+    run(scenario())
+
+
+def test_wait_timeout_gives_503_and_leaves_the_queue():
+    async def scenario():
+        limiter = ProviderLimiter(limit=1, max_waiting=4, wait_timeout=0.05)
+        release = await limiter.enter()
+        with pytest.raises(Overloaded) as e:
+            await limiter.enter()
+        assert e.value.status_code == 503
+        stats = limiter.stats()
+        assert (stats["active"], stats["waiting"], stats["timed_out"]) == (1, 0, 1)
+        release()
+        assert limiter.stats()["active"] == 0
+
+    run(scenario())
+
+
+def test_waiters_are_granted_in_order():
+    async def scenario():
+        limiter = ProviderLimiter(limit=1, max_waiting=4, wait_timeout=5)
+        release = await limiter.enter()
+        order = []
+
+        async def waiter(n):
+            done = await limiter.enter()
+            order.append(n)
+            done()
+
+        tasks = [asyncio.ensure_future(waiter(n)) for n in range(3)]
+        await asyncio.sleep(0)
+        release()
+        await asyncio.gather(*tasks)
+        assert order == [0, 1, 2]
+        assert limiter.stats()["active"] == 0
+
+    run(scenario())
+
+
+def test_cancel_while_queued_frees_the_place():
+    async def scenario():
+        limiter = ProviderLimiter(limit=1, max_waiting=4, wait_timeout=5)
+        release = await limiter.enter()
+        queued = asyncio.ensure_future(limiter.enter())
+        await asyncio.sleep(0)
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        assert limiter.stats()["waiting"] == 0
+        release()
+        assert limiter.stats()["active"] == 0
+
+    run(scenario())
+
+
+def test_cancel_after_grant_gives_the_slot_back():
+    async def scenario():
+        limiter = ProviderLimiter(limit=1, max_waiting=4, wait_timeout=5)
+        release = await limiter.enter()
+        queued = asyncio.ensure_future(limiter.enter())
+        await asyncio.sleep(0)
+        # The slot passes to the waiter, which is cancelled before it resumes.
+        release()
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        # Let the grant's wake-up callback run.
+        await asyncio.sleep(0)
+        assert limiter.stats()["active"] == 0
+        (await limiter.enter())()
+        assert limiter.stats()["active"] == 0
+
+    run(scenario())
+
+
+def test_thread_callers_share_the_slots():
+    limiter = ProviderLimiter(limit=1, max_waiting=1, wait_timeout=0.05)
+    release = limiter.enter_sync()
+    with pytest.raises(Overloaded) as e:
+        limiter.enter_sync()
+    assert e.value.status_code == 503
+    release()
+    with limiter.slot_sync():
+        assert limiter.stats()["active"] == 1
+    assert limiter.stats()["active"] == 0
@@ -0,0 +1,76 @@
+from app.services.dom_index import DomIndex
+from app.services.selector_validation import apply_repairs, parse_repairs, validate_script
+
+PAGE = """
+<html><body>
+  <form id="checkout">
+    <input id="promo-code" name="promo">
+    <button class="btn apply" id="apply-btn">Apply</button>
+    <button class="btn">Cancel</button>
+    <a href="/cart">Back to cart</a>
+  </form>
+</body></html>
+"""
+
+SCRIPT = '''from selenium.webdriver.common.by import By
+PROMO = "promo-code"
+driver.find_element(By.ID, PROMO).send_keys("SAVE10")
+driver.find_element(By.CSS_SELECTOR, "#apply-btn").click()
+driver.find_element(By.CLASS_NAME, "btn").click()
+driver.find_element(By.ID, "coupon").click()
+driver.find_element(By.XPATH, "//button[").click()
+driver.find_element(By.ID, f"step-{n}").click()
+driver.find_elements(By.CLASS_NAME, "btn")
+driver.find_element(By.LINK_TEXT, "Back to cart").click()
+'''
+
+
+def _index():
+    return DomIndex.build(PAGE)
+
+
+def test_every_locator_gets_a_status():
+    report = validate_script(SCRIPT, _index())
+    statuses = [(s["line"], s["status"]) for s in report["selectors"]]
+    assert statuses == [
+        (3, "unique"), (4, "unique"), (5, "ambiguous"), (6, "missing"),
+        (7, "invalid"), (8, "dynamic"), (9, "present"), (10, "unique"),
+    ]
+    assert report["selectors"][0]["value"] == "promo-code"
+    assert report["summary"]["ambiguous"] == report["summary"]["missing"] == report["summary"]["invalid"] == 1
+    assert report["valid"] is False
+    assert report["parse_error"] is None
+
+
+def test_valid_script():
+    report = validate_script('driver.find_element(By.NAME, "promo").clear()', _index())
+    assert report["valid"] is True
+    assert report["summary"]["unique"] == 1
+
+
+def test_unparsable_script_is_scanned_for_literal_locators():
+    report = validate_script('driver.find_element(By.ID, "apply-btn").click(\ndriver.find_element(By.ID, "nope"', _index())
+    assert report["parse_error"]
+    assert [s["status"] for s in report["selectors"]] == ["unique", "missing"]
+
+
+def test_repair_is_applied_only_when_it_resolves():
+    index = _index()
+    script = 'driver.find_element(By.ID, "coupon").click()\ndriver.find_element(By.CLASS_NAME, "btn").click()'
+    repairs = parse_repairs(
+        'Here you go: [{"ref": 0, "by": "ID", "value": "promo-code"}, '
+        '{"ref": 1, "by": "CSS_SELECTOR", "value": "button"}]'
+    )
+    repaired, applied = apply_repairs(script, repairs, index)
+    # "button" matches two elements, so the second locator stays as it was.
+    assert applied == 1
+    assert repaired == 'driver.find_element(By.ID, \'promo-code\').click()\ndriver.find_element(By.CLASS_NAME, "btn").click()'
+    assert [s["status"] for s in validate_script(repaired, index)["selectors"]] == ["unique", "ambiguous"]
+
+
+def test_repairs_leave_variable_locators_and_bad_replies_alone():
+    index = _index()
+    script = 'PROMO = "coupon"\ndriver.find_element(By.ID, PROMO).click()'
+    assert apply_repairs(script, [{"ref": 0, "by": "ID", "value": "promo-code"}], index) == (script, 0)
+    assert parse_repairs("no json here") == []
+    assert parse_repairs('[{"ref": "0", "by": "ID", "value": "x"}, {"ref": 1, "by": "BOGUS", "value": "x"}]') == []
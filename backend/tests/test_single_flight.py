@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.services.single_flight import SingleFlight
+
+
+def test_concurrent_thread_callers_share_one_run():
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    runs, results = [], []
+
+    def work():
+        runs.append(1)
+        started.set()
+        release.wait(5)
+        return "plan"
+
+    def call():
+        results.append(flights.do("k", work))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    deadline = time.monotonic() + 5
+    while flights.stats()["coalesced"] < 1 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert len(runs) == 1
+    assert sorted(results) == [("plan", False), ("plan", True)]
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_errors_reach_every_waiter_and_are_not_kept():
+    async def scenario():
+        flights = SingleFlight()
+        gate = asyncio.Event()
+        runs = []
+
+        async def work():
+            runs.append(1)
+            await gate.wait()
+            raise RuntimeError("model down")
+
+        first = asyncio.ensure_future(flights.ado("k", work))
+        second = asyncio.ensure_future(flights.ado("k", work))
+        await asyncio.sleep(0)
+        gate.set()
+        for waiter in (first, second):
+            with pytest.raises(RuntimeError, match="model down"):
+                await waiter
+        assert len(runs) == 1
+
+        # A failed flight is gone: the next call runs again.
+        async def ok():
+            return "script"
+
+        assert await flights.ado("k", ok) == ("script", False)
+
+    asyncio.run(scenario())
+
+
+def test_one_waiter_leaving_does_not_cancel_the_others():
+    async def scenario():
+        flights = SingleFlight()
+        gate = asyncio.Event()
+
+        async def work():
+            await gate.wait()
+            return "plan"
+
+        leader = asyncio.ensure_future(flights.ado("k", work))
+        follower = asyncio.ensure_future(flights.ado("k", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        gate.set()
+        assert await follower == ("plan", True)
+
+    asyncio.run(scenario())
+
+
+def test_shared_run_is_cancelled_for_all_when_the_last_waiter_leaves():
+    async def scenario():
+        flights = SingleFlight()
+        cancelled = asyncio.Event()
+
+        async def work():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        waiters = [asyncio.ensure_future(flights.ado("k", work)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for waiter in waiters:
+            waiter.cancel()
+        for waiter in waiters:
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+        await asyncio.wait_for(cancelled.wait(), 1)
+        assert flights.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_run_fails_waiters_that_remain():
+    async def scenario():
+        flights = SingleFlight()
+
+        async def work():
+            raise asyncio.CancelledError()
+
+        first = asyncio.ensure_future(flights.ado("k", work))
+        second = asyncio.ensure_future(flights.ado("k", work))
+        for waiter in (first, second):
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+        assert flights.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
@@ -9,6 +9,28 @@ def clean_markdown_output(text):
     text = re.sub(r"\n```$", "", text.strip())
     return text
 
+def render_selector_report(report):
+    """Locators of a generated script as checked against the uploaded page."""
+    if not report:
+        return
+    summary = report["summary"]
+    caption = (
+        f"Selectors: {summary['unique']} unique, {summary['present']} found, "
+        f"{summary['ambiguous']} ambiguous, {summary['missing']} missing, {summary['invalid']} invalid"
+    )
+    if report.get("repaired"):
+        caption += f" · {report['repaired']} repaired"
+    failing = [s for s in report["selectors"] if s["status"] in ("missing", "ambiguous", "invalid")]
+    if not failing:
+        st.success(caption)
+        return
+    st.warning(caption)
+    st.markdown("\n".join(
+        f"- Line {s['line']}: `By.{s['by']}` `{s['value']}` is {s['status']}"
+        + (f" ({s['matches']} matches)" if s["status"] == "ambiguous" else "")
+        for s in failing
+    ))
+
 st.set_page_config(
     page_title="Autonomous QA Agent",
     page_icon="🧬",
@@ -38,6 +60,9 @@ if "session_ready" not in st.session_state:
     if st.session_state.api.start_session():
         st.session_state.session_ready = True
         st.session_state.session_id = st.session_state.api.session_id
+        # A session started on a project can plan right away.
+        if st.session_state.api.project:
+            st.session_state.knowledge_base_built = True
     else:
         st.session_state.session_ready = False
 
@@ -48,6 +73,8 @@ with st.sidebar:
     if st.session_state.session_ready:
         st.success("System Operational")
         st.caption(f"Session: `{st.session_state.session_id[:8]}...`")
+        if st.session_state.api.project:
+            st.caption(f"Project: `{st.session_state.api.project}`")
     else:
         st.error("Backend Offline")
         st.warning("Please ensure the API server is running.")
@@ -78,6 +105,27 @@ tab_ingest, tab_plan, tab_code = st.tabs([
 with tab_ingest:
     st.header("Upload Project Assets")
     st.markdown("To generate accurate tests, the agent needs to understand your project requirements and HTML structure.")
+
+    projects = st.session_state.api.list_projects()
+    if projects:
+        options = [None] + [p["name"] for p in projects]
+        current = st.session_state.api.project
+        choice = st.selectbox(
+            "Project knowledge base",
+            options,
+            index=options.index(current) if current in options else 0,
+            format_func=lambda name: "None (this session's uploads only)" if name is None else name,
+            help="Shared documents ingested once per project. Files you upload below are layered on top and replace project files of the same name.",
+        )
+        if choice != current:
+            attached = st.session_state.api.attach_project(choice)
+            if attached["success"]:
+                st.session_state.knowledge_base_built = choice is not None or st.session_state.get("own_uploads", False)
+                for key in ("last_plan", "last_script", "last_script_report", "batch_cases"):
+                    st.session_state.pop(key, None)
+                st.rerun()
+            else:
+                st.error(f"Error: {attached['error']}")
     
     col1, col2 = st.columns([2, 1])
     with col1:
@@ -91,14 +139,44 @@ with tab_ingest:
         st.info("**Tip:** Ensure you upload `checkout.html` and at least one requirement document (e.g., `product_specs.md`).")
 
     if uploaded_files and st.button("Build Knowledge Base", type="primary"):
-        with st.spinner("Processing documents & vectorizing content..."):
+        with st.spinner("Uploading documents..."):
             result = st.session_state.api.upload_documents(uploaded_files)
-            
-            if result["success"]:
-                st.success(f"Success! {result['data']['message']}")
-                st.session_state.knowledge_base_built = True
-            else:
-                st.error(f"Error: {result['error']}")
+
+        if result["success"]:
+            progress_bar = st.progress(0.0, text="Queued for ingestion...")
+
+            def render_progress(job):
+                progress = job["progress"]
+                files_total = max(progress["files_total"], 1)
+                chunks_total = max(progress["chunks_produced"], 1)
+                # Parsing is the first half of the bar, storing chunks the second.
+                fraction = 0.5 * progress["files_parsed"] / files_total
+                if progress["chunks_produced"]:
+                    # Unchanged chunks from a re-upload are already stored.
+                    done = progress["chunks_stored"] + progress.get("chunks_unchanged", 0)
+                    fraction += 0.5 * done / chunks_total
+                progress_bar.progress(
+                    min(fraction, 1.0),
+                    text=(
+                        f"Parsed {progress['files_parsed']}/{progress['files_total']} files · "
+                        f"{progress['chunks_produced']} chunks · "
+                        f"{progress.get('chunks_unchanged', 0)} unchanged · "
+                        f"{progress['chunks_embedded']} embedded · "
+                        f"{progress['chunks_stored']} stored"
+                    )
+                )
+
+            result = st.session_state.api.wait_for_ingestion(result["data"]["job_id"], on_progress=render_progress)
+
+        if result["success"]:
+            st.success(f"Success! {result['data']['message']}")
+            st.session_state.knowledge_base_built = True
+            st.session_state.own_uploads = True
+            # Results from the previous knowledge base no longer apply.
+            for key in ("last_plan", "last_script", "last_script_report", "batch_cases"):
+                st.session_state.pop(key, None)
+        else:
+            st.error(f"Error: {result['error']}")
 
 with tab_plan:
     st.header("Generate Test Plan")
@@ -116,18 +194,27 @@ with tab_plan:
         )
         
         if st.button("Generate Test Cases", type="primary"):
-            with st.spinner("Analyzing requirements..."):
-                result = st.session_state.api.generate_test_plan(user_query)
-                
-                if result["success"]:
-                    st.markdown("### Generated Test Plan")
-                    
-                    clean_table = clean_markdown_output(result["data"])
-                    st.markdown(clean_table)
-                    
-                    st.session_state.last_plan = clean_table
-                else:
-                    st.error(f"Error generating plan: {result['error']}")
+            st.markdown("### Generated Test Plan")
+            plan_placeholder = st.empty()
+            plan_placeholder.info("Analyzing requirements...")
+
+            plan_text, error = "", None
+            # Replayed from the client's cache when this objective was already planned.
+            for event, data in st.session_state.api.stream_test_plan(user_query):
+                if event == "token":
+                    plan_text += data["text"]
+                    plan_placeholder.markdown(clean_markdown_output(plan_text))
+                elif event == "error":
+                    error = data.get("detail")
+
+            if error:
+                st.error(f"Error generating plan: {error}")
+            else:
+                st.session_state.last_plan = clean_markdown_output(plan_text)
+        elif st.session_state.get("last_plan"):
+            # Reruns (widget changes, tab switches) show the last plan without a backend call.
+            st.markdown("### Generated Test Plan")
+            st.markdown(st.session_state.last_plan)
 
 with tab_code:
     st.header("Generate Automation Script")
@@ -136,7 +223,17 @@ with tab_code:
          st.warning("Please build the Knowledge Base in Tab 1 first.")
     else:
         st.markdown("Paste a specific test scenario to convert it into Python Selenium code.")
+
+        pages = st.session_state.api.list_pages()
+        target_page = None
+        if len(pages) > 1:
+            target_page = st.selectbox("Target page", pages, help="The uploaded HTML page the script drives.")
         
+        repair_selectors = st.checkbox(
+            "Repair failing selectors",
+            help="Send selectors that match nothing or several elements back to the model once."
+        )
+
         test_case_input = st.text_area(
             "Test Scenario",
             placeholder="e.g., Verify that entering 'SAVE15' reduces the total price by 15%.",
@@ -147,13 +244,76 @@ with tab_code:
             if not test_case_input:
                 st.error("Please provide a test scenario.")
             else:
-                with st.spinner("Writing code (Selectors, Logic, Assertions)..."):
-                    result = st.session_state.api.generate_automation_script(test_case_input)
-                    
-                    if result["success"]:
-                        st.subheader("Python Selenium Script")
-                        st.code(result["data"], language="python")
-                        st.caption("Copy this code into a .py file to run it.")
+                st.subheader("Python Selenium Script")
+                code_placeholder = st.empty()
+                code_placeholder.info("Writing code (Selectors, Logic, Assertions)...")
+
+                script_text, error, report = "", None, None
+                for event, data in st.session_state.api.stream_automation_script(test_case_input, target_page, repair_selectors):
+                    if event == "token":
+                        script_text += data["text"]
+                        code_placeholder.code(clean_markdown_output(script_text), language="python")
+                    elif event == "done":
+                        report = data.get("selector_report")
+                        if data.get("script"):
+                            # Selector repair rewrote some locators after the stream.
+                            script_text = data["script"]
+                            code_placeholder.code(clean_markdown_output(script_text), language="python")
+                    elif event == "error":
+                        error = data.get("detail")
+
+                if error:
+                    st.error(f"Generation failed: {error}")
+                else:
+                    st.session_state.last_script = clean_markdown_output(script_text)
+                    st.session_state.last_script_report = report
+                    render_selector_report(report)
+                    st.caption("Copy this code into a .py file to run it.")
+        elif st.session_state.get("last_script"):
+            st.subheader("Python Selenium Script")
+            st.code(st.session_state.last_script, language="python")
+            render_selector_report(st.session_state.get("last_script_report"))
+            st.caption("Copy this code into a .py file to run it.")
+
+        if st.session_state.get("last_plan"):
+            st.markdown("---")
+            st.markdown("#### Whole Test Plan")
+            st.markdown("Generate a script for every row of the plan from Tab 2.")
+
+            concurrency = st.slider("Parallel generations", min_value=1, max_value=8, value=4)
+
+            def render_batch_case(data):
+                case = data["case"]
+                title = case.get("id") or f"Case {data['index'] + 1}"
+                with st.expander(f"{title}: {case.get('scenario', '')[:80]}"):
+                    if data["status"] == "ok":
+                        st.code(clean_markdown_output(data["script"]), language="python")
+                        render_selector_report(data.get("selector_report"))
                     else:
-                        st.error(f"Generation failed: {result['error']}")
+                        st.error(data["error"])
+
+            if st.button("Write Scripts For Entire Plan"):
+                batch_progress = st.progress(0.0, text="Parsing test plan...")
+                total, finished, failed = 0, 0, 0
+                st.session_state.batch_cases = []
+
+                for event, data in st.session_state.api.stream_batch_scripts(st.session_state.last_plan, concurrency, target_page, repair_selectors):
+                    if event == "start":
+                        total = data["total"]
+                    elif event == "case":
+                        finished += 1
+                        if data["status"] != "ok":
+                            failed += 1
+                        st.session_state.batch_cases.append(data)
+                        render_batch_case(data)
+                    elif event == "done":
+                        batch_progress.progress(1.0, text=f"Done: {data['succeeded']} scripts, {data['failed']} failed.")
+                    elif event == "error":
+                        st.error(f"Batch failed: {data.get('detail')}")
+
+                    if event == "case" and total:
+                        batch_progress.progress(finished / total, text=f"{finished}/{total} scripts written ({failed} failed)...")
+            else:
+                for data in st.session_state.get("batch_cases", []):
+                    render_batch_case(data)
 
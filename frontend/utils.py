@@ -1,75 +1,375 @@
 import requests
+import gzip
+import json
 import os
+import random
 import time
+from requests.adapters import HTTPAdapter
 
 BASE_API_URL = os.getenv("API_URL", "http://127.0.0.1:8000/api")
 
+# (connect, read) seconds per endpoint. Generation allows for the backend's
+# provider queue wait plus its own LLM timeout; for streams the read timeout
+# is the longest gap between two events.
+TIMEOUTS = {
+    "health": (2, 2),
+    "session": (3, 5),
+    "ingest": (5, 120),
+    "status": (3, 5),
+    "files": (3, 5),
+    "generate": (5, 180),
+    "stream": (5, 180),
+}
+
+RETRY_ATTEMPTS = 3
+RETRY_BASE_SECONDS = 0.5
+RETRY_CAP_SECONDS = 8.0
+# Rejected by the backend's provider limiter before any work started, so safe to resend.
+RETRY_STATUSES = (429, 503)
+# Only idempotent reads are also retried on gateway errors and dropped connections.
+IDEMPOTENT_RETRY_STATUSES = (429, 502, 503, 504)
+
+# The backend answers some generation failures with a 200 whose text starts like this; never cached.
+FAILED_RESULT_PREFIXES = ("Error generating test cases", "# Error generating script")
+
+# Upload parts smaller than this, or that do not shrink by a tenth, go uncompressed.
+GZIP_MIN_BYTES = 1024
+
+
+def _build_http():
+    """One keep-alive connection pool shared by every browser session of this Streamlit process."""
+    http = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=0)
+    http.mount("http://", adapter)
+    http.mount("https://", adapter)
+    return http
+
+
+_http = _build_http()
+
+
+def _retry_delay(attempt, resp=None):
+    """Full jitter backoff, never shorter than the server's Retry-After."""
+    delay = random.uniform(0, min(RETRY_CAP_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt))
+    retry_after = resp.headers.get("Retry-After") if resp is not None else None
+    if retry_after and retry_after.isdigit():
+        delay = min(RETRY_CAP_SECONDS, int(retry_after)) + random.uniform(0, RETRY_BASE_SECONDS)
+    return delay
+
+
+def _error_detail(resp):
+    try:
+        return resp.json().get("detail", f"Error {resp.status_code}")
+    except ValueError:
+        return resp.text or f"Error {resp.status_code}"
+
+
+def _gzip_part(f):
+    data = f.getvalue()
+    if len(data) >= GZIP_MIN_BYTES:
+        packed = gzip.compress(data, compresslevel=6)
+        if len(packed) < len(data) * 0.9:
+            return (f.name, packed, f.type, {"Content-Encoding": "gzip"})
+    return (f.name, data, f.type)
+
+
 class QA_API_Client:
     def __init__(self):
         self.base_url = BASE_API_URL
         self.session_id = None
+        # Project knowledge base the session reads under its own uploads.
+        self.project = None
+        # Finished plans and scripts, so Streamlit reruns replay them instead of calling the backend.
+        # Keyed by session and knowledge base version; the client itself lives in st.session_state.
+        self.kb_version = 0
+        self._results = {}
+        self._pages = None
+        self._projects = None
+
+    def _request(self, method, path, endpoint, idempotent=False, **kwargs):
+        """
+        Sends one request on the shared pool with the endpoint's timeout.
+        Limiter rejections (429/503) are retried for every call; idempotent
+        reads are also retried on gateway errors and connection failures.
+        """
+        kwargs.setdefault("timeout", TIMEOUTS[endpoint])
+        statuses = IDEMPOTENT_RETRY_STATUSES if idempotent else RETRY_STATUSES
+        for attempt in range(RETRY_ATTEMPTS):
+            last = attempt == RETRY_ATTEMPTS - 1
+            try:
+                resp = _http.request(method, f"{self.base_url}{path}", **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if not idempotent or last:
+                    raise
+                time.sleep(_retry_delay(attempt))
+                continue
+            if resp.status_code not in statuses or last:
+                return resp
+            delay = _retry_delay(attempt, resp)
+            resp.close()
+            time.sleep(delay)
+
+    def _result_key(self, kind, *inputs):
+        normalized = tuple(" ".join(i.split()) if isinstance(i, str) else i for i in inputs)
+        return (self.session_id, self.kb_version, kind) + normalized
+
+    def cached_result(self, kind, *inputs):
+        """A plan, script or batch already generated for these inputs against the current knowledge base."""
+        return self._results.get(self._result_key(kind, *inputs))
+
+    def remember_result(self, kind, value, *inputs):
+        text = value[0] if isinstance(value, tuple) else None
+        if isinstance(text, str) and text.startswith(FAILED_RESULT_PREFIXES):
+            return
+        self._results[self._result_key(kind, *inputs)] = value
+
+    def _knowledge_base_changed(self):
+        self.kb_version += 1
+        self._results.clear()
+        self._pages = None
+        self._projects = None
 
     def health_check(self):
         try:
-            resp = requests.get(f"{self.base_url}/health", timeout=2)
+            resp = self._request("GET", "/health", "health", idempotent=True)
             return resp.status_code == 200
         except Exception:
             return False
 
-    def start_session(self):
+    def start_session(self, project=None):
+        """Starts a session on `project`, or on the backend's default project when None."""
         try:
-            resp = requests.post(f"{self.base_url}/session/start", timeout=5)
+            payload = {"project": project} if project else None
+            resp = self._request("POST", "/session/start", "session", json=payload)
             if resp.status_code == 200:
-                self.session_id = resp.json().get("session_id")
+                body = resp.json()
+                self.session_id = body.get("session_id")
+                self.project = body.get("project")
+                self._knowledge_base_changed()
                 return True
             return False
         except Exception:
             return False
 
+    def list_projects(self):
+        """Project knowledge bases on the backend. Cached until the next ingest or session change."""
+        if self._projects is not None:
+            return self._projects
+        try:
+            resp = self._request("GET", "/projects", "files", idempotent=True)
+            if resp.status_code == 200:
+                self._projects = resp.json()["projects"]
+                return self._projects
+            return []
+        except Exception:
+            return []
+
+    def attach_project(self, project):
+        """Layers the session over a project knowledge base; None detaches it."""
+        if not self.session_id:
+            return {"success": False, "error": "Session not active. Please refresh."}
+        try:
+            resp = self._request(
+                "PUT", f"/session/{self.session_id}/project", "session", idempotent=True, json={"project": project}
+            )
+            if resp.status_code == 200:
+                self.project = project
+                self._knowledge_base_changed()
+                return {"success": True}
+            return {"success": False, "error": _error_detail(resp)}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
     def upload_documents(self, files):
         if not self.session_id:
             return {"success": False, "error": "Session not active. Please refresh."}
 
-        url = f"{self.base_url}/ingest"
-        
-        headers = {"session-id": self.session_id} 
-        
-        files_payload = [
-            ("files", (f.name, f.getvalue(), f.type)) for f in files
-        ]
+        headers = {"session-id": self.session_id}
+
+        files_payload = [("files", _gzip_part(f)) for f in files]
 
         try:
-            resp = requests.post(url, headers=headers, files=files_payload)
+            resp = self._request("POST", "/ingest", "ingest", headers=headers, files=files_payload)
+            if resp.status_code in (200, 202):
+                self._knowledge_base_changed()
+                return {"success": True, "data": resp.json()}
+            return {"success": False, "error": _error_detail(resp)}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    def get_ingestion_status(self, job_id):
+        try:
+            resp = self._request("GET", f"/ingest/{job_id}", "status", idempotent=True)
             if resp.status_code == 200:
                 return {"success": True, "data": resp.json()}
-            return {"success": False, "error": resp.json().get("detail", f"Error {resp.status_code}")}
+            return {"success": False, "error": _error_detail(resp)}
         except Exception as e:
             return {"success": False, "error": str(e)}
 
+    def wait_for_ingestion(self, job_id, on_progress=None, poll_interval=1.0, timeout=900):
+        deadline = time.time() + timeout
+        try:
+            while time.time() < deadline:
+                status = self.get_ingestion_status(job_id)
+                if not status["success"]:
+                    return status
+
+                job = status["data"]
+                if on_progress:
+                    on_progress(job)
+                if job["status"] == "completed":
+                    return {"success": True, "data": job["result"]}
+                if job["status"] == "failed":
+                    return {"success": False, "error": job.get("error") or "Ingestion failed."}
+                time.sleep(poll_interval)
+
+            return {"success": False, "error": "Timed out waiting for ingestion to finish."}
+        finally:
+            # Pages and answers computed while the job ran may predate its chunks.
+            self._knowledge_base_changed()
+
+    def list_pages(self):
+        """HTML pages the session can target (its own first, then its project's). Cached until the next ingest."""
+        if not self.session_id:
+            return []
+        if self._pages is not None:
+            return self._pages
+        try:
+            resp = self._request("GET", f"/session/{self.session_id}/files", "files", idempotent=True)
+            if resp.status_code != 200:
+                return []
+            pages = [f for f in resp.json()["files"] if f.get("type") == "html" and f.get("status") != "failed"]
+            pages.sort(key=lambda f: f.get("ingested_at") or 0, reverse=True)
+            self._pages = [f["filename"] for f in pages]
+            return self._pages
+        except Exception:
+            return []
+
     def generate_test_plan(self, query):
         if not self.session_id:
             return {"success": False, "error": "Session lost."}
 
+        cached = self.cached_result("plan", query)
+        if cached is not None:
+            return {"success": True, "data": cached[0]}
+
         try:
             payload = {"query": query, "session_id": self.session_id}
-            resp = requests.post(f"{self.base_url}/generate-tests", json=payload)
-            
+            resp = self._request("POST", "/generate-tests", "generate", json=payload)
+
             if resp.status_code == 200:
-                return {"success": True, "data": resp.json().get("result")}
-            return {"success": False, "error": resp.text}
+                plan = resp.json().get("result")
+                self.remember_result("plan", (plan, {}), query)
+                return {"success": True, "data": plan}
+            return {"success": False, "error": _error_detail(resp)}
         except Exception as e:
             return {"success": False, "error": str(e)}
 
-    def generate_automation_script(self, test_case):
+    def generate_automation_script(self, test_case, target_page=None, repair=False):
         if not self.session_id:
             return {"success": False, "error": "Session lost."}
 
+        cached = self.cached_result("script", test_case, target_page, repair)
+        if cached is not None:
+            return {"success": True, "data": cached[0], "selector_report": cached[1].get("selector_report")}
+
         try:
-            payload = {"test_case": test_case, "session_id": self.session_id}
-            resp = requests.post(f"{self.base_url}/generate-script", json=payload)
-            
+            payload = {"test_case": test_case, "session_id": self.session_id, "target_page": target_page, "repair": repair}
+            resp = self._request("POST", "/generate-script", "generate", json=payload)
+
             if resp.status_code == 200:
-                return {"success": True, "data": resp.json().get("script")}
-            return {"success": False, "error": resp.text}
+                body = resp.json()
+                self.remember_result("script", (body["script"], body), test_case, target_page, repair)
+                return {"success": True, "data": body["script"], "selector_report": body.get("selector_report")}
+            return {"success": False, "error": _error_detail(resp)}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    def _stream_events(self, path, payload):
+        """Yields (event, data) pairs from a server-sent events endpoint."""
+        resp = self._request("POST", path, "stream", json=payload, stream=True)
+        with resp:
+            if resp.status_code != 200:
+                yield "error", {"detail": _error_detail(resp)}
+                return
+
+            event, data_lines = "message", []
+            for line in resp.iter_lines(decode_unicode=True):
+                if line is None:
+                    continue
+                if line == "":
+                    if data_lines:
+                        yield event, json.loads("\n".join(data_lines))
+                    event, data_lines = "message", []
+                elif line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data_lines.append(line[len("data:"):].strip())
+
+    def _stream_text(self, kind, path, payload, *inputs):
+        """
+        Streams token events, remembering the final text and `done` event; a
+        cached result replays as one token. `done` may carry a rewritten
+        "script" (selector repair) that replaces the streamed text.
+        """
+        cached = self.cached_result(kind, *inputs)
+        if cached is not None:
+            text, done = cached
+            yield "token", {"text": text}
+            yield "done", dict(done, cached=True)
+            return
+
+        text = ""
+        for event, data in self._stream_events(path, payload):
+            if event == "token":
+                text += data["text"]
+            elif event == "done":
+                self.remember_result(kind, (data.get("script", text), data), *inputs)
+            yield event, data
+
+    def stream_test_plan(self, query):
+        if not self.session_id:
+            yield "error", {"detail": "Session lost."}
+            return
+
+        try:
+            payload = {"query": query, "session_id": self.session_id}
+            yield from self._stream_text("plan", "/generate-tests/stream", payload, query)
+        except Exception as e:
+            yield "error", {"detail": str(e)}
+
+    def stream_automation_script(self, test_case, target_page=None, repair=False):
+        if not self.session_id:
+            yield "error", {"detail": "Session lost."}
+            return
+
+        try:
+            payload = {"test_case": test_case, "session_id": self.session_id, "target_page": target_page, "repair": repair}
+            yield from self._stream_text("script", "/generate-script/stream", payload, test_case, target_page, repair)
+        except Exception as e:
+            yield "error", {"detail": str(e)}
+
+    def stream_batch_scripts(self, plan, concurrency=4, target_page=None, repair=False):
+        if not self.session_id:
+            yield "error", {"detail": "Session lost."}
+            return
+
+        cached = self.cached_result("batch", plan, target_page, repair)
+        if cached is not None:
+            yield from cached
+            return
+
+        try:
+            payload = {
+                "plan": plan, "session_id": self.session_id, "concurrency": concurrency,
+                "target_page": target_page, "repair": repair,
+            }
+            events = []
+            for event, data in self._stream_events("/generate-scripts/batch", payload):
+                events.append((event, data))
+                # Failed cases are kept out of the cache so pressing the button again retries them.
+                if event == "done" and not data.get("failed"):
+                    self.remember_result("batch", events, plan, target_page, repair)
+                yield event, data
         except Exception as e:
-            return {"success": False, "error": str(e)}
\ No newline at end of file
+            yield "error", {"detail": str(e)}